@@ -0,0 +1,30 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncGenerator, Coroutine, Generator, TypeVar
+
+T = TypeVar("T")
+
+_EXHAUSTED = object()
+
+
+async def iterate_in_thread(generator: Generator[T, None, None]) -> AsyncGenerator[T, None]:
+    """Iterates a blocking generator in a worker thread without blocking the event loop"""
+    try:
+        while True:
+            item = await asyncio.to_thread(next, generator, _EXHAUSTED)
+            if item is _EXHAUSTED:
+                break
+            yield item
+    finally:
+        generator.close()
+
+
+def run_sync(coroutine: Coroutine[None, None, T]) -> T:
+    """Runs a coroutine to completion, also from code that already runs inside an event loop like a notebook"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(contextvars.copy_context().run, asyncio.run, coroutine).result()
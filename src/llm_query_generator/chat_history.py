@@ -1,6 +1,7 @@
 from copy import deepcopy
 from dataclasses import dataclass
 from enum import Enum
+from typing import Optional
 
 
 class MessageType(str, Enum):
@@ -27,6 +28,8 @@ class ChatHistory:
     def __init__(self, window: int = 10):
         self.history: list[Message] = []
         self.window = window
+        # database the last question of the conversation was answered from
+        self.last_database: Optional[str] = None
 
     def __getitem__(self, index: int) -> Message:
         """Returns a message from the chat history"""
@@ -40,6 +43,7 @@ class ChatHistory:
         clone = ChatHistory(self.window)
         for message in self.history:
             clone.add(deepcopy(message))
+        clone.last_database = self.last_database
         return clone
 
     def add(self, message: Message):
@@ -1,2 +1,11 @@
-from .base import DataBaseAdapter
+from .async_neo4j import AsyncNeo4jAdapter
+from .base import DataBaseAdapter, QueryCancelledError
+from .cost_guard import CostGuard, QueryCostError
+from .cypher_checker import CypherChecker, CypherSchemaError
+from .cypher_repair import CypherRepairer
+from .driver_registry import DRIVER_REGISTRY, DriverConfig, DriverRegistry
+from .few_shot_store import FewShotExample, FewShotStore
 from .neo4j import Neo4jAdapter
+from .plan import QueryPlan
+from .result import QueryResult, ResultStream, RowBudget
+from .result_cache import CacheStats, ResultCache, normalize_cypher
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+from typing import Any, Optional
+
+from neo4j import READ_ACCESS, AsyncDriver, Query, unit_of_work
+
+from .base import DataBaseAdapter
+from .driver_registry import async_warm_up
+from .neo4j import (
+    FINGERPRINT_QUERY,
+    SCHEMA_QUERY,
+    VALUE_SAMPLE_QUERY,
+    Neo4jAdapter,
+    build_fingerprint,
+    build_structured_schema,
+)
+from .plan import QueryPlan
+from .result import QueryResult, RowBudget
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncNeo4jAdapter(Neo4jAdapter):
+    """Neo4j adapter that runs queries on the neo4j async driver.
+
+    The synchronous interface of `Neo4jAdapter` stays available after `connect()`,
+    the async interface needs `aconnect()` and must be used from a single event loop.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.async_driver: Optional[AsyncDriver] = None
+        self._schema_lock: Optional[asyncio.Lock] = None
+        self._schema_refresh: Optional[asyncio.Task] = None
+
+    async def aconnect(self) -> DataBaseAdapter:
+        self.async_driver = self.driver_registry.acquire(
+            self.uri, (self.user, self.password), self.driver_config, asynchronous=True
+        )
+        try:
+            await self.async_driver.verify_connectivity()
+            if self.driver_config is not None and self.driver_config.warmup_connections > 0:
+                await async_warm_up(self.async_driver, self.driver_config.warmup_connections)
+        except Exception:
+            await self.adisconnect()
+            raise
+        self.is_connected = True
+        return self
+
+    async def adisconnect(self) -> DataBaseAdapter:
+        if self.async_driver is not None:
+            driver = self.driver_registry.release(self.uri, (self.user, self.password), asynchronous=True)
+            if driver is not None:
+                await driver.close()
+        self.is_connected = self.driver is not None
+        self.async_driver = None
+        return self
+
+    async def aexecute(self, query: str, parameters: Optional[dict[str, Any]] = None) -> list[dict[str, Any]]:
+        limits = {"max_rows": self.max_rows, "max_bytes": self.max_result_bytes}
+        if self.result_cache is None or parameters is not None:
+            return await self._arun(query, parameters, **limits)
+        if self.graph_version.is_due():
+            self.graph_version.set(build_fingerprint(await self._arun(FINGERPRINT_QUERY)))
+        result = self.result_cache.get(self.uri, query, self.graph_version.value)
+        if result is None:
+            result = await self._arun(query, **limits)
+            self.result_cache.put(self.uri, query, result, self.graph_version.value)
+        return result
+
+    async def _arun(
+        self,
+        query: str,
+        parameters: Optional[dict[str, Any]] = None,
+        *,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ) -> QueryResult:
+        """Async version of `_read`, internal queries run without `max_rows` and `max_bytes`"""
+
+        @unit_of_work(timeout=self.query_timeout)
+        async def transaction(tx):
+            budget = RowBudget(max_rows, max_bytes)
+            rows = []
+            async for record in await tx.run(query, parameters):
+                row = record.data()
+                if not budget.admit(row):
+                    break
+                rows.append(row)
+            return QueryResult(rows, truncated=budget.truncated)
+
+        async with self.async_driver.session(default_access_mode=READ_ACCESS, fetch_size=self.fetch_size) as session:
+            return await session.execute_read(transaction)
+
+    async def aexplain(self, query: str) -> QueryPlan:
+        async with self.async_driver.session(default_access_mode=READ_ACCESS) as session:
+            result = await session.run(Query(f"EXPLAIN {query}", timeout=self.query_timeout))
+            summary = await result.consume()
+        return QueryPlan.from_summary(summary.plan)
+
+    async def avalidate(self, query: str) -> Optional[QueryPlan]:
+        if self.static_check:
+            await self.aget_structured_schema()
+            self.check_against_schema(query)
+        if not self.explain_before_execute and self.cost_guard is None:
+            return None
+        plan = await self.aexplain(query)
+        if self.cost_guard is not None:
+            self.cost_guard.check(plan, query)
+        return plan
+
+    async def arepair(self, query: str, error_message: str) -> Optional[str]:
+        await self.aget_structured_schema()
+        return self.repair(query, error_message)
+
+    async def aschema_digest(self) -> Optional[str]:
+        await self.aget_structured_schema()
+        return self.schema_digest()
+
+    async def asample_values(self, limit: int = 1000) -> list[dict[str, str]]:
+        await self.aget_structured_schema()
+        version = self.schema_cache.version
+        if self._value_samples is None or self._value_samples[:2] != (version, limit):
+            samples = await self._arun(VALUE_SAMPLE_QUERY, self.value_sample_parameters(limit))
+            self._value_samples = (version, limit, [dict(row) for row in samples])
+        return self._value_samples[2]
+
+    def get_structured_schema(self) -> dict[str, Any]:
+        # Without a sync driver the cache can only be read, loading and refreshing is left to the async driver
+        if self.driver is None:
+            schema = self.schema_cache.peek()
+            if schema is not None:
+                return schema
+        return super().get_structured_schema()
+
+    async def aget_schema(self) -> str:
+        return self.render_schema(await self.aget_structured_schema())
+
+    async def aget_structured_schema(self) -> dict[str, Any]:
+        schema = self.schema_cache.peek()
+        if schema is None:
+            await self._arefresh_schema()
+            return self.schema_cache.peek()
+        if self.schema_cache.is_stale() and self._schema_refresh is None:
+            self._schema_refresh = asyncio.create_task(self._arefresh_schema())
+            self._schema_refresh.add_done_callback(self._schema_refresh_done)
+        return schema
+
+    async def _arefresh_schema(self) -> None:
+        if self._schema_lock is None:
+            self._schema_lock = asyncio.Lock()
+        async with self._schema_lock:
+            if not self.schema_cache.is_stale():
+                return
+            fingerprint = build_fingerprint(await self._arun(FINGERPRINT_QUERY))
+            if self.schema_cache.peek() is not None and fingerprint == self.schema_cache.cached_fingerprint:
+                self.schema_cache.touch()
+                return
+            meta_data = await self._arun(SCHEMA_QUERY, self.schema_query_parameters())
+            schema = build_structured_schema(meta_data)
+            self.schema_cache.put(schema, fingerprint)
+
+    def _schema_refresh_done(self, task: asyncio.Task) -> None:
+        self._schema_refresh = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Background schema refresh failed, serving the cached schema", exc_info=task.exception())
+
+    async def abuild_prompt(self, question: str) -> str:
+        await self.aget_schema()
+        return self.build_prompt(question)
+
+    async def abuild_error_prompt(self, question: str, error_message: str, query: str) -> str:
+        await self.aget_schema()
+        return self.build_error_prompt(question, error_message, query)
+
+    async def abuild_prompt_messages(self, question: str) -> list[dict[str, str]]:
+        await self.aget_schema()
+        if self.prune_schema:
+            await self.asample_values(self.prune_sample_limit)
+        return self.build_prompt_messages(question)
+
+    async def abuild_error_prompt_messages(self, question: str, error_message: str, query: str) -> list[dict[str, str]]:
+        await self.aget_schema()
+        if self.prune_schema:
+            await self.asample_values(self.prune_sample_limit)
+        return self.build_error_prompt_messages(question, error_message, query)
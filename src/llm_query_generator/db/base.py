@@ -1,8 +1,16 @@
+import asyncio
+import threading
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, Optional
 
 from src.llm_query_generator.chat_history import ChatHistory
 
+from .plan import QueryPlan
+
+
+class QueryCancelledError(Exception):
+    """Raised by `execute_cancellable` when the query was stopped before it finished"""
+
 
 class DataBaseAdapter(ABC):
     is_connected: bool = False
@@ -12,6 +20,22 @@ class DataBaseAdapter(ABC):
         """Execute a query and return the result as a string"""
         ...
 
+    def execute_cancellable(self, query: str, cancelled: threading.Event) -> list[dict[str, Any]]:  # noqa: ARG002
+        """Execute a query that is stopped once `cancelled` is set, adapters that can not stop a query finish it"""
+        return self.execute(query)
+
+    def validate(self, query: str) -> Optional[QueryPlan]:  # noqa: ARG002
+        """Check a query without executing it, raises if it is invalid and returns the plan if there is one"""
+        return None
+
+    def repair(self, query: str, error_message: str) -> Optional[str]:  # noqa: ARG002
+        """Fix mechanical mistakes of a failed query without an LLM, returns None if nothing could be fixed"""
+        return None
+
+    def is_repairable(self, error: Exception) -> bool:  # noqa: ARG002
+        """If `repair` may fix the query that raised the error, e.g. not after timeouts"""
+        return True
+
     @abstractmethod
     def build_prompt(self, question: str) -> str:
         """Build a prompt for the given question"""
@@ -21,6 +45,26 @@ class DataBaseAdapter(ABC):
         """Build a prompt for the given error message"""
         ...
 
+    def build_prompt_messages(self, question: str) -> list[dict[str, str]]:
+        """Build the chat messages for the given question, static context goes into a leading system message"""
+        return [{"role": "user", "content": self.build_prompt(question)}]
+
+    def build_error_prompt_messages(self, question: str, error_message: str, query: str) -> list[dict[str, str]]:
+        """Build the chat messages for the given error message"""
+        return [{"role": "user", "content": self.build_error_prompt(question, error_message, query)}]
+
+    def schema_terms(self) -> list[str]:
+        """Labels, relationship types and property names of the schema, empty if the adapter has no schema"""
+        return []
+
+    def sample_values(self, limit: int = 1000) -> list[dict[str, str]]:  # noqa: ARG002
+        """A sample of entity names as rows with `label`, `property` and `value`"""
+        return []
+
+    def schema_digest(self) -> Optional[str]:
+        """Hash of the current schema that changes whenever the schema changes, None if the adapter has no schema"""
+        return None
+
     @abstractmethod
     def connect(self) -> "DataBaseAdapter":
         """Connect to the database"""
@@ -30,3 +74,43 @@ class DataBaseAdapter(ABC):
     def disconnect(self) -> "DataBaseAdapter":
         """Disconnect from the database"""
         ...
+
+    async def aexecute(self, query: str) -> list[dict[str, Any]]:
+        """Execute a query without blocking the event loop"""
+        return await asyncio.to_thread(self.execute, query)
+
+    async def avalidate(self, query: str) -> Optional[QueryPlan]:
+        """Check a query without executing it and without blocking the event loop"""
+        return await asyncio.to_thread(self.validate, query)
+
+    async def arepair(self, query: str, error_message: str) -> Optional[str]:
+        """Fix mechanical mistakes of a failed query without blocking the event loop"""
+        return await asyncio.to_thread(self.repair, query, error_message)
+
+    async def abuild_prompt(self, question: str) -> str:
+        """Build a prompt for the given question without blocking the event loop"""
+        return await asyncio.to_thread(self.build_prompt, question)
+
+    async def abuild_error_prompt(self, question: str, error_message: str, query: str) -> str:
+        """Build a prompt for the given error message without blocking the event loop"""
+        return await asyncio.to_thread(self.build_error_prompt, question, error_message, query)
+
+    async def abuild_prompt_messages(self, question: str) -> list[dict[str, str]]:
+        """Build the chat messages for the given question without blocking the event loop"""
+        return await asyncio.to_thread(self.build_prompt_messages, question)
+
+    async def abuild_error_prompt_messages(self, question: str, error_message: str, query: str) -> list[dict[str, str]]:
+        """Build the chat messages for the given error message without blocking the event loop"""
+        return await asyncio.to_thread(self.build_error_prompt_messages, question, error_message, query)
+
+    async def aschema_digest(self) -> Optional[str]:
+        """Hash of the current schema without blocking the event loop"""
+        return await asyncio.to_thread(self.schema_digest)
+
+    async def aconnect(self) -> "DataBaseAdapter":
+        """Connect to the database without blocking the event loop"""
+        return await asyncio.to_thread(self.connect)
+
+    async def adisconnect(self) -> "DataBaseAdapter":
+        """Disconnect from the database without blocking the event loop"""
+        return await asyncio.to_thread(self.disconnect)
@@ -0,0 +1,75 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from .cypher_checker import mask_string_literals
+from .plan import QueryPlan
+
+VAR_LENGTH_PATTERN = re.compile(r"-\[[^\[\]]*?\*\s*(\d*)\s*(\.\.)?\s*(\d*)\s*(?:\{[^{}]*\})?\s*\]")
+ALL_NODES_SCAN_OPERATORS = {"AllNodesScan"}
+CARTESIAN_PRODUCT_OPERATORS = {"CartesianProduct"}
+
+
+class QueryCostError(Exception):
+    """Raised when the plan of a query exceeds the limits of a `CostGuard`"""
+
+
+def var_length_upper_bounds(query: str) -> list[Optional[int]]:
+    """Returns the upper bound of every variable length relationship in the query, None if it is unbounded"""
+    bounds = []
+    for match in VAR_LENGTH_PATTERN.finditer(mask_string_literals(query)):
+        lower, has_range, upper = match.groups()
+        if has_range:
+            bounds.append(int(upper) if upper else None)
+        else:
+            bounds.append(int(lower) if lower else None)
+    return bounds
+
+
+@dataclass
+class CostGuard:
+    """Rejects queries whose EXPLAIN plan is too expensive for a shared database"""
+
+    max_estimated_rows: Optional[float] = 1_000_000
+    allow_cartesian_product: bool = False
+    allow_all_nodes_scan: bool = False
+    # the CLEVR few shots bound their shortest paths to 50 hops
+    max_var_length: Optional[int] = 50
+
+    def violations(self, plan: QueryPlan, query: str) -> list[str]:
+        """Returns a description of every limit the plan exceeds"""
+        violations = []
+        operators = list(plan.walk())
+        estimated_rows = max(operator.estimated_rows for operator in operators)
+        if self.max_estimated_rows is not None and estimated_rows > self.max_estimated_rows:
+            violations.append(
+                f"The planner estimates {estimated_rows:.0f} rows, more than the allowed {self.max_estimated_rows:.0f}."
+            )
+        operator_names = {operator.operator for operator in operators}
+        if not self.allow_cartesian_product and operator_names & CARTESIAN_PRODUCT_OPERATORS:
+            violations.append("The query builds a cartesian product of disconnected patterns.")
+        if not self.allow_all_nodes_scan and operator_names & ALL_NODES_SCAN_OPERATORS:
+            violations.append("The query scans all nodes because a node pattern has no label.")
+        if self.max_var_length is not None:
+            for bound in var_length_upper_bounds(query):
+                if bound is None or bound > self.max_var_length:
+                    length = "unbounded" if bound is None else f"up to {bound} hops"
+                    violations.append(
+                        f"A variable length relationship is {length}, at most {self.max_var_length} hops are allowed."
+                    )
+        return violations
+
+    def check(self, plan: QueryPlan, query: str) -> None:
+        """Raises a `QueryCostError` asking for a cheaper query if the plan exceeds a limit"""
+        violations = self.violations(plan, query)
+        if violations:
+            details = " ".join(violations)
+            var_length_hint = ""
+            if self.max_var_length is not None:
+                var_length_hint = f"bound variable length relationships to at most {self.max_var_length} hops and "
+            msg = (
+                f"The query was rejected because it is too expensive: {details} "
+                "Make this query cheaper: use labels on every node, connect all patterns, "
+                f"{var_length_hint}limit the result."
+            )
+            raise QueryCostError(msg)
@@ -0,0 +1,213 @@
+import re
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+STRING_LITERAL_PATTERN = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+IDENTIFIER = r"(?:`[^`]+`|[A-Za-z_][A-Za-z0-9_]*)"
+NODE_PATTERN = re.compile(
+    rf"\(\s*(?P<variable>{IDENTIFIER})?\s*(?P<labels>(?::\s*{IDENTIFIER}\s*)+)?(?P<properties>\{{[^{{}}]*\}})?\s*\)"
+)
+RELATIONSHIP_PATTERN = re.compile(
+    rf"(?P<left><)?-\[\s*(?P<variable>{IDENTIFIER})?\s*(?::\s*(?P<types>{IDENTIFIER}(?:\s*\|\s*:?\s*{IDENTIFIER})*))?"
+    rf"\s*(?P<length>\*[^\]{{]*)?\s*(?P<properties>\{{[^{{}}]*\}})?\s*\]-(?P<right>>)?"
+)
+PROPERTY_KEY_PATTERN = re.compile(rf"(?P<key>{IDENTIFIER})\s*:")
+PROPERTY_ACCESS_PATTERN = re.compile(rf"(?<![\w.`])(?P<variable>{IDENTIFIER})\.(?P<key>{IDENTIFIER})")
+
+
+class CypherSchemaError(Exception):
+    """Raised when a query references labels, relationship types or properties that are not in the schema"""
+
+
+def strip_identifier(identifier: str) -> str:
+    return identifier.strip().strip("`")
+
+
+def mask_string_literals(query: str) -> str:
+    """Blanks the content of string literals so it is not mistaken for query syntax, offsets stay the same"""
+
+    def mask(match: re.Match) -> str:
+        literal = match.group()
+        return literal[0] + " " * (len(literal) - 2) + literal[-1]
+
+    return STRING_LITERAL_PATTERN.sub(mask, query)
+
+
+@dataclass
+class PatternElement:
+    start: int
+    end: int
+    variable: Optional[str]
+    names: list[str]
+    property_keys: list[str] = field(default_factory=list)
+
+
+@dataclass
+class RelationshipElement(PatternElement):
+    direction: str = "both"
+
+
+def _property_keys(properties: Optional[str]) -> list[str]:
+    if properties is None:
+        return []
+    return [strip_identifier(match.group("key")) for match in PROPERTY_KEY_PATTERN.finditer(properties[1:-1])]
+
+
+def bind_variables(
+    nodes: list[PatternElement], relationships: list[RelationshipElement]
+) -> dict[str, tuple[str, set[str]]]:
+    """Maps every pattern variable to its kind and the labels or relationship types it was declared with"""
+    variables: dict[str, tuple[str, set[str]]] = {}
+    for node in nodes:
+        if node.variable is not None and node.names:
+            variables.setdefault(node.variable, ("node", set()))[1].update(node.names)
+    for relationship in relationships:
+        if relationship.variable is not None and relationship.names:
+            variables.setdefault(relationship.variable, ("relationship", set()))[1].update(relationship.names)
+    return variables
+
+
+class CypherChecker:
+    """Checks labels, relationship types, property keys and directions of a query against a structured schema"""
+
+    def __init__(self, schema: dict[str, Any]):
+        self.node_properties: dict[str, set[str]] = {
+            node["labels"]: {prop["property"] for prop in node["properties"]} for node in schema["node_properties"]
+        }
+        self.relationship_properties: dict[str, set[str]] = {
+            rel["type"]: {prop["property"] for prop in rel["properties"]} for rel in schema["relationship_properties"]
+        }
+        self.patterns: set[tuple[str, str, str]] = {
+            (rel["start"], rel["type"], rel["end"]) for rel in schema["relationships"]
+        }
+        self.labels = set(self.node_properties)
+        self.relationship_types = set(self.relationship_properties)
+        for start, rel_type, end in self.patterns:
+            self.labels.update((start, end))
+            self.relationship_types.add(rel_type)
+
+    def check(self, query: str) -> list[str]:
+        """Returns a diagnostic message for every schema violation of the query"""
+        errors, warnings = self.diagnose(query)
+        return errors + warnings
+
+    def diagnose(self, query: str) -> tuple[list[str], list[str]]:
+        """Splits the diagnostics into unknown labels and the remaining violations.
+
+        The schema is read from a sample of the graph, so relationship types, properties and relationship directions
+        it misses may still exist, while labels are complete.
+        """
+        query = mask_string_literals(query)
+        nodes = self.nodes(query)
+        relationships = self.relationships(query)
+        variables = bind_variables(nodes, relationships)
+
+        errors: list[str] = []
+        warnings: list[str] = []
+        for node in nodes:
+            errors.extend(self._check_names(node.names, self.labels, "Label"))
+            warnings.extend(self._check_keys("node", node.names, node.property_keys))
+        for relationship in relationships:
+            warnings.extend(self._check_names(relationship.names, self.relationship_types, "Relationship type"))
+            warnings.extend(self._check_keys("relationship", relationship.names, relationship.property_keys))
+            warnings.extend(self._check_direction(relationship, nodes, variables))
+        for match in PROPERTY_ACCESS_PATTERN.finditer(query):
+            variable = strip_identifier(match.group("variable"))
+            if variable in variables:
+                kind, names = variables[variable]
+                warnings.extend(self._check_keys(kind, sorted(names), [strip_identifier(match.group("key"))]))
+        return list(dict.fromkeys(errors)), list(dict.fromkeys(warnings))
+
+    def nodes(self, query: str) -> list[PatternElement]:
+        nodes = []
+        for match in NODE_PATTERN.finditer(query):
+            labels = match.group("labels")
+            names = [strip_identifier(label) for label in labels.split(":")[1:]] if labels else []
+            variable = strip_identifier(match.group("variable")) if match.group("variable") else None
+            nodes.append(
+                PatternElement(match.start(), match.end(), variable, names, _property_keys(match.group("properties")))
+            )
+        return nodes
+
+    def relationships(self, query: str) -> list[RelationshipElement]:
+        relationships = []
+        for match in RELATIONSHIP_PATTERN.finditer(query):
+            types = match.group("types")
+            names = [strip_identifier(name.lstrip(":")) for name in types.split("|")] if types else []
+            variable = strip_identifier(match.group("variable")) if match.group("variable") else None
+            if match.group("left") and not match.group("right"):
+                direction = "left"
+            elif match.group("right") and not match.group("left"):
+                direction = "right"
+            else:
+                direction = "both"
+            relationships.append(
+                RelationshipElement(
+                    match.start(),
+                    match.end(),
+                    variable,
+                    names,
+                    _property_keys(match.group("properties")),
+                    direction,
+                )
+            )
+        return relationships
+
+    def _check_names(self, names: list[str], known: set[str], kind: str) -> list[str]:
+        return [
+            f"{kind} `{name}` does not exist in the schema, use one of: {', '.join(sorted(known))}."
+            for name in names
+            if name not in known
+        ]
+
+    def _check_keys(self, kind: str, names: list[str], keys: list[str]) -> list[str]:
+        properties = self.node_properties if kind == "node" else self.relationship_properties
+        known_names = [name for name in names if name in properties]
+        if not known_names:
+            return []
+        allowed = set().union(*(properties[name] for name in known_names))
+        owner = ":".join(known_names)
+        return [
+            f"Property `{key}` does not exist on `{owner}`, use one of: {', '.join(sorted(allowed))}."
+            for key in keys
+            if key not in allowed
+        ]
+
+    def _check_direction(
+        self,
+        relationship: RelationshipElement,
+        nodes: list[PatternElement],
+        variables: dict[str, tuple[str, set[str]]],
+    ) -> list[str]:
+        if relationship.direction == "both" or len(relationship.names) != 1:
+            return []
+        left = next((node for node in nodes if node.end == relationship.start), None)
+        right = next((node for node in nodes if node.start == relationship.end), None)
+        if left is None or right is None:
+            return []
+        left_labels = self._labels_of(left, variables)
+        right_labels = self._labels_of(right, variables)
+        if not left_labels or not right_labels:
+            return []
+        rel_type = relationship.names[0]
+        start_labels, end_labels = (left_labels, right_labels)
+        if relationship.direction == "left":
+            start_labels, end_labels = (right_labels, left_labels)
+        pairs = [(start, end) for start in start_labels for end in end_labels]
+        if any((start, rel_type, end) in self.patterns for start, end in pairs):
+            return []
+        if any((end, rel_type, start) in self.patterns for start, end in pairs):
+            start, end = pairs[0]
+            return [
+                (
+                    f"Relationship (:{start})-[:{rel_type}]->(:{end}) does not exist, "
+                    f"but (:{end})-[:{rel_type}]->(:{start}) does. Reverse the direction of the relationship."
+                )
+            ]
+        return []
+
+    def _labels_of(self, node: PatternElement, variables: dict[str, tuple[str, set[str]]]) -> list[str]:
+        labels = [label for label in node.names if label in self.labels]
+        if not labels and node.variable in variables and variables[node.variable][0] == "node":
+            labels = sorted(variables[node.variable][1] & self.labels)
+        return labels
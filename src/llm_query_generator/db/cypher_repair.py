@@ -0,0 +1,208 @@
+import re
+from typing import Any, Iterable, Optional
+
+from .cypher_checker import (
+    IDENTIFIER,
+    NODE_PATTERN,
+    PROPERTY_ACCESS_PATTERN,
+    PROPERTY_KEY_PATTERN,
+    RELATIONSHIP_PATTERN,
+    CypherChecker,
+    bind_variables,
+    mask_string_literals,
+    strip_identifier,
+)
+
+NUMERIC_TYPES = {"INTEGER", "FLOAT", "LONG", "DOUBLE"}
+FENCE_PATTERN = re.compile(r"^\s*```[A-Za-z]*[ \t]*\n?|\n?\s*```\s*$")
+INLINE_CODE_PATTERN = re.compile(r"^`\s*(?:MATCH|OPTIONAL|WITH|UNWIND|CALL|RETURN)\b", re.IGNORECASE)
+IDENTIFIER_PATTERN = re.compile(IDENTIFIER)
+QUOTED_NUMBER_PATTERN = re.compile(
+    r"(?P<key>[A-Za-z_][A-Za-z0-9_]*)(?P<operator>\s*(?::|=|<>|<=|>=|<|>)\s*)(?P<quote>['\"])(?P<number>-?\d+(?:\.\d+)?)(?P=quote)"
+)
+PATH_VARIABLE_PATTERN = re.compile(rf"(?P<variable>{IDENTIFIER})\s*=\s*(?:shortestPath|allShortestPaths)?\s*\(")
+READ_CLAUSE_PATTERN = re.compile(r"\b(?:MATCH|UNWIND)\b", re.IGNORECASE)
+RETURN_CLAUSE_PATTERN = re.compile(r"\bRETURN\b", re.IGNORECASE)
+WRITE_CLAUSE_PATTERN = re.compile(r"\b(?:CREATE|MERGE|SET|DELETE|REMOVE|CALL)\b", re.IGNORECASE)
+
+Edit = tuple[int, int, str]
+
+
+def edit_distance(first: str, second: str) -> int:
+    """Edit distance between two strings that counts swapping two adjacent characters as one edit"""
+    distances = [[0] * (len(second) + 1) for _ in range(len(first) + 1)]
+    for i in range(len(first) + 1):
+        distances[i][0] = i
+    for j in range(len(second) + 1):
+        distances[0][j] = j
+    for i in range(1, len(first) + 1):
+        for j in range(1, len(second) + 1):
+            cost = first[i - 1] != second[j - 1]
+            distances[i][j] = min(distances[i - 1][j] + 1, distances[i][j - 1] + 1, distances[i - 1][j - 1] + cost)
+            if i > 1 and j > 1 and first[i - 1] == second[j - 2] and first[i - 2] == second[j - 1]:
+                distances[i][j] = min(distances[i][j], distances[i - 2][j - 2] + 1)
+    return distances[-1][-1]
+
+
+def closest_name(name: str, candidates: Iterable[str]) -> Optional[str]:
+    """Returns the candidate that is a near miss of the name, ignoring case, or None if there is none"""
+    max_distance = max(1, len(name) // 3)
+    best, best_distance = None, max_distance + 1
+    for candidate in sorted(candidates):
+        distance = edit_distance(name.lower(), candidate.lower())
+        if distance < best_distance:
+            best, best_distance = candidate, distance
+    return best
+
+
+def apply_edits(query: str, edits: list[Edit]) -> str:
+    for start, end, replacement in sorted(edits, reverse=True):
+        query = query[:start] + replacement + query[end:]
+    return query
+
+
+def strip_code_fences(query: str) -> str:
+    """Removes markdown fences and stray backticks that `clean_generation` left around the query"""
+    query = FENCE_PATTERN.sub("", query).strip()
+    if INLINE_CODE_PATTERN.match(query) and query.endswith("`"):
+        query = query[1:-1].strip()
+    if query.count("`") % 2 == 1:
+        if query.startswith("`"):
+            query = query[1:]
+        elif query.endswith("`"):
+            query = query[:-1]
+    return query.strip()
+
+
+def close_string_literals(query: str) -> str:
+    """Closes a string literal that is still open at the end of the query"""
+    quote = None
+    index = 0
+    while index < len(query):
+        char = query[index]
+        if quote is not None and char == "\\":
+            index += 2
+            continue
+        if quote is None and char in "'\"":
+            quote = char
+        elif char == quote:
+            quote = None
+        index += 1
+    return query + quote if quote is not None else query
+
+
+class CypherRepairer:
+    """Fixes mechanical mistakes in generated Cypher without asking the LLM"""
+
+    def __init__(self, schema: dict[str, Any]):
+        self.checker = CypherChecker(schema)
+        property_types: dict[str, set[str]] = {}
+        for owner in schema["node_properties"] + schema["relationship_properties"]:
+            for prop in owner["properties"]:
+                property_types.setdefault(prop["property"], set()).add(prop["type"].upper())
+        self.numeric_properties = {key for key, types in property_types.items() if types <= NUMERIC_TYPES}
+
+    def repair(self, query: str) -> str:
+        query = strip_code_fences(query)
+        query = close_string_literals(query)
+        query = self.fix_names(query)
+        query = self.fix_property_keys(query)
+        query = self.unquote_numbers(query)
+        query = self.add_missing_return(query)
+        return query
+
+    def fix_names(self, query: str) -> str:
+        """Replaces labels and relationship types that are near misses of schema identifiers"""
+        masked = mask_string_literals(query)
+        edits: list[Edit] = []
+        for match in NODE_PATTERN.finditer(masked):
+            edits.extend(self._name_edits(match, "labels", self.checker.labels))
+        for match in RELATIONSHIP_PATTERN.finditer(masked):
+            edits.extend(self._name_edits(match, "types", self.checker.relationship_types))
+        return apply_edits(query, edits)
+
+    def fix_property_keys(self, query: str) -> str:
+        """Replaces property keys that are near misses of the properties of their label or relationship type"""
+        masked = mask_string_literals(query)
+        variables = bind_variables(self.checker.nodes(masked), self.checker.relationships(masked))
+        edits: list[Edit] = []
+        for match in NODE_PATTERN.finditer(masked):
+            names = self._names(match.group("labels"))
+            edits.extend(self._key_edits(match, self._allowed_keys("node", names)))
+        for match in RELATIONSHIP_PATTERN.finditer(masked):
+            names = self._names(match.group("types"))
+            edits.extend(self._key_edits(match, self._allowed_keys("relationship", names)))
+        for match in PROPERTY_ACCESS_PATTERN.finditer(masked):
+            variable = strip_identifier(match.group("variable"))
+            if variable not in variables:
+                continue
+            kind, names = variables[variable]
+            replacement = self._replacement(match.group("key"), self._allowed_keys(kind, names))
+            if replacement is not None:
+                edits.append((match.start("key"), match.end("key"), replacement))
+        return apply_edits(query, edits)
+
+    def unquote_numbers(self, query: str) -> str:
+        """Turns string quoted numbers that are compared with numeric properties into numbers"""
+        masked = mask_string_literals(query)
+        edits: list[Edit] = []
+        for match in QUOTED_NUMBER_PATTERN.finditer(query):
+            # the key and operator are blanked in the masked query if the match lies inside a string literal
+            if masked[match.start() : match.start("quote")] != query[match.start() : match.start("quote")]:
+                continue
+            if match.group("key") in self.numeric_properties:
+                edits.append((match.start("quote"), match.end(), match.group("number")))
+        return apply_edits(query, edits)
+
+    def add_missing_return(self, query: str) -> str:
+        """Returns all named variables of a read query that has no RETURN clause"""
+        masked = mask_string_literals(query)
+        if RETURN_CLAUSE_PATTERN.search(masked) or WRITE_CLAUSE_PATTERN.search(masked):
+            return query
+        if not READ_CLAUSE_PATTERN.search(masked):
+            return query
+        variables = [strip_identifier(match.group("variable")) for match in PATH_VARIABLE_PATTERN.finditer(masked)]
+        for element in self.checker.nodes(masked) + self.checker.relationships(masked):
+            if element.variable is not None:
+                variables.append(element.variable)
+        variables = list(dict.fromkeys(variables))
+        if not variables:
+            return query
+        return f"{query.rstrip().rstrip(';')}\nRETURN {', '.join(variables)}"
+
+    def _names(self, group: Optional[str]) -> set[str]:
+        if group is None:
+            return set()
+        return {strip_identifier(match.group()) for match in IDENTIFIER_PATTERN.finditer(group)}
+
+    def _allowed_keys(self, kind: str, names: Iterable[str]) -> set[str]:
+        properties = self.checker.node_properties if kind == "node" else self.checker.relationship_properties
+        return set().union(*(properties.get(name, set()) for name in names))
+
+    def _replacement(self, identifier: str, allowed: set[str]) -> Optional[str]:
+        name = strip_identifier(identifier)
+        if not allowed or name in allowed:
+            return None
+        return closest_name(name, allowed)
+
+    def _name_edits(self, match: re.Match, group: str, known: set[str]) -> list[Edit]:
+        if match.group(group) is None:
+            return []
+        offset = match.start(group)
+        edits = []
+        for name in IDENTIFIER_PATTERN.finditer(match.group(group)):
+            replacement = self._replacement(name.group(), known)
+            if replacement is not None:
+                edits.append((offset + name.start(), offset + name.end(), replacement))
+        return edits
+
+    def _key_edits(self, match: re.Match, allowed: set[str]) -> list[Edit]:
+        if match.group("properties") is None:
+            return []
+        offset = match.start("properties")
+        edits = []
+        for key in PROPERTY_KEY_PATTERN.finditer(match.group("properties")):
+            replacement = self._replacement(key.group("key"), allowed)
+            if replacement is not None:
+                edits.append((offset + key.start("key"), offset + key.end("key"), replacement))
+        return edits
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Any, Optional, Union
+
+from neo4j import READ_ACCESS, AsyncDriver, AsyncGraphDatabase, Driver, GraphDatabase
+
+DriverKey = tuple[str, tuple[str, str], bool]
+
+
+@dataclass(frozen=True)
+class DriverConfig:
+    """Connection pool settings of a shared Neo4j driver"""
+
+    max_connection_pool_size: int = 100
+    max_connection_lifetime: float = 3600.0
+    connection_acquisition_timeout: float = 60.0
+    warmup_connections: int = 0
+
+    def driver_kwargs(self) -> dict[str, Any]:
+        return {
+            "max_connection_pool_size": self.max_connection_pool_size,
+            "max_connection_lifetime": self.max_connection_lifetime,
+            "connection_acquisition_timeout": self.connection_acquisition_timeout,
+        }
+
+
+class DriverRegistry:
+    """Process wide registry that shares one pooled driver per uri and auth"""
+
+    def __init__(self) -> None:
+        self._drivers: dict[DriverKey, Union[Driver, AsyncDriver]] = {}
+        self._ref_counts: dict[DriverKey, int] = {}
+        self._lock = threading.Lock()
+        self._key_locks: dict[DriverKey, threading.Lock] = {}
+
+    def acquire(
+        self,
+        uri: str,
+        auth: tuple[str, str],
+        config: Optional[DriverConfig] = None,
+        *,
+        asynchronous: bool = False,
+    ) -> Union[Driver, AsyncDriver]:
+        """Returns the shared driver for the given uri and auth, creating it on first use.
+
+        The config of the first adapter that acquires a driver defines its pool settings.
+        Async drivers are bound to the event loop they are used on and are not warmed up here, see `async_warm_up`.
+        """
+        key = (uri, auth, asynchronous)
+        driver = self._share(key)
+        if driver is not None:
+            return driver
+        # drivers are created and warmed up under a lock of their key, so a slow server only blocks its own adapters
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            driver = self._share(key)
+            if driver is not None:
+                return driver
+            config = config or DriverConfig()
+            if asynchronous:
+                driver = AsyncGraphDatabase.driver(uri, auth=auth, **config.driver_kwargs())
+            else:
+                driver = GraphDatabase.driver(uri, auth=auth, **config.driver_kwargs())
+                if config.warmup_connections > 0:
+                    try:
+                        warm_up(driver, config.warmup_connections)
+                    except Exception:
+                        driver.close()
+                        raise
+            with self._lock:
+                self._drivers[key] = driver
+                self._ref_counts[key] = 1
+            return driver
+
+    def _share(self, key: DriverKey) -> Optional[Union[Driver, AsyncDriver]]:
+        with self._lock:
+            driver = self._drivers.get(key)
+            if driver is not None:
+                self._ref_counts[key] += 1
+            return driver
+
+    def release(self, uri: str, auth: tuple[str, str], *, asynchronous: bool = False) -> Optional[AsyncDriver]:
+        """Releases a driver and closes it once no adapter uses it anymore.
+
+        Async drivers are returned instead of closed so the caller can await their `close()`.
+        """
+        key = (uri, auth, asynchronous)
+        with self._lock:
+            if key not in self._drivers:
+                return None
+            self._ref_counts[key] -= 1
+            if self._ref_counts[key] > 0:
+                return None
+            driver = self._drivers.pop(key)
+            del self._ref_counts[key]
+        if asynchronous:
+            return driver
+        driver.close()
+        return None
+
+    def close_all(self) -> None:
+        """Closes every registered driver, async drivers are closed on a new event loop, see `aclose_all`"""
+        for (_, _, asynchronous), driver in self._take_all():
+            if asynchronous:
+                asyncio.run(driver.close())
+            else:
+                driver.close()
+
+    async def aclose_all(self) -> None:
+        """Closes every registered driver from the event loop the async drivers are used on"""
+        for (_, _, asynchronous), driver in self._take_all():
+            if asynchronous:
+                await driver.close()
+            else:
+                driver.close()
+
+    def _take_all(self) -> list[tuple[DriverKey, Union[Driver, AsyncDriver]]]:
+        with self._lock:
+            drivers = list(self._drivers.items())
+            self._drivers.clear()
+            self._ref_counts.clear()
+        return drivers
+
+    def __len__(self) -> int:
+        return len(self._drivers)
+
+
+def warm_up(driver: Driver, connections: int) -> None:
+    """Opens `connections` pooled connections by holding that many transactions open at the same time"""
+    with ExitStack() as stack:
+        for _ in range(connections):
+            session = stack.enter_context(driver.session(default_access_mode=READ_ACCESS))
+            transaction = stack.enter_context(session.begin_transaction())
+            transaction.run("RETURN 1").consume()
+
+
+async def async_warm_up(driver: AsyncDriver, connections: int) -> None:
+    """Async counterpart of `warm_up`"""
+    sessions = [driver.session(default_access_mode=READ_ACCESS) for _ in range(connections)]
+    transactions = []
+    try:
+        for session in sessions:
+            transaction = await session.begin_transaction()
+            transactions.append(transaction)
+            await (await transaction.run("RETURN 1")).consume()
+    finally:
+        for transaction in transactions:
+            await transaction.close()
+        for session in sessions:
+            await session.close()
+
+
+DRIVER_REGISTRY = DriverRegistry()
@@ -0,0 +1,107 @@
+import json
+import mmap
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+from ..llm.scheduler import estimate_tokens
+from ..text_index import SparseIndex, mask_entities
+
+
+@dataclass
+class FewShotExample:
+    question: str
+    cypher: str
+
+    def format(self) -> str:
+        return f"Question: {self.question}\nCypher: {self.cypher}\n"
+
+
+class FewShotStore:
+    """Question and Cypher examples from which the most similar ones are picked for every prompt.
+
+    Examples are added in memory or loaded from a JSON lines corpus with `question` and `cypher` fields, like the
+    `questions.jsonl` written by `scripts/clevr/create_graph.py`. A corpus file is memory mapped and only the byte
+    offsets of its examples are kept, examples are read back from the mapping once they are selected. The mapping
+    is a lazy line index, the TF-IDF index of the questions is built in memory when the corpus is loaded.
+
+    Questions are indexed with their entities masked, so examples are matched by the shape of the question and
+    examples that only differ in their entities share one index entry, which keeps the in-memory index small.
+    """
+
+    def __init__(self, examples: Iterable[FewShotExample] = ()):
+        self.index: SparseIndex[str] = SparseIndex()
+        self.shapes: dict[str, list[int]] = {}
+        self._examples: list[Union[FewShotExample, tuple[int, int]]] = []
+        self._mapping: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+        for example in examples:
+            self.add(example)
+
+    @classmethod
+    def from_jsonl(cls, path: Union[str, Path]) -> "FewShotStore":
+        store = cls()
+        if Path(path).stat().st_size == 0:
+            return store
+        with open(path, "rb") as file:
+            store._mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        start = 0
+        while start < len(store._mapping):
+            end = store._mapping.find(b"\n", start)
+            end = len(store._mapping) if end == -1 else end
+            line = store._mapping[start:end].strip()
+            if line:
+                record = json.loads(line)
+                if record.get("question") and record.get("cypher"):
+                    store._index(record["question"], (start, end))
+            start = end + 1
+        store.index.norms()
+        return store
+
+    def __len__(self) -> int:
+        return len(self._examples)
+
+    def add(self, example: FewShotExample) -> None:
+        with self._lock:
+            self._index(example.question, example)
+
+    def _index(self, question: str, example: Union[FewShotExample, tuple[int, int]]) -> None:
+        shape = mask_entities(question)[0]
+        if shape not in self.shapes:
+            self.shapes[shape] = []
+            self.index.add(shape, shape)
+        self.shapes[shape].append(len(self._examples))
+        self._examples.append(example)
+
+    def example(self, position: int) -> FewShotExample:
+        example = self._examples[position]
+        if isinstance(example, FewShotExample):
+            return example
+        record = json.loads(self._mapping[example[0] : example[1]])
+        return FewShotExample(record["question"], record["cypher"])
+
+    def select(self, question: str, k: int = 4, max_tokens: Optional[int] = 400) -> list[FewShotExample]:
+        """The up to `k` examples of the question shapes most similar to the question that fit into `max_tokens`"""
+        with self._lock:
+            # extra candidates in case the most similar examples do not fit into the token budget
+            matches = self.index.search(mask_entities(question)[0], k=k * 4)
+        selected, tokens = [], 0
+        for shape, _ in matches:
+            if len(selected) == k:
+                break
+            example = self.example(self.shapes[shape][0])
+            example_tokens = estimate_tokens(example.format())
+            if max_tokens is not None and tokens + example_tokens > max_tokens:
+                continue
+            selected.append(example)
+            tokens += example_tokens
+        return selected
+
+    def format(self, question: str, k: int = 4, max_tokens: Optional[int] = 400) -> str:
+        return "\n".join(example.format() for example in self.select(question, k, max_tokens))
+
+    def close(self) -> None:
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
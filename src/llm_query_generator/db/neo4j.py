@@ -1,55 +1,245 @@
-from typing import Any, Optional
+import hashlib
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Optional, Union
 
-from neo4j import READ_ACCESS, GraphDatabase, unit_of_work
+from neo4j import READ_ACCESS, Query, unit_of_work
+from neo4j.exceptions import CypherSyntaxError, CypherTypeError
 
-from .base import DataBaseAdapter
+from .base import DataBaseAdapter, QueryCancelledError
+from .cost_guard import CostGuard
+from .cypher_checker import CypherChecker, CypherSchemaError
+from .cypher_repair import CypherRepairer
+from .driver_registry import DRIVER_REGISTRY, DriverConfig, DriverRegistry
+from .few_shot_store import FewShotStore
+from .plan import QueryPlan
+from .result import QueryResult, ResultStream, RowBudget
+from .result_cache import ResultCache, VersionProbe
+from .schema_cache import SchemaCache
+from .schema_index import SchemaIndex
 
-NODE_PROPERTIES_QUERY = """
-CALL apoc.meta.data()
+SCHEMA_QUERY = """
+CALL apoc.meta.data($config)
 YIELD label, other, elementType, type, property
-WHERE NOT type = "RELATIONSHIP" AND elementType = "node"
-WITH label AS nodeLabels, collect({property:property, type:type}) AS properties
-RETURN {labels: nodeLabels, properties: properties} AS output
-
+RETURN label, other, elementType, type, property
 """
 
-REL_PROPERTIES_QUERY = """
-CALL apoc.meta.data()
-YIELD label, other, elementType, type, property
-WHERE NOT type = "RELATIONSHIP" AND elementType = "relationship"
-WITH label AS nodeLabels, collect({property:property, type:type}) AS properties
-RETURN {type: nodeLabels, properties: properties} AS output
+FINGERPRINT_QUERY = """
+CALL apoc.meta.stats()
+YIELD labels, relTypesCount
+RETURN labels, relTypesCount
 """
 
-REL_QUERY = """
-CALL apoc.meta.data()
-YIELD label, other, elementType, type, property
-WHERE type = "RELATIONSHIP" AND elementType = "node"
-UNWIND other AS other_node
-RETURN "(:" + label + ")-[:" + property + "]->(:" + toString(other_node) + ")" AS output
+VALUE_SAMPLE_QUERY = """
+MATCH (n)
+WITH n LIMIT $scan
+UNWIND labels(n) AS label
+UNWIND [property IN $properties WHERE n[property] IS NOT NULL] AS property
+WITH label, property, toStringOrNull(n[property]) AS value
+WHERE value IS NOT NULL
+RETURN DISTINCT label, property, value
+LIMIT $limit
 """
 
+logger = logging.getLogger(__name__)
+
+
+def format_schema(schema: dict[str, Any]) -> str:
+    relationships = [format_relationship(relationship) for relationship in schema["relationships"]]
+    return f"""
+            Node properties are the following:
+            {schema['node_properties']}
+            Relationship properties are the following:
+            {schema['relationship_properties']}
+            The relationships are the following:
+            {relationships}
+            """
+
+
+def format_relationship(relationship: dict[str, str]) -> str:
+    return f"(:{relationship['start']})-[:{relationship['type']}]->(:{relationship['end']})"
+
+
+def format_compact_schema(schema: dict[str, Any]) -> str:
+    """Renders the schema with one line per label and relationship pattern.
+
+    Labels are rendered like `STATION(name:STRING)` and patterns like `(:STATION)-[:EDGE {line_id:STRING}]->(:STATION)`,
+    without the repeated dictionary keys and indentation of `format_schema` the schema needs far fewer tokens.
+    """
+    relationship_properties = {
+        relationship["type"]: format_properties(relationship["properties"])
+        for relationship in schema["relationship_properties"]
+    }
+    lines = ["Nodes:"]
+    lines.extend(f"{node['labels']}({format_properties(node['properties'])})" for node in schema["node_properties"])
+    lines.append("Relationships:")
+    for relationship in schema["relationships"]:
+        properties = relationship_properties.get(relationship["type"])
+        properties = f" {{{properties}}}" if properties else ""
+        lines.append(f"(:{relationship['start']})-[:{relationship['type']}{properties}]->(:{relationship['end']})")
+    # relationship types without a sampled pattern keep their properties
+    patterns = {relationship["type"] for relationship in schema["relationships"]}
+    lines.extend(
+        f"[:{rel_type} {{{properties}}}]"
+        for rel_type, properties in relationship_properties.items()
+        if rel_type not in patterns and properties
+    )
+    return "\n".join(lines)
+
+
+def format_properties(properties: list[dict[str, str]]) -> str:
+    return ", ".join(f"{prop['property']}:{prop['type']}" for prop in properties)
+
+
+SCHEMA_FORMATS = {"verbose": format_schema, "compact": format_compact_schema}
+
+
+def build_structured_schema(meta_data: list[dict[str, Any]]) -> dict[str, Any]:
+    """Builds node properties, relationship properties and relationship patterns from one `apoc.meta.data` pass"""
+    node_properties: dict[str, list[dict[str, str]]] = {}
+    relationship_properties: dict[str, list[dict[str, str]]] = {}
+    relationships = []
+    for row in meta_data:
+        if row["type"] == "RELATIONSHIP":
+            if row["elementType"] == "node":
+                relationships.extend(
+                    {"start": row["label"], "type": row["property"], "end": other} for other in row["other"]
+                )
+        elif row["elementType"] == "node":
+            node_properties.setdefault(row["label"], []).append({"property": row["property"], "type": row["type"]})
+        elif row["elementType"] == "relationship":
+            relationship_properties.setdefault(row["label"], []).append(
+                {"property": row["property"], "type": row["type"]}
+            )
+    return {
+        "node_properties": [
+            {"labels": label, "properties": properties} for label, properties in node_properties.items()
+        ],
+        "relationship_properties": [
+            {"type": rel_type, "properties": properties} for rel_type, properties in relationship_properties.items()
+        ],
+        "relationships": relationships,
+    }
+
+
+def schema_identifiers(schema: dict[str, Any]) -> list[str]:
+    """Labels, relationship types and property names of a structured schema without duplicates"""
+    identifiers = []
+    for node in schema["node_properties"]:
+        identifiers.append(node["labels"])
+        identifiers.extend(prop["property"] for prop in node["properties"])
+    for relationship in schema["relationship_properties"]:
+        identifiers.append(relationship["type"])
+        identifiers.extend(prop["property"] for prop in relationship["properties"])
+    identifiers.extend(relationship["type"] for relationship in schema["relationships"])
+    return list(dict.fromkeys(identifiers))
+
+
+def join_messages(messages: list[dict[str, str]]) -> str:
+    """Joins prompt messages into a single prompt for callers that send one user message"""
+    return "\n\n".join(message["content"] for message in messages)
+
+
+def build_fingerprint(stats: list[dict[str, Any]]) -> str:
+    serialized_stats = json.dumps(stats, sort_keys=True, default=str)
+    return hashlib.sha1(serialized_stats.encode(), usedforsecurity=False).hexdigest()
+
 
 class Neo4jAdapter(DataBaseAdapter):
     """Neo4j adapter for Database operations"""
 
-    def __init__(self, uri: str, user: str, password: str, few_shots: Optional[str] = None, query_timeout: int = 10):
+    def __init__(
+        self,
+        uri: str,
+        user: str,
+        password: str,
+        few_shots: Optional[str] = None,
+        query_timeout: int = 10,
+        *,
+        candidate_timeout: Optional[float] = None,
+        driver_config: Optional[DriverConfig] = None,
+        driver_registry: DriverRegistry = DRIVER_REGISTRY,
+        fetch_size: int = 1000,
+        max_rows: Optional[int] = 10_000,
+        max_result_bytes: Optional[int] = 10 * 1024 * 1024,
+        schema_ttl: Optional[float] = 3600.0,
+        schema_snapshot_path: Optional[Union[str, Path]] = None,
+        schema_sample: Optional[int] = 1000,
+        schema_max_rels: Optional[int] = 100,
+        result_cache: Optional[ResultCache] = None,
+        graph_version_interval: float = 5.0,
+        explain_before_execute: bool = True,
+        cost_guard: Optional[CostGuard] = None,
+        static_check: bool = True,
+        sample_properties: tuple[str, ...] = ("name", "title"),
+        few_shot_store: Optional[FewShotStore] = None,
+        few_shot_k: int = 4,
+        few_shot_tokens: Optional[int] = 400,
+        prune_schema: bool = False,
+        prune_sample_limit: int = 1000,
+        schema_format: str = "verbose",
+    ):
+        if schema_format not in SCHEMA_FORMATS:
+            msg = f"Unknown schema format {schema_format}"
+            raise ValueError(msg)
         self.uri = uri
         self.user = user
         self.password = password
         self.driver = None
-        self.schema = None
         self.few_shots = few_shots
         self.query_timeout = query_timeout
+        # losing candidates that are still computing are stopped by the server at the latest after this timeout
+        self.candidate_timeout = candidate_timeout if candidate_timeout is not None else query_timeout
+        self.driver_config = driver_config
+        self.driver_registry = driver_registry
+        self.fetch_size = fetch_size
+        self.max_rows = max_rows
+        self.max_result_bytes = max_result_bytes
+        self.schema_sample = schema_sample
+        self.schema_max_rels = schema_max_rels
+        self.schema_cache = SchemaCache(
+            self._load_schema,
+            self._fingerprint,
+            ttl=schema_ttl,
+            snapshot_path=schema_snapshot_path,
+            identity=uri,
+        )
+        self.result_cache = result_cache
+        self.graph_version = VersionProbe(self._fingerprint, graph_version_interval)
+        self.explain_before_execute = explain_before_execute
+        self.cost_guard = cost_guard
+        self.static_check = static_check
+        self._schema_checker: Optional[tuple[int, CypherChecker]] = None
+        self._schema_repairer: Optional[tuple[int, CypherRepairer]] = None
+        self._prompt_prefix: Optional[tuple[int, str]] = None
+        self.sample_properties = sample_properties
+        self.few_shot_store = few_shot_store
+        self.few_shot_k = few_shot_k
+        self.few_shot_tokens = few_shot_tokens
+        self._value_samples: Optional[tuple[int, int, list[dict[str, str]]]] = None
+        self._schema_digest: Optional[tuple[int, str]] = None
+        # render only the part of the schema a question is about, the schema then moves out of the cached prefix
+        self.prune_schema = prune_schema
+        self.prune_sample_limit = prune_sample_limit
+        self._schema_index: Optional[tuple[int, SchemaIndex]] = None
+        self.schema_format = schema_format
 
     def connect(self) -> DataBaseAdapter:
-        self.driver = GraphDatabase.driver(self.uri, auth=(self.user, self.password))
-        self.driver.verify_connectivity()
+        self.driver = self.driver_registry.acquire(self.uri, (self.user, self.password), self.driver_config)
+        try:
+            self.driver.verify_connectivity()
+        except Exception:
+            self.driver_registry.release(self.uri, (self.user, self.password))
+            self.driver = None
+            raise
         self.is_connected = True
         return self
 
     def disconnect(self) -> DataBaseAdapter:
-        self.driver.close()
+        if self.driver is not None:
+            self.driver_registry.release(self.uri, (self.user, self.password))
         self.is_connected = False
         self.driver = None
         return self
@@ -59,75 +249,214 @@ class Neo4jAdapter(DataBaseAdapter):
         return f"CALL apoc.cypher.runTimeboxed(\"{query}\",{'{}'}, {millis})"
 
     def execute(self, query: str) -> list[dict[str, Any]]:
-        result_list = []
+        return self._execute(query)
+
+    def execute_cancellable(self, query: str, cancelled: threading.Event) -> list[dict[str, Any]]:
+        """Execute a candidate query, the transaction is rolled back once `cancelled` is set.
+
+        The flag is checked between records, a query that is still computing its first record runs until the
+        `candidate_timeout` of the adapter.
+        """
+        return self._execute(query, timeout=self.candidate_timeout, cancelled=cancelled)
 
-        @unit_of_work(timeout=self.query_timeout)
+    def _execute(
+        self, query: str, *, timeout: Optional[float] = None, cancelled: Optional[threading.Event] = None
+    ) -> QueryResult:
+        def read() -> QueryResult:
+            return self._read(
+                query, max_rows=self.max_rows, max_bytes=self.max_result_bytes, timeout=timeout, cancelled=cancelled
+            )
+
+        if self.result_cache is None:
+            return read()
+        graph_version = self.graph_version.current()
+        result = self.result_cache.get(self.uri, query, graph_version)
+        if result is None:
+            result = read()
+            self.result_cache.put(self.uri, query, result, graph_version)
+        return result
+
+    def _read(
+        self,
+        query: str,
+        parameters: Optional[dict[str, Any]] = None,
+        *,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        timeout: Optional[float] = None,
+        cancelled: Optional[threading.Event] = None,
+    ) -> QueryResult:
+        """Run a query in a managed read transaction, the driver retries it on transient errors.
+
+        Without `max_rows` and `max_bytes` the result is not capped, internal queries like the schema introspection
+        must not be truncated. Once `cancelled` is set the transaction is rolled back, which stops the query on the
+        server, and `QueryCancelledError` is raised.
+        """
+
+        @unit_of_work(timeout=timeout if timeout is not None else self.query_timeout)
         def transaction(tx):
-            return list(tx.run(query))
+            budget = RowBudget(max_rows, max_bytes)
+            rows = []
+            for record in tx.run(query, parameters):
+                if cancelled is not None and cancelled.is_set():
+                    raise QueryCancelledError(query)
+                row = record.data()
+                if not budget.admit(row):
+                    break
+                rows.append(row)
+            return QueryResult(rows, truncated=budget.truncated)
+
+        with self.driver.session(default_access_mode=READ_ACCESS, fetch_size=self.fetch_size) as session:
+            return session.execute_read(transaction)
 
+    def execute_stream(
+        self,
+        query: str,
+        *,
+        parameters: Optional[dict[str, Any]] = None,
+        fetch_size: Optional[int] = None,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ) -> ResultStream:
+        """Run a query and fetch its records lazily in batches of `fetch_size`.
+
+        Iteration stops once `max_rows` rows or `max_bytes` bytes of serialized rows are reached,
+        the limits default to the ones of the adapter and `ResultStream.truncated` reports if they were hit.
+        The records are read lazily in an auto-commit transaction, so unlike `execute` a transient error is not retried.
+        """
+        session = self.driver.session(default_access_mode=READ_ACCESS, fetch_size=fetch_size or self.fetch_size)
+        try:
+            result = session.run(Query(query, timeout=self.query_timeout), parameters)
+        except Exception:
+            session.close()
+            raise
+        budget = RowBudget(
+            max_rows if max_rows is not None else self.max_rows,
+            max_bytes if max_bytes is not None else self.max_result_bytes,
+        )
+        return ResultStream((record.data() for record in result), budget, on_close=session.close)
+
+    def explain(self, query: str) -> QueryPlan:
+        """Plan the query with EXPLAIN, planner errors are raised without executing the query"""
         with self.driver.session(default_access_mode=READ_ACCESS) as session:
-            results = session.execute_read(transaction)
-            for result in results:
-                result_list.append(result.data())
-            return result_list
+            summary = session.run(Query(f"EXPLAIN {query}", timeout=self.query_timeout)).consume()
+        return QueryPlan.from_summary(summary.plan)
 
-    def build_prompt(self, question: str) -> str:
-        schema = self.get_schema()
-        prompt = f"""Task:Generate Cypher statement to query a graph database.
-Instructions:
-Use only the provided relationship types and properties in the schema.
-Do not use any other relationship types or properties that are not provided.
-Schema:
-{schema}
-"""
-        if self.few_shots is not None:
-            prompt += f"""Hint: You can use the following queries as examples:
-{self.few_shots}"""
+    def schema_checker(self) -> CypherChecker:
+        """Returns a `CypherChecker` for the current schema, rebuilt whenever the cached schema changes"""
+        schema = self.get_structured_schema()
+        version = self.schema_cache.version
+        if self._schema_checker is None or self._schema_checker[0] != version:
+            self._schema_checker = (version, CypherChecker(schema))
+        return self._schema_checker[1]
 
-        prompt += f"""
-Note: Do not include any explanations or apologies in your responses.
-Do not respond to any questions that might ask anything else than for you to construct a Cypher statement.
-Do not include any text except the generated Cypher statement.
+    def check_against_schema(self, query: str) -> None:
+        """Check the query offline against the cached schema.
 
-The question is:
-{question}"""
+        Unknown labels raise a `CypherSchemaError`. Unknown relationship types, properties and directions are only
+        logged, they may be missing from the sampled schema and are left to `EXPLAIN` and the database.
+        """
+        errors, warnings = self.schema_checker().diagnose(query)
+        if errors:
+            raise CypherSchemaError(" ".join(errors + warnings))
+        if warnings:
+            logger.warning("Query may not match the sampled schema: %s", " ".join(warnings))
 
-        return prompt
+    def schema_repairer(self) -> CypherRepairer:
+        """Returns a `CypherRepairer` for the current schema, rebuilt whenever the cached schema changes"""
+        schema = self.get_structured_schema()
+        version = self.schema_cache.version
+        if self._schema_repairer is None or self._schema_repairer[0] != version:
+            self._schema_repairer = (version, CypherRepairer(schema))
+        return self._schema_repairer[1]
 
-    def get_schema(self) -> str:
-        if self.schema is None:
-            node_properties = self.execute(NODE_PROPERTIES_QUERY)
-            relationships_properties = self.execute(REL_PROPERTIES_QUERY)
-            relationships = self.execute(REL_QUERY)
+    def repair(self, query: str, error_message: str) -> Optional[str]:  # noqa: ARG002
+        repaired_query = self.schema_repairer().repair(query)
+        return repaired_query if repaired_query != query else None
 
-            self.schema = f"""
-            Node properties are the following:
-            {[el['output'] for el in node_properties]}
-            Relationship properties are the following:
-            {[el['output'] for el in relationships_properties]}
-            The relationships are the following:
-            {[el['output'] for el in relationships]}
-            """
+    def is_repairable(self, error: Exception) -> bool:
+        """Only syntax and schema errors can be fixed mechanically, timeouts and rejected plans need another query"""
+        return isinstance(error, (CypherSchemaError, CypherSyntaxError, CypherTypeError))
 
-        return self.schema
+    def validate(self, query: str) -> Optional[QueryPlan]:
+        if self.static_check:
+            self.check_against_schema(query)
+        if not self.explain_before_execute and self.cost_guard is None:
+            return None
+        plan = self.explain(query)
+        if self.cost_guard is not None:
+            self.cost_guard.check(plan, query)
+        return plan
 
-    def build_error_prompt(self, question: str, error_message: str, query: str) -> str:
-        schema = self.get_schema()
-        prompt = f"""Task:Fix this Cypher statement to query a graph database.
+    def prompt_prefix(self) -> str:
+        """System message shared by all generation and repair prompts, rendered once per schema version.
+
+        The prefix is byte identical between calls so the provider can cache its prefill.
+        """
+        schema = self.get_structured_schema()
+        version = self.schema_cache.version
+        if self._prompt_prefix is None or self._prompt_prefix[0] != version:
+            prefix_schema = None if self.prune_schema else self.render_schema(schema)
+            self._prompt_prefix = (version, self.render_prompt_prefix(prefix_schema))
+        return self._prompt_prefix[1]
+
+    def render_prompt_prefix(self, schema: Optional[str]) -> str:
+        prefix = """Task:Generate Cypher statements to query a graph database or fix generated ones that failed.
 Instructions:
 Use only the provided relationship types and properties in the schema.
 Do not use any other relationship types or properties that are not provided.
-Schema:
+"""
+        if schema is not None:
+            prefix += f"""Schema:
 {schema}
 """
         if self.few_shots is not None:
-            prompt += f"""Hint: You can use the following queries as examples:
+            prefix += f"""Hint: You can use the following queries as examples:
 {self.few_shots}"""
 
-        prompt += f"""Note: Do not include any explanations or apologies in your responses.
+        prefix += """
+Note: Do not include any explanations or apologies in your responses.
 Do not respond to any questions that might ask anything else than for you to construct a Cypher statement.
-Do not include any text except the generated Cypher statement.
+Do not include any text except the generated Cypher statement."""
+
+        return prefix
 
+    def schema_index(self) -> SchemaIndex:
+        """Returns a `SchemaIndex` of the current schema and sampled values, rebuilt whenever the schema changes"""
+        schema = self.get_structured_schema()
+        version = self.schema_cache.version
+        if self._schema_index is None or self._schema_index[0] != version:
+            self._schema_index = (version, SchemaIndex(schema, self.sample_values(self.prune_sample_limit)))
+        return self._schema_index[1]
+
+    def question_context(self, question: str) -> str:
+        """Prompt context that depends on the question: the pruned schema and similar examples"""
+        context = ""
+        if self.prune_schema:
+            context += f"Schema:\n{self.render_schema(self.schema_index().prune(question))}\n"
+        return context + self.few_shot_hint(question)
+
+    def few_shot_hint(self, question: str) -> str:
+        """Examples similar to the question, they change per question and therefore stay out of the prefix"""
+        if self.few_shot_store is None:
+            return ""
+        examples = self.few_shot_store.format(question, self.few_shot_k, self.few_shot_tokens)
+        if not examples:
+            return ""
+        return f"Hint: You can use the following queries as examples:\n{examples}\n"
+
+    def build_prompt_messages(self, question: str) -> list[dict[str, str]]:
+        return [
+            {"role": "system", "content": self.prompt_prefix()},
+            {"role": "user", "content": f"{self.question_context(question)}The question is:\n{question}"},
+        ]
+
+    def build_error_prompt_messages(self, question: str, error_message: str, query: str) -> list[dict[str, str]]:
+        return [
+            {"role": "system", "content": self.prompt_prefix()},
+            {
+                "role": "user",
+                "content": f"""{self.question_context(question)}Fix this Cypher statement.
 The question that should be answered is:
 {question}
 
@@ -136,6 +465,62 @@ The generated Cypher statement is:
 
 The error message is:
 `{error_message}`
-"""
+""",
+            },
+        ]
+
+    def build_prompt(self, question: str) -> str:
+        return join_messages(self.build_prompt_messages(question))
+
+    def render_schema(self, schema: dict[str, Any]) -> str:
+        """Renders a structured schema in the `schema_format` of the adapter"""
+        return SCHEMA_FORMATS[self.schema_format](schema)
+
+    def get_schema(self) -> str:
+        return self.render_schema(self.get_structured_schema())
 
-        return prompt
+    def get_structured_schema(self) -> dict[str, Any]:
+        return self.schema_cache.get()
+
+    def schema_terms(self) -> list[str]:
+        return schema_identifiers(self.get_structured_schema())
+
+    def schema_digest(self) -> Optional[str]:
+        schema = self.get_structured_schema()
+        version = self.schema_cache.version
+        if self._schema_digest is None or self._schema_digest[0] != version:
+            serialized_schema = json.dumps(schema, sort_keys=True).encode()
+            self._schema_digest = (version, hashlib.sha1(serialized_schema, usedforsecurity=False).hexdigest())
+        return self._schema_digest[1]
+
+    def sample_values(self, limit: int = 1000) -> list[dict[str, str]]:
+        """Distinct values of the `sample_properties` of up to `limit` nodes, read once per schema version"""
+        self.get_structured_schema()
+        version = self.schema_cache.version
+        if self._value_samples is None or self._value_samples[:2] != (version, limit):
+            parameters = self.value_sample_parameters(limit)
+            samples = self._read(VALUE_SAMPLE_QUERY, parameters)
+            self._value_samples = (version, limit, [dict(row) for row in samples])
+        return self._value_samples[2]
+
+    def value_sample_parameters(self, limit: int) -> dict[str, Any]:
+        return {"scan": limit, "limit": limit, "properties": list(self.sample_properties)}
+
+    def _load_schema(self) -> dict[str, Any]:
+        meta_data = self._read(SCHEMA_QUERY, self.schema_query_parameters())
+        return build_structured_schema(meta_data)
+
+    def schema_query_parameters(self) -> dict[str, Any]:
+        """`apoc.meta.data` config that bounds the introspection time on large graphs"""
+        config = {}
+        if self.schema_sample is not None:
+            config["sample"] = self.schema_sample
+        if self.schema_max_rels is not None:
+            config["maxRels"] = self.schema_max_rels
+        return {"config": config}
+
+    def _fingerprint(self) -> str:
+        return build_fingerprint(self._read(FINGERPRINT_QUERY))
+
+    def build_error_prompt(self, question: str, error_message: str, query: str) -> str:
+        return join_messages(self.build_error_prompt_messages(question, error_message, query))
@@ -0,0 +1,29 @@
+from dataclasses import dataclass, field
+from typing import Any, Iterator
+
+
+@dataclass
+class QueryPlan:
+    """An operator of the execution plan the Neo4j planner created for a query"""
+
+    operator: str
+    estimated_rows: float
+    arguments: dict[str, Any] = field(default_factory=dict)
+    children: list["QueryPlan"] = field(default_factory=list)
+
+    @classmethod
+    def from_summary(cls, plan: dict[str, Any]) -> "QueryPlan":
+        """Builds the plan from the `plan` of a neo4j result summary"""
+        arguments = plan.get("args", {})
+        return cls(
+            operator=plan["operatorType"].split("@")[0],
+            estimated_rows=float(arguments.get("EstimatedRows", 0.0)),
+            arguments=arguments,
+            children=[cls.from_summary(child) for child in plan.get("children", [])],
+        )
+
+    def walk(self) -> Iterator["QueryPlan"]:
+        """Iterates over this operator and all operators below it"""
+        yield self
+        for child in self.children:
+            yield from child.walk()
@@ -0,0 +1,89 @@
+import json
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+
+class QueryResult(list):
+    """Rows of a query result, `truncated` is set if a row cap or byte budget cut the result short
+    and `estimated_rows` holds the row estimate of the planner if the query was validated before."""
+
+    def __init__(
+        self,
+        rows: Iterable[dict[str, Any]] = (),
+        *,
+        truncated: bool = False,
+        estimated_rows: Optional[float] = None,
+    ):
+        super().__init__(rows)
+        self.truncated = truncated
+        self.estimated_rows = estimated_rows
+
+
+class RowBudget:
+    """Tracks the rows and bytes of a result against a row cap and byte budget"""
+
+    def __init__(self, max_rows: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.rows = 0
+        self.bytes = 0
+        self.truncated = False
+
+    def admit(self, row: dict[str, Any]) -> bool:
+        """Returns if the row still fits into the budget and accounts for it"""
+        if self.max_rows is not None and self.rows >= self.max_rows:
+            self.truncated = True
+            return False
+        size = len(json.dumps(row, default=str))
+        if self.max_bytes is not None and self.bytes + size > self.max_bytes:
+            self.truncated = True
+            return False
+        self.rows += 1
+        self.bytes += size
+        return True
+
+
+class ResultStream:
+    """Lazily fetched query result that stops at the row cap or byte budget"""
+
+    def __init__(
+        self,
+        rows: Iterator[dict[str, Any]],
+        budget: RowBudget,
+        on_close: Optional[Callable[[], None]] = None,
+    ):
+        self._rows = rows
+        self.budget = budget
+        self._on_close = on_close
+        self._closed = False
+
+    @property
+    def truncated(self) -> bool:
+        return self.budget.truncated
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        try:
+            for row in self._rows:
+                if not self.budget.admit(row):
+                    break
+                yield row
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Releases the underlying session, remaining records are discarded"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._on_close is not None:
+            self._on_close()
+
+    def to_result(self) -> QueryResult:
+        """Consumes the stream into a `QueryResult`"""
+        rows = list(self)
+        return QueryResult(rows, truncated=self.truncated)
+
+    def __enter__(self) -> "ResultStream":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
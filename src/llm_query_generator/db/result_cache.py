@@ -0,0 +1,163 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from .result import QueryResult
+
+CYPHER_KEYWORDS = {
+    "ALL", "AND", "ANY", "AS", "ASC", "ASCENDING", "BY", "CALL", "CASE", "CONTAINS", "COUNT", "DESC",
+    "DESCENDING", "DISTINCT", "ELSE", "END", "ENDS", "EXISTS", "FALSE", "IN", "IS", "LIMIT", "MATCH",
+    "NONE", "NOT", "NULL", "OPTIONAL", "OR", "ORDER", "RETURN", "SINGLE", "SKIP", "STARTS", "THEN",
+    "TRUE", "UNION", "UNWIND", "WHEN", "WHERE", "WITH", "XOR", "YIELD",
+}  # fmt: skip
+PUNCTUATION = set("()[]{},:;.=<>-+*/")
+WORD_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def normalize_cypher(query: str) -> str:
+    """Collapses whitespace and upper cases keywords outside of string literals and backtick quoted names.
+
+    Labels, relationship types, properties and variables are case sensitive in Cypher and are kept as they are.
+    """
+    tokens: list[str] = []
+    index = 0
+    while index < len(query):
+        char = query[index]
+        if char in "'\"`":
+            end = index + 1
+            while end < len(query) and query[end] != char:
+                end += 2 if query[end] == "\\" else 1
+            tokens.append(query[index : end + 1])
+            index = end + 1
+        elif char.isspace():
+            while index < len(query) and query[index].isspace():
+                index += 1
+            tokens.append(" ")
+        else:
+            match = WORD_PATTERN.match(query, index)
+            if match is None:
+                tokens.append(char)
+                index += 1
+                continue
+            word = match.group()
+            previous = next((token for token in reversed(tokens) if token != " "), "")
+            if word.upper() in CYPHER_KEYWORDS and previous not in (".", ":"):
+                word = word.upper()
+            tokens.append(word)
+            index = match.end()
+
+    normalized: list[str] = []
+    for position, token in enumerate(tokens):
+        if token == " ":
+            following = tokens[position + 1] if position + 1 < len(tokens) else ""
+            if not normalized or normalized[-1] in PUNCTUATION or following in PUNCTUATION or following == "":
+                continue
+        normalized.append(token)
+    return "".join(normalized).rstrip(";")
+
+
+@dataclass
+class CacheStats:
+    """Hit and miss counters of a cache"""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    size: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+@dataclass
+class CacheEntry:
+    result: QueryResult
+    graph_version: Optional[str]
+    expires_at: float
+
+
+class ResultCache:
+    """LRU cache of query results with a time to live.
+
+    Results are keyed on the normalized query and the identity of the database and are only served while
+    the graph version they were read at is still current.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[tuple[str, str], CacheEntry] = OrderedDict()
+        self._stats = CacheStats()
+        self._lock = threading.Lock()
+
+    def get(self, identity: str, query: str, graph_version: Optional[str] = None) -> Optional[QueryResult]:
+        key = (identity, normalize_cypher(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.graph_version != graph_version or time.time() > entry.expires_at):
+                del self._entries[key]
+                self._stats.invalidations += 1
+                entry = None
+            if entry is None:
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+            return QueryResult(entry.result, truncated=entry.result.truncated)
+
+    def put(self, identity: str, query: str, result: list[dict[str, Any]], graph_version: Optional[str] = None):
+        key = (identity, normalize_cypher(query))
+        expires_at = time.time() + self.ttl if self.ttl is not None else float("inf")
+        stored = QueryResult(result, truncated=getattr(result, "truncated", False))
+        with self._lock:
+            self._entries[key] = CacheEntry(stored, graph_version, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stats.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                self._stats.hits,
+                self._stats.misses,
+                self._stats.evictions,
+                self._stats.invalidations,
+                len(self._entries),
+            )
+
+
+class VersionProbe:
+    """Throttles a graph version probe so it runs at most once every `interval` seconds"""
+
+    def __init__(self, probe: Callable[[], str], interval: float = 5.0):
+        self.probe = probe
+        self.interval = interval
+        self.value: Optional[str] = None
+        self._probed_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def is_due(self) -> bool:
+        return time.monotonic() - self._probed_at >= self.interval
+
+    def set(self, value: str) -> None:
+        self.value = value
+        self._probed_at = time.monotonic()
+
+    def current(self) -> Optional[str]:
+        if self.is_due():
+            with self._lock:
+                if self.is_due():
+                    self.set(self.probe())
+        return self.value
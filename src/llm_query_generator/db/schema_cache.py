@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Optional, Union
+
+SNAPSHOT_FORMAT_VERSION = 2
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SchemaEntry:
+    """A cached schema together with the fingerprint of the graph it was read from"""
+
+    schema: dict[str, Any]
+    fingerprint: Optional[str]
+    loaded_at: float
+    version: int
+
+
+class SchemaCache:
+    """Caches the structured schema of a database.
+
+    Concurrent first requests share a single introspection run. Once `ttl` seconds have passed the cached
+    schema is still served while a background thread compares the cheap `fingerprint` of the graph and only
+    runs the expensive `loader` again if it changed. With a `snapshot_path` every loaded schema is written to
+    disk and read back on construction, so prompts can be built offline and restarts are ready immediately.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[], dict[str, Any]],
+        fingerprint: Optional[Callable[[], str]] = None,
+        ttl: Optional[float] = 3600.0,
+        snapshot_path: Optional[Union[str, Path]] = None,
+        identity: str = "",
+    ):
+        self.loader = loader
+        self.fingerprint = fingerprint
+        self.ttl = ttl
+        self.snapshot_path = Path(snapshot_path) if snapshot_path is not None else None
+        self.identity = identity
+        self._entry: Optional[SchemaEntry] = None
+        self._load_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        if self.snapshot_path is not None:
+            self._entry = self._read_snapshot()
+
+    @property
+    def version(self) -> int:
+        """Increases every time the cached schema changes, 0 if nothing is cached"""
+        entry = self._entry
+        return entry.version if entry is not None else 0
+
+    @property
+    def cached_fingerprint(self) -> Optional[str]:
+        entry = self._entry
+        return entry.fingerprint if entry is not None else None
+
+    def get(self) -> dict[str, Any]:
+        """Returns the cached schema, loading it on first use and refreshing it in the background once stale"""
+        entry = self._entry
+        if entry is None:
+            with self._load_lock:
+                if self._entry is None:
+                    self._reload(None)
+                return self._entry.schema
+        if self.is_stale():
+            self._refresh_in_background()
+        return entry.schema
+
+    def peek(self) -> Optional[dict[str, Any]]:
+        """Returns the cached schema without loading or refreshing it"""
+        entry = self._entry
+        return entry.schema if entry is not None else None
+
+    def is_stale(self) -> bool:
+        entry = self._entry
+        if entry is None:
+            return True
+        return self.ttl is not None and time.time() - entry.loaded_at > self.ttl
+
+    def put(self, schema: dict[str, Any], fingerprint: Optional[str] = None) -> None:
+        """Stores a schema that was loaded outside of the cache, e.g. by an async adapter"""
+        entry = self._entry
+        if entry is not None and entry.schema == schema:
+            self._entry = SchemaEntry(schema, fingerprint, time.time(), entry.version)
+        else:
+            self._entry = SchemaEntry(schema, fingerprint, time.time(), self.version + 1)
+        self._write_snapshot()
+
+    def touch(self) -> None:
+        """Marks the cached schema as fresh without reloading it"""
+        entry = self._entry
+        if entry is not None:
+            self._entry = SchemaEntry(entry.schema, entry.fingerprint, time.time(), entry.version)
+
+    def refresh(self) -> dict[str, Any]:
+        """Reloads the schema if the fingerprint of the graph changed since it was cached"""
+        with self._load_lock:
+            fingerprint = self.fingerprint() if self.fingerprint is not None else None
+            entry = self._entry
+            if entry is not None and fingerprint is not None and fingerprint == entry.fingerprint:
+                self.touch()
+            else:
+                self._reload(fingerprint)
+            return self._entry.schema
+
+    def invalidate(self) -> None:
+        """Drops the cached schema so the next `get` loads it again"""
+        self._entry = None
+
+    def _reload(self, fingerprint: Optional[str]) -> None:
+        if fingerprint is None and self.fingerprint is not None:
+            fingerprint = self.fingerprint()
+        self.put(self.loader(), fingerprint)
+
+    def _refresh_in_background(self) -> None:
+        with self._refresh_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self.refresh()
+            except Exception:
+                logger.warning("Background schema refresh failed, serving the cached schema", exc_info=True)
+                # Retry after another ttl instead of on every request while the database is unreachable
+                self.touch()
+            finally:
+                with self._refresh_lock:
+                    self._refreshing = False
+
+        threading.Thread(target=refresh, name="schema-refresh", daemon=True).start()
+
+    def _read_snapshot(self) -> Optional[SchemaEntry]:
+        if not self.snapshot_path.exists():
+            return None
+        try:
+            snapshot = json.loads(self.snapshot_path.read_text())
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable schema snapshot %s", self.snapshot_path, exc_info=True)
+            return None
+        if snapshot.get("format_version") != SNAPSHOT_FORMAT_VERSION or snapshot.get("identity") != self.identity:
+            return None
+        return SchemaEntry(snapshot["schema"], snapshot.get("fingerprint"), snapshot["loaded_at"], 1)
+
+    def _write_snapshot(self) -> None:
+        entry = self._entry
+        if self.snapshot_path is None or entry is None:
+            return
+        snapshot = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "identity": self.identity,
+            "fingerprint": entry.fingerprint,
+            "loaded_at": entry.loaded_at,
+            "schema": entry.schema,
+        }
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.snapshot_path.with_suffix(self.snapshot_path.suffix + ".tmp")
+        temporary_path.write_text(json.dumps(snapshot))
+        os.replace(temporary_path, self.snapshot_path)
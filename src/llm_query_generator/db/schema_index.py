@@ -0,0 +1,102 @@
+from typing import Any, Iterable
+
+from ..text_index import SparseIndex
+
+
+class SchemaIndex:
+    """Finds the part of a schema a question is about.
+
+    Labels and relationship types are indexed by their name, the names of their properties and sampled values of
+    their nodes, they match a question that covers at least `min_score` of one of their documents. The
+    `key_properties` are not indexed as most labels have them. `prune` keeps the matching labels and relationship
+    types, expands them by `hops` relationships so the kept part stays connected and drops the properties of
+    expanded labels that neither match the question nor are `key_properties`. Kept relationship types keep all their
+    properties, questions about a label often ask for the properties of its relationships.
+    """
+
+    def __init__(
+        self,
+        schema: dict[str, Any],
+        samples: Iterable[dict[str, str]] = (),
+        *,
+        min_score: float = 0.5,
+        hops: int = 1,
+        key_properties: tuple[str, ...] = ("id", "name", "title"),
+    ):
+        self.schema = schema
+        self.min_score = min_score
+        self.hops = hops
+        self.key_properties = key_properties
+        self.index: SparseIndex[tuple[str, str, int]] = SparseIndex(ngram=3)
+        owners = [("node", node["labels"], node["properties"]) for node in schema["node_properties"]]
+        owners += [
+            ("relationship", relationship["type"], relationship["properties"])
+            for relationship in schema["relationship_properties"]
+        ]
+        owners += [("relationship", relationship["type"], []) for relationship in schema["relationships"]]
+        for kind, name, properties in owners:
+            self.index.add((kind, name, 0), name)
+            for position, prop in enumerate(properties, start=1):
+                if prop["property"] not in key_properties:
+                    self.index.add((kind, name, position), prop["property"])
+        for position, sample in enumerate(samples):
+            self.index.add(("node", sample["label"], -1 - position), sample["value"])
+        self.index.norms()
+
+    def match(self, question: str) -> dict[tuple[str, str], set[str]]:
+        """The labels and relationship types that match the question with the names of their matching properties"""
+        matches: dict[tuple[str, str], set[str]] = {}
+        for (kind, name, position), score in self.index.coverage(question).items():
+            if score < self.min_score:
+                continue
+            matched_properties = matches.setdefault((kind, name), set())
+            if position > 0:
+                matched_properties.add(self.property_name(kind, name, position))
+        return matches
+
+    def property_name(self, kind: str, name: str, position: int) -> str:
+        owners = self.schema["node_properties"] if kind == "node" else self.schema["relationship_properties"]
+        key = "labels" if kind == "node" else "type"
+        owner = next(owner for owner in owners if owner[key] == name)
+        return owner["properties"][position - 1]["property"]
+
+    def prune(self, question: str) -> dict[str, Any]:
+        """The subgraph of the schema relevant to the question, the whole schema if nothing matches"""
+        matches = self.match(question)
+        if not matches:
+            return self.schema
+        labels = {name for kind, name in matches if kind == "node"}
+        types = {name for kind, name in matches if kind == "relationship"}
+        relationships = [
+            relationship
+            for relationship in self.schema["relationships"]
+            if relationship["type"] in types or {relationship["start"], relationship["end"]} <= labels
+        ]
+        for hop in range(self.hops + 1):
+            if hop > 0:
+                relationships = [
+                    relationship
+                    for relationship in self.schema["relationships"]
+                    if relationship["start"] in labels or relationship["end"] in labels
+                ]
+            labels.update(
+                label for relationship in relationships for label in (relationship["start"], relationship["end"])
+            )
+        types.update(relationship["type"] for relationship in relationships)
+
+        def properties(label: str, node_properties: list[dict[str, str]]) -> list[dict[str, str]]:
+            if ("node", label) in matches:
+                return node_properties
+            return [prop for prop in node_properties if prop["property"] in self.key_properties]
+
+        return {
+            "node_properties": [
+                {"labels": node["labels"], "properties": properties(node["labels"], node["properties"])}
+                for node in self.schema["node_properties"]
+                if node["labels"] in labels
+            ],
+            "relationship_properties": [
+                relationship for relationship in self.schema["relationship_properties"] if relationship["type"] in types
+            ],
+            "relationships": relationships,
+        }
@@ -1,2 +1,7 @@
 from .base import LLMAdapter
+from .completion_cache import CompletionCache
+from .hedging import HedgePolicy
 from .open_ai_model import OpenAILLM
+from .replay_model import ReplayLLM, ReplayMissError
+from .scheduler import ModelLimits, Priority, RequestScheduler, priority_context
+from .usage import UsageRecord, UsageStats, UsageTracker, atag_stream, tag_stream, usage_context
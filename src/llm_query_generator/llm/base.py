@@ -1,7 +1,10 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Generator
+from typing import AsyncGenerator, Generator, Optional, Union
 
+from ..async_utils import iterate_in_thread, run_sync
 from ..chat_history import ChatHistory
+from .scheduler import Priority, priority_context
 
 
 class LLMAdapter(ABC):
@@ -30,3 +33,64 @@ class LLMAdapter(ABC):
     def stream_generate(self, prompt: str) -> Generator[str, None, None]:
         """Stream a conversation from given prompt"""
         ...
+
+    async def agenerate(self, prompt: str) -> str:
+        """Generate a answer from the given prompt without blocking the event loop"""
+        return await self.achat([{"role": "user", "content": prompt}])
+
+    async def achat(self, formatted_history: list[dict[str, str]]) -> str:
+        """Chat with the model without blocking the event loop"""
+        return await asyncio.to_thread(self.chat, formatted_history)
+
+    async def acontinue_conversation(self, history: ChatHistory) -> str:
+        """Continue a conversation from given history without blocking the event loop"""
+        return await self.achat(history.format_for_model())
+
+    async def astream_chat(self, formatted_history: list[dict[str, str]]) -> AsyncGenerator[str, None]:
+        """Stream a conversation from given history without blocking the event loop"""
+        async for chunk in iterate_in_thread(self.stream_chat(formatted_history)):
+            yield chunk
+
+    async def astream_generate(self, prompt: str) -> AsyncGenerator[str, None]:
+        """Stream a conversation from given prompt without blocking the event loop"""
+        async for chunk in self.astream_chat([{"role": "user", "content": prompt}]):
+            yield chunk
+
+    def chat_candidates(
+        self, formatted_history: list[dict[str, str]], n: int, temperature: Optional[float] = None
+    ) -> list[str]:
+        """Sample n alternative answers to the same history, adapters that can sample use `temperature` for it"""
+        return run_sync(self.achat_candidates(formatted_history, n, temperature))
+
+    async def achat_candidates(
+        self, formatted_history: list[dict[str, str]], n: int, temperature: Optional[float] = None  # noqa: ARG002
+    ) -> list[str]:
+        """Sample n alternative answers to the same history concurrently"""
+        return list(await asyncio.gather(*(self.achat(formatted_history) for _ in range(n))))
+
+    async def agenerate_many(
+        self, prompts: list[str], max_concurrency: Optional[int] = None
+    ) -> list[Union[str, Exception]]:
+        """Generate answers for all prompts concurrently.
+
+        The answers keep the order of the prompts, a failing prompt yields its exception instead of an answer.
+        The requests are scheduled as batch requests, so interactive requests overtake them.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency is not None else None
+
+        async def generate(prompt: str) -> Union[str, Exception]:
+            try:
+                if semaphore is None:
+                    return await self.agenerate(prompt)
+                async with semaphore:
+                    return await self.agenerate(prompt)
+            except Exception as e:
+                return e
+
+        # the tasks copy the context when they are created
+        with priority_context(Priority.BATCH):
+            return await asyncio.gather(*(generate(prompt) for prompt in prompts))
+
+    def generate_many(self, prompts: list[str], max_concurrency: Optional[int] = None) -> list[Union[str, Exception]]:
+        """Blocking version of `agenerate_many`"""
+        return run_sync(self.agenerate_many(prompts, max_concurrency))
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional, Union
+
+
+def completion_key(request: dict[str, Any]) -> str:
+    """Hashes everything that determines a completion: model, sampling settings, response format and messages"""
+    serialized_request = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(serialized_request.encode()).hexdigest()
+
+
+class CompletionCache:
+    """Two tier cache of completions, an in memory LRU in front of an optional SQLite file.
+
+    Completions are stored as the list of streamed chunks so cached answers can be replayed by `stream_chat`.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: Optional[float] = None,
+        path: Optional[Union[str, Path]] = None,
+        max_disk_entries: int = 100_000,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self._memory: OrderedDict[str, tuple[list[str], float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(str(path), check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS completions "
+                "(key TEXT PRIMARY KEY, chunks TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            # the eviction reads the least recently used rows in order
+            self._connection.execute("CREATE INDEX IF NOT EXISTS completions_accessed_at ON completions (accessed_at)")
+            self._connection.commit()
+        # rows in the SQLite file, counted once so inserts do not have to count them
+        self._disk_entries = len(self) if self._connection is not None else 0
+
+    def get(self, key: str) -> Optional[list[str]]:
+        """Returns the cached chunks of a completion or None if it is not cached or expired"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                chunks, created_at = entry
+                if not self._is_expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    return list(chunks)
+                del self._memory[key]
+            if self._connection is None:
+                return None
+            row = self._connection.execute(
+                "SELECT chunks, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            chunks, created_at = json.loads(row[0]), row[1]
+            if self._is_expired(created_at, now):
+                self._connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._connection.commit()
+                self._disk_entries -= 1
+                return None
+            self._connection.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            self._remember(key, chunks, created_at)
+            return list(chunks)
+
+    def put(self, key: str, chunks: list[str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, list(chunks), now)
+            if self._connection is None:
+                return
+            exists = self._connection.execute("SELECT 1 FROM completions WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO completions (key, chunks, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(chunks), now, now),
+            )
+            if exists is None:
+                self._disk_entries += 1
+            if self._disk_entries > self.max_disk_entries:
+                self._prune()
+            self._connection.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM completions")
+                self._connection.commit()
+                self._disk_entries = 0
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            if self._connection is None:
+                return len(self._memory)
+            return self._connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def _prune(self) -> None:
+        """Deletes the least recently used rows above `max_disk_entries`, other processes may share the file"""
+        self._disk_entries = self._connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        excess = self._disk_entries - self.max_disk_entries
+        if excess <= 0:
+            return
+        self._connection.execute(
+            "DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY accessed_at LIMIT ?)",
+            (excess,),
+        )
+        self._disk_entries -= excess
+
+    def _remember(self, key: str, chunks: list[str], created_at: float) -> None:
+        self._memory[key] = (chunks, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
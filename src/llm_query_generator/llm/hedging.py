@@ -0,0 +1,197 @@
+import asyncio
+import contextvars
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, AsyncGenerator, Awaitable, Callable, Generator, Literal, Optional, TypeVar
+
+from .usage import current_usage_tags
+
+T = TypeVar("T")
+
+# completions are timed until they are complete, streams until their first chunk
+LatencyKind = Literal["completion", "first_token"]
+
+_END = object()
+
+
+class HedgePolicy:
+    """Decides when a slow LLM request gets a duplicate.
+
+    A request is hedged once it waited longer than the given percentile of the recently observed latencies of its
+    kind, the complete duration for completions and the time to the first chunk for streams. `budgets` caps the share
+    of the requests of a stage that may be hedged, so hedging can not double the spend; stages without a budget use
+    `default_budget`. Blocking calls run on a thread pool of `max_workers` threads shared by all calls of the policy.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        *,
+        window: int = 200,
+        min_samples: int = 20,
+        min_delay: float = 0.1,
+        budgets: Optional[dict[str, float]] = None,
+        default_budget: float = 0.05,
+        max_workers: int = 32,
+    ):
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.budgets = dict(budgets or {})
+        self.default_budget = default_budget
+        self.max_workers = max_workers
+        self.latencies: dict[LatencyKind, deque[float]] = {}
+        self.requests: dict[Optional[str], int] = {}
+        self.hedges: dict[Optional[str], int] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hedge")
+            return self._executor
+
+    def observe(self, latency: float, kind: LatencyKind = "completion") -> None:
+        with self._lock:
+            self.latencies.setdefault(kind, deque(maxlen=self.window)).append(latency)
+
+    def delay(self, kind: LatencyKind = "completion") -> Optional[float]:
+        """Seconds to wait before hedging, None while too few latencies of the kind were observed"""
+        with self._lock:
+            latencies = self.latencies.get(kind, ())
+            if len(latencies) < self.min_samples:
+                return None
+            cut_points = statistics.quantiles(latencies, n=100, method="inclusive")
+        index = min(max(round(self.percentile * 100) - 1, 0), len(cut_points) - 1)
+        return max(self.min_delay, cut_points[index])
+
+    def start(self, stage: Optional[str]) -> None:
+        with self._lock:
+            self.requests[stage] = self.requests.get(stage, 0) + 1
+
+    def allow_hedge(self, stage: Optional[str]) -> bool:
+        """Takes a hedge from the budget of the stage if there is one left"""
+        with self._lock:
+            budget = self.budgets.get(stage, self.default_budget)
+            if self.hedges.get(stage, 0) + 1 > budget * self.requests.get(stage, 0):
+                return False
+            self.hedges[stage] = self.hedges.get(stage, 0) + 1
+            return True
+
+
+def _winner(futures: set[Future]) -> Future:
+    """Waits for the first future that succeeds, or for the last one to fail"""
+    pending = set(futures)
+    while True:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None or not pending:
+                return future
+
+
+def hedged_call(
+    policy: HedgePolicy,
+    call: Callable[[], T],
+    discard: Optional[Callable[[T], None]] = None,
+    *,
+    kind: LatencyKind = "completion",
+) -> T:
+    """Runs a blocking call and issues a duplicate if it is slow, the result of the faster one is returned.
+
+    A blocking call can not be interrupted, the slower call finishes in the background and its result is passed to
+    `discard`, e.g. to record the usage it was billed for.
+    """
+    stage = current_usage_tags().stage
+    policy.start(stage)
+    delay = policy.delay(kind)
+    start = time.perf_counter()
+    if delay is None:
+        result = call()
+        policy.observe(time.perf_counter() - start, kind)
+        return result
+    futures = {policy.executor.submit(contextvars.copy_context().run, call)}
+    done, _ = wait(futures, timeout=delay)
+    if not done and policy.allow_hedge(stage):
+        futures.add(policy.executor.submit(contextvars.copy_context().run, call))
+    winner = _winner(futures)
+    if discard is not None:
+        for future in futures - {winner}:
+            future.add_done_callback(lambda future: discard(future.result()) if future.exception() is None else None)
+    policy.observe(time.perf_counter() - start, kind)
+    return winner.result()
+
+
+def hedged_stream(policy: HedgePolicy, open_stream: Callable[[], Generator[T, None, None]]) -> Generator[T, None, None]:
+    """Streams from a duplicate stream as well if the first chunk is slow, the stream that starts first is kept.
+
+    The other stream is closed as soon as its pending chunk arrives, which stops its generation.
+    """
+
+    def first_chunk() -> tuple[Generator[T, None, None], Any]:
+        stream = open_stream()
+        return stream, next(stream, _END)
+
+    stream, chunk = hedged_call(policy, first_chunk, discard=lambda result: result[0].close(), kind="first_token")
+    if chunk is _END:
+        return
+    yield chunk
+    yield from stream
+
+
+async def ahedged_call(policy: HedgePolicy, call: Callable[[], Awaitable[T]], *, kind: LatencyKind = "completion") -> T:
+    """Async version of `hedged_call`, the slower request is cancelled"""
+    stage = current_usage_tags().stage
+    policy.start(stage)
+    delay = policy.delay(kind)
+    start = time.perf_counter()
+    tasks = {asyncio.ensure_future(call())}
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and policy.allow_hedge(stage):
+                tasks.add(asyncio.ensure_future(call()))
+        pending = set(tasks)
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((task for task in done if task.exception() is None), None)
+            if winner is not None or not pending:
+                winner = winner or done.pop()
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    policy.observe(time.perf_counter() - start, kind)
+    return winner.result()
+
+
+async def ahedged_stream(
+    policy: HedgePolicy, open_stream: Callable[[], AsyncGenerator[T, None]]
+) -> AsyncGenerator[T, None]:
+    """Async version of `hedged_stream`, the slower stream is cancelled and closed"""
+    streams = []
+
+    async def first_chunk() -> tuple[AsyncGenerator[T, None], Any]:
+        stream = open_stream()
+        streams.append(stream)
+        try:
+            # the anext builtin needs Python 3.10
+            return stream, await stream.__anext__()
+        except StopAsyncIteration:
+            return stream, _END
+
+    stream, chunk = await ahedged_call(policy, first_chunk, kind="first_token")
+    for other in streams:
+        if other is not stream:
+            await other.aclose()
+    if chunk is _END:
+        return
+    yield chunk
+    async for chunk in stream:
+        yield chunk
@@ -1,8 +1,34 @@
-from typing import Generator, Optional
+import asyncio
+import time
+from collections import Counter
+from contextlib import AbstractAsyncContextManager, nullcontext
+from typing import Any, AsyncGenerator, Generator, Optional
 
-from openai import OpenAI
+from openai import (
+    DEFAULT_MAX_RETRIES,
+    APIConnectionError,
+    APIError,
+    AsyncOpenAI,
+    InternalServerError,
+    OpenAI,
+    RateLimitError,
+)
 
 from .base import LLMAdapter
+from .completion_cache import CompletionCache, completion_key
+from .hedging import HedgePolicy, ahedged_call, ahedged_stream, hedged_call, hedged_stream
+from .scheduler import (
+    Priority,
+    RequestScheduler,
+    current_priority,
+    estimate_prompt_tokens,
+    estimate_request_tokens,
+    estimate_tokens,
+)
+from .usage import UsageRecord, UsageTags, UsageTracker, current_usage_tags
+
+# errors the client would retry itself, timeouts are connection errors
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
 
 
 class OpenAILLM(LLMAdapter):
@@ -15,41 +41,320 @@ class OpenAILLM(LLMAdapter):
         temperature: float = 0.7,
         max_tokens: int = 50,
         response_format: Optional[dict] = None,
+        *,
+        cache: Optional[CompletionCache] = None,
+        max_concurrency: Optional[int] = None,
+        scheduler: Optional[RequestScheduler] = None,
+        priority: Priority = Priority.INTERACTIVE,
+        max_rate_limit_retries: int = 5,
+        max_transient_retries: int = DEFAULT_MAX_RETRIES,
+        usage_tracker: Optional[UsageTracker] = None,
+        hedge: Optional[HedgePolicy] = None,
     ):
         self.api_key = api_key
         self.model = model
         self.temperature = temperature
         self.max_tokens = max_tokens
-        self.client = OpenAI(api_key=api_key)
         self.response_format = response_format
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.scheduler = scheduler
+        self.priority = priority
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.max_transient_retries = max_transient_retries
+        self.usage_tracker = usage_tracker
+        self.hedge = hedge
+        # the scheduler retries failed requests itself, retries of the client would bypass the queue
+        self._client_retries = 0 if scheduler is not None else DEFAULT_MAX_RETRIES
+        self.client = OpenAI(api_key=api_key, max_retries=self._client_retries)
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_client: Optional[AsyncOpenAI] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """The async client of the running event loop, async clients can not be shared between loops"""
+        self._bind_to_running_loop()
+        return self._async_client
+
+    def _bind_to_running_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self._async_loop:
+            self._async_loop = loop
+            self._async_client = AsyncOpenAI(api_key=self.api_key, max_retries=self._client_retries)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency is not None else None
+
+    def _concurrency_slot(self) -> AbstractAsyncContextManager:
+        self._bind_to_running_loop()
+        return self._semaphore if self._semaphore is not None else nullcontext()
+
+    def _request(self, formatted_history: list[dict[str, str]]) -> dict[str, Any]:
+        return {
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "messages": formatted_history,
+            "response_format": self.response_format,
+        }
+
+    def _candidates_request(
+        self, formatted_history: list[dict[str, str]], n: int, temperature: Optional[float]
+    ) -> dict[str, Any]:
+        request = {**self._request(formatted_history), "n": n}
+        if temperature is not None:
+            request["temperature"] = temperature
+        return request
+
+    def _priority(self) -> Priority:
+        """The priority of the surrounding `priority_context`, the priority of the adapter outside of one"""
+        priority = current_priority()
+        return priority if priority is not None else self.priority
+
+    def _create(self, request: dict[str, Any], **kwargs: Any) -> Any:
+        if self.scheduler is None:
+            return self.client.chat.completions.create(**request, **kwargs)
+        tokens = estimate_request_tokens(request["messages"], request["max_tokens"] * request.get("n", 1))
+        retries: Counter[str] = Counter()
+        while True:
+            self.scheduler.acquire(self.model, tokens, self._priority())
+            try:
+                response = self.client.chat.completions.with_raw_response.create(**request, **kwargs)
+            except RETRYABLE_ERRORS as error:
+                time.sleep(self._retry_delay(error, retries))
+                continue
+            self.scheduler.update_from_headers(self.model, response.headers)
+            return response.parse()
+
+    async def _acreate(self, request: dict[str, Any], **kwargs: Any) -> Any:
+        if self.scheduler is None:
+            return await self.async_client.chat.completions.create(**request, **kwargs)
+        tokens = estimate_request_tokens(request["messages"], request["max_tokens"] * request.get("n", 1))
+        retries: Counter[str] = Counter()
+        while True:
+            await self.scheduler.aacquire(self.model, tokens, self._priority())
+            try:
+                response = await self.async_client.chat.completions.with_raw_response.create(**request, **kwargs)
+            except RETRYABLE_ERRORS as error:
+                await asyncio.sleep(self._retry_delay(error, retries))
+                continue
+            self.scheduler.update_from_headers(self.model, response.headers)
+            return response.parse()
+
+    def _retry_delay(self, error: APIError, retries: Counter[str]) -> float:
+        """Seconds to wait before a failed request is sent again, re-raises the error once its retries are used up.
+
+        A rate limit pauses every request of the model in the scheduler, other errors only delay the failed request.
+        """
+        if isinstance(error, RateLimitError):
+            if retries["rate_limit"] == self.max_rate_limit_retries:
+                raise error
+            self.scheduler.backoff(self.model, retries["rate_limit"], error.response.headers)
+            retries["rate_limit"] += 1
+            return 0.0
+        if retries["transient"] == self.max_transient_retries:
+            raise error
+        retries["transient"] += 1
+        return self.scheduler.retry_delay(retries["transient"] - 1)
+
+    def _hedged_create(self, request: dict[str, Any], tags: UsageTags, start: float) -> Any:
+        if self.hedge is None:
+            return self._create(request)
+
+        def track_loser(completion: Any) -> None:
+            # the slower request still runs to completion and is billed
+            content = "".join(choice.message.content or "" for choice in completion.choices)
+            self._track(request, tags, start, None, content, usage=completion.usage)
+
+        return hedged_call(self.hedge, lambda: self._create(request), discard=track_loser)
+
+    async def _ahedged_create(self, request: dict[str, Any]) -> Any:
+        async def create() -> Any:
+            async with self._concurrency_slot():
+                return await self._acreate(request)
+
+        if self.hedge is None:
+            return await create()
+        return await ahedged_call(self.hedge, create)
+
+    def _stream_chunks(self, request: dict[str, Any]) -> Generator[str, None, None]:
+        stream = self._create(request, stream=True)
+        try:
+            for chunk in stream:
+                if chunk.choices[0].delta.content is not None:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # closing the response stops the generation when the caller stops reading early
+            stream.response.close()
+
+    async def _astream_chunks(self, request: dict[str, Any]) -> AsyncGenerator[str, None]:
+        async with self._concurrency_slot():
+            stream = await self._acreate(request, stream=True)
+            try:
+                async for chunk in stream:
+                    if chunk.choices[0].delta.content is not None:
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.response.aclose()
+
+    def _hedged_stream(self, request: dict[str, Any]) -> Generator[str, None, None]:
+        if self.hedge is None:
+            return self._stream_chunks(request)
+        return hedged_stream(self.hedge, lambda: self._stream_chunks(request))
+
+    def _ahedged_stream(self, request: dict[str, Any]) -> AsyncGenerator[str, None]:
+        if self.hedge is None:
+            return self._astream_chunks(request)
+        return ahedged_stream(self.hedge, lambda: self._astream_chunks(request))
+
+    def _cacheable(self, request: dict[str, Any]) -> bool:
+        # sampled requests are expected to differ between calls, replaying one completion would defeat them
+        return self.cache is not None and request["temperature"] == 0 and request.get("n", 1) == 1
+
+    def _cached(self, request: dict[str, Any]) -> Optional[list[str]]:
+        if not self._cacheable(request):
+            return None
+        return self.cache.get(completion_key(request))
+
+    def _store(self, request: dict[str, Any], chunks: list[str]) -> None:
+        if self._cacheable(request):
+            self.cache.put(completion_key(request), chunks)
+
+    def _track(
+        self,
+        request: dict[str, Any],
+        tags: UsageTags,
+        start: float,
+        first_token_at: Optional[float],
+        content: str,
+        *,
+        cached: bool = False,
+        usage: Optional[Any] = None,
+    ) -> None:
+        """Records the usage of a call, streamed completions carry no usage so their tokens are estimated"""
+        if self.usage_tracker is None:
+            return
+        end = time.perf_counter()
+        self.usage_tracker.record(
+            UsageRecord(
+                model=self.model,
+                stage=tags.stage,
+                database=tags.database,
+                prompt_tokens=usage.prompt_tokens if usage is not None else estimate_prompt_tokens(request["messages"]),
+                completion_tokens=usage.completion_tokens if usage is not None else estimate_tokens(content),
+                time_to_first_token=(first_token_at or end) - start,
+                duration=end - start,
+                cached=cached,
+                estimated=usage is None,
+            )
+        )
 
     def generate(self, prompt: str) -> str:
         message = [{"role": "user", "content": prompt}]
         return self.chat(message)
 
     def chat(self, formatted_history: list[dict[str, str]]) -> str:
-        completion = self.client.chat.completions.create(
-            model=self.model,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens,
-            messages=formatted_history,
-            response_format=self.response_format,
-        )
-        return completion.choices[0].message.content
+        request = self._request(formatted_history)
+        tags, start = current_usage_tags(), time.perf_counter()
+        cached_chunks = self._cached(request)
+        if cached_chunks is not None:
+            content = "".join(cached_chunks)
+            self._track(request, tags, start, None, content, cached=True)
+            return content
+        completion = self._hedged_create(request, tags, start)
+        content = completion.choices[0].message.content
+        self._track(request, tags, start, None, content, usage=completion.usage)
+        self._store(request, [content])
+        return content
+
+    def chat_candidates(
+        self, formatted_history: list[dict[str, str]], n: int, temperature: Optional[float] = None
+    ) -> list[str]:
+        """Samples all candidates in one request, the prompt is only paid for once"""
+        request = self._candidates_request(formatted_history, n, temperature)
+        tags, start = current_usage_tags(), time.perf_counter()
+        # the cache keeps the candidates in place of the chunks of a single completion
+        cached_candidates = self._cached(request)
+        if cached_candidates is not None:
+            self._track(request, tags, start, None, "".join(cached_candidates), cached=True)
+            return cached_candidates
+        completion = self._hedged_create(request, tags, start)
+        candidates = [choice.message.content for choice in completion.choices]
+        self._track(request, tags, start, None, "".join(candidates), usage=completion.usage)
+        self._store(request, candidates)
+        return candidates
+
+    async def achat_candidates(
+        self, formatted_history: list[dict[str, str]], n: int, temperature: Optional[float] = None
+    ) -> list[str]:
+        request = self._candidates_request(formatted_history, n, temperature)
+        tags, start = current_usage_tags(), time.perf_counter()
+        cached_candidates = self._cached(request)
+        if cached_candidates is not None:
+            self._track(request, tags, start, None, "".join(cached_candidates), cached=True)
+            return cached_candidates
+        completion = await self._ahedged_create(request)
+        candidates = [choice.message.content for choice in completion.choices]
+        self._track(request, tags, start, None, "".join(candidates), usage=completion.usage)
+        self._store(request, candidates)
+        return candidates
 
     def stream_chat(self, formatted_history: list[dict[str, str]]) -> Generator[str, None, None]:
-        stream = self.client.chat.completions.create(
-            model=self.model,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens,
-            messages=formatted_history,
-            response_format=self.response_format,
-            stream=True,
-        )
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                yield chunk.choices[0].delta.content
+        request = self._request(formatted_history)
+        tags, start = current_usage_tags(), time.perf_counter()
+        cached_chunks = self._cached(request)
+        if cached_chunks is not None:
+            self._track(request, tags, start, None, "".join(cached_chunks), cached=True)
+            yield from cached_chunks
+            return
+        stream = self._hedged_stream(request)
+        chunks = []
+        first_token_at = None
+        try:
+            for chunk in stream:
+                first_token_at = first_token_at or time.perf_counter()
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            stream.close()
+            self._track(request, tags, start, first_token_at, "".join(chunks))
+        self._store(request, chunks)
 
     def stream_generate(self, prompt: str) -> Generator[str, None, None]:
         message = [{"role": "user", "content": prompt}]
         yield from self.stream_chat(message)
+
+    async def achat(self, formatted_history: list[dict[str, str]]) -> str:
+        request = self._request(formatted_history)
+        tags, start = current_usage_tags(), time.perf_counter()
+        cached_chunks = self._cached(request)
+        if cached_chunks is not None:
+            content = "".join(cached_chunks)
+            self._track(request, tags, start, None, content, cached=True)
+            return content
+        completion = await self._ahedged_create(request)
+        content = completion.choices[0].message.content
+        self._track(request, tags, start, None, content, usage=completion.usage)
+        self._store(request, [content])
+        return content
+
+    async def astream_chat(self, formatted_history: list[dict[str, str]]) -> AsyncGenerator[str, None]:
+        request = self._request(formatted_history)
+        tags, start = current_usage_tags(), time.perf_counter()
+        cached_chunks = self._cached(request)
+        if cached_chunks is not None:
+            self._track(request, tags, start, None, "".join(cached_chunks), cached=True)
+            for chunk in cached_chunks:
+                yield chunk
+            return
+        stream = self._ahedged_stream(request)
+        chunks = []
+        first_token_at = None
+        try:
+            async for chunk in stream:
+                first_token_at = first_token_at or time.perf_counter()
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            await stream.aclose()
+            self._track(request, tags, start, first_token_at, "".join(chunks))
+        self._store(request, chunks)
@@ -0,0 +1,242 @@
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import AsyncGenerator, Generator, Literal, Optional, Union
+
+from .base import LLMAdapter
+from .completion_cache import completion_key
+
+CHUNK_PATTERN = re.compile(r"\S+\s*|\s+")
+DECISION_QUESTION_PATTERN = re.compile(r"The question is:(.*?)\nThe current chat history is:", re.DOTALL)
+QUERY_QUESTION_PATTERN = re.compile(
+    r"(?:The question is:|The question that should be answered is:)\n(.*?)(?:\n\nThe generated Cypher statement is:|$)",
+    re.DOTALL,
+)
+ANSWER_QUESTION_PATTERN = re.compile(r"Question: (.*?)\n\s*Helpful Answer:", re.DOTALL)
+
+Mode = Literal["record", "replay", "synthetic"]
+
+
+class ReplayMissError(KeyError):
+    """Raised in replay mode when no recording matches the request"""
+
+
+class Recording:
+    """A recorded completion with the delay before each of its chunks"""
+
+    def __init__(self, chunks: list[str], delays: list[float]):
+        self.chunks = chunks
+        self.delays = delays
+
+    @classmethod
+    def from_text(cls, text: str, duration: float) -> "Recording":
+        """Splits a text into word chunks and spreads the duration evenly over them"""
+        chunks = CHUNK_PATTERN.findall(text) or [text]
+        return cls(chunks, [duration / len(chunks)] * len(chunks))
+
+
+def read_evaluation_csv(path: Path) -> list[dict[str, str]]:
+    with open(path, newline="", encoding="utf-8") as file:
+        return list(csv.DictReader(file, delimiter=";"))
+
+
+def evaluation_results_dir() -> Path:
+    """The `evaluation_results` directory of the working directory, `EVALUATION_RESULTS_DIR` overrides it"""
+    return Path(os.getenv("EVALUATION_RESULTS_DIR", "evaluation_results")).resolve()
+
+
+def parse_duration(value: Optional[str]) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class SyntheticAnswers:
+    """Answers the prompts of the pipelines with the recorded answers of the evaluation runs.
+
+    Questions of the evaluation runs get their recorded answer and duration, other questions get the answer of an
+    evaluation question picked by a stable hash, so load tests see realistic answer sizes and latencies.
+    """
+
+    def __init__(self, results_dir: Optional[Union[str, Path]] = None):
+        results_dir = Path(results_dir) if results_dir is not None else evaluation_results_dir()
+        if not results_dir.is_dir():
+            msg = f"No evaluation results directory at {results_dir}"
+            raise FileNotFoundError(msg)
+        self.queries: dict[str, Recording] = {}
+        self.answers: dict[str, Recording] = {}
+        self.databases: dict[str, tuple[str, float]] = {}
+        self.history_decisions: dict[str, bool] = {}
+        for path in sorted(results_dir.glob("Clevr_Generation_*.csv"), reverse=True):
+            for row in read_evaluation_csv(path):
+                question = row["question"].strip()
+                if row.get("cleaned_query"):
+                    query = Recording.from_text(row["cleaned_query"], parse_duration(row["duration_query_generation"]))
+                    self.queries.setdefault(question, query)
+                if row.get("chat_generation_answer"):
+                    duration = parse_duration(row["duration_chat_answer"])
+                    answer = Recording.from_text(row["chat_generation_answer"], duration)
+                    self.answers.setdefault(question, answer)
+        database_decisions = results_dir / "All_Database_Decisions.csv"
+        if database_decisions.exists():
+            for row in read_evaluation_csv(database_decisions):
+                self.databases[row["Question"].strip()] = (row["Chatbot Decision"], parse_duration(row["Duration"]))
+        for path in sorted(results_dir.glob("All_*History*.csv")):
+            for row in read_evaluation_csv(path):
+                questions = [value for key, value in row.items() if key.startswith(("Question", "Followup Question"))]
+                if questions and questions[-1].strip():
+                    decision = row["Used History Chatbot Decision"] == "True"
+                    self.history_decisions.setdefault(questions[-1].strip(), decision)
+
+    def recording(self, prompt: str) -> Recording:
+        if match := DECISION_QUESTION_PATTERN.search(prompt):
+            return self._decision(match.group(1).strip())
+        if match := ANSWER_QUESTION_PATTERN.search(prompt):
+            return self._pick(self.answers, match.group(1).strip())
+        if match := QUERY_QUESTION_PATTERN.search(prompt):
+            return self._pick(self.queries, match.group(1).strip())
+        return self._pick(self.answers, prompt)
+
+    def _decision(self, question: str) -> Recording:
+        database, duration = self.databases.get(question, ("None", 0.0))
+        can_answer_from_history = self.history_decisions.get(question, False)
+        decision = {"database": database, "can_answer_from_history": can_answer_from_history}
+        return Recording([json.dumps(decision)], [duration])
+
+    def _pick(self, recordings: dict[str, Recording], question: str) -> Recording:
+        if question in recordings:
+            return recordings[question]
+        if not recordings:
+            return Recording([""], [0.0])
+        index = int(hashlib.sha1(question.encode(), usedforsecurity=False).hexdigest(), 16) % len(recordings)
+        return list(recordings.values())[index]
+
+
+class ReplayLLM(LLMAdapter):
+    """LLM that records, replays or synthesizes completions so the pipelines can run without network access.
+
+    `record` forwards every request to `llm` and appends the prompt, chunks and chunk timings to `path`.
+    `replay` serves the recordings of `path` and `synthetic` answers from the evaluation results in `results_dir`,
+    by default the `evaluation_results` directory of the working directory or `EVALUATION_RESULTS_DIR`.
+    `latency_scale` replays the recorded timings, 0 answers instantly and 1 takes as long as the original.
+    """
+
+    def __init__(
+        self,
+        mode: Mode = "replay",
+        path: Optional[Union[str, Path]] = None,
+        *,
+        llm: Optional[LLMAdapter] = None,
+        results_dir: Optional[Union[str, Path]] = None,
+        latency_scale: float = 0.0,
+    ):
+        if mode in ("record", "replay") and path is None:
+            msg = f"{mode} mode needs the path of the recordings"
+            raise ValueError(msg)
+        if mode == "record" and llm is None:
+            msg = "record mode needs the llm to record"
+            raise ValueError(msg)
+        if mode not in ("record", "replay", "synthetic"):
+            msg = f"Unknown mode {mode}"
+            raise ValueError(msg)
+        self.mode = mode
+        self.path = Path(path) if path is not None else None
+        self.llm = llm
+        self.latency_scale = latency_scale
+        self.recordings: dict[str, Recording] = {}
+        self._lock = threading.Lock()
+        if mode == "replay":
+            self.recordings = self.load(self.path)
+        self.synthetic = SyntheticAnswers(results_dir) if mode == "synthetic" else None
+
+    @staticmethod
+    def load(path: Path) -> dict[str, Recording]:
+        recordings = {}
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    recordings[entry["key"]] = Recording(entry["chunks"], entry["delays"])
+        return recordings
+
+    def _save(self, formatted_history: list[dict[str, str]], recording: Recording) -> None:
+        entry = {
+            "key": completion_key({"messages": formatted_history}),
+            "messages": formatted_history,
+            "chunks": recording.chunks,
+            "delays": recording.delays,
+        }
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.recordings[entry["key"]] = recording
+
+    def _lookup(self, formatted_history: list[dict[str, str]]) -> Recording:
+        if self.synthetic is not None:
+            return self.synthetic.recording(formatted_history[-1]["content"])
+        key = completion_key({"messages": formatted_history})
+        if key not in self.recordings:
+            msg = f"No recording for the prompt {formatted_history[-1]['content'][:80]!r}"
+            raise ReplayMissError(msg)
+        return self.recordings[key]
+
+    def _record_stream(self, formatted_history: list[dict[str, str]]) -> Generator[str, None, None]:
+        chunks, delays = [], []
+        last_chunk_at = time.perf_counter()
+        for chunk in self.llm.stream_chat(formatted_history):
+            now = time.perf_counter()
+            chunks.append(chunk)
+            delays.append(now - last_chunk_at)
+            last_chunk_at = now
+            yield chunk
+        self._save(formatted_history, Recording(chunks, delays))
+
+    def generate(self, prompt: str) -> str:
+        return self.chat([{"role": "user", "content": prompt}])
+
+    def chat(self, formatted_history: list[dict[str, str]]) -> str:
+        if self.mode == "record":
+            start = time.perf_counter()
+            answer = self.llm.chat(formatted_history)
+            self._save(formatted_history, Recording([answer], [time.perf_counter() - start]))
+            return answer
+        recording = self._lookup(formatted_history)
+        time.sleep(sum(recording.delays) * self.latency_scale)
+        return "".join(recording.chunks)
+
+    def stream_chat(self, formatted_history: list[dict[str, str]]) -> Generator[str, None, None]:
+        if self.mode == "record":
+            yield from self._record_stream(formatted_history)
+            return
+        recording = self._lookup(formatted_history)
+        for chunk, delay in zip(recording.chunks, recording.delays):
+            time.sleep(delay * self.latency_scale)
+            yield chunk
+
+    def stream_generate(self, prompt: str) -> Generator[str, None, None]:
+        yield from self.stream_chat([{"role": "user", "content": prompt}])
+
+    async def achat(self, formatted_history: list[dict[str, str]]) -> str:
+        if self.mode == "record":
+            return await super().achat(formatted_history)
+        recording = self._lookup(formatted_history)
+        await asyncio.sleep(sum(recording.delays) * self.latency_scale)
+        return "".join(recording.chunks)
+
+    async def astream_chat(self, formatted_history: list[dict[str, str]]) -> AsyncGenerator[str, None]:
+        if self.mode == "record":
+            async for chunk in super().astream_chat(formatted_history):
+                yield chunk
+            return
+        recording = self._lookup(formatted_history)
+        for chunk, delay in zip(recording.chunks, recording.delays):
+            await asyncio.sleep(delay * self.latency_scale)
+            yield chunk
@@ -0,0 +1,269 @@
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Iterator, Mapping, Optional
+
+DURATION_PATTERN = re.compile(r"(?P<value>\d+(?:\.\d+)?)(?P<unit>ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class Priority(IntEnum):
+    """Scheduling priority of a request, lower values are served first"""
+
+    INTERACTIVE = 0
+    BATCH = 10
+
+
+REQUEST_PRIORITY: ContextVar[Optional[Priority]] = ContextVar("request_priority", default=None)
+
+
+@contextmanager
+def priority_context(priority: Priority) -> Iterator[Priority]:
+    """Schedules the LLM requests made inside the block with the given priority instead of the adapter default"""
+    token = REQUEST_PRIORITY.set(priority)
+    try:
+        yield priority
+    finally:
+        REQUEST_PRIORITY.reset(token)
+
+
+def current_priority() -> Optional[Priority]:
+    return REQUEST_PRIORITY.get()
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate of roughly four characters per token"""
+    return math.ceil(len(text) / 4)
+
+
+def estimate_prompt_tokens(formatted_history: list[dict[str, str]]) -> int:
+    """Estimated prompt tokens including the few tokens each message adds"""
+    return sum(estimate_tokens(message["content"]) + 4 for message in formatted_history)
+
+
+def estimate_request_tokens(formatted_history: list[dict[str, str]], max_tokens: int) -> int:
+    """Estimated prompt tokens plus the completion tokens a request may use, like the provider counts them"""
+    return estimate_prompt_tokens(formatted_history) + max_tokens
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """Parses durations of rate limit headers like `20ms`, `1.5s` or `6m0s` into seconds"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    matches = list(DURATION_PATTERN.finditer(value))
+    if not matches:
+        return None
+    return sum(float(match.group("value")) * DURATION_UNITS[match.group("unit")] for match in matches)
+
+
+@dataclass
+class ModelLimits:
+    """Requests and tokens per minute a model may use"""
+
+    requests_per_minute: int = 500
+    tokens_per_minute: int = 80_000
+
+
+class TokenBucket:
+    """Token bucket that refills continuously up to its capacity"""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def time_until(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available, requests larger than the capacity wait for a full bucket"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def consume(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    def set_remaining(self, remaining: float, now: float) -> None:
+        self._refill(now)
+        self.tokens = min(self.tokens, remaining)
+
+    def resize(self, capacity: float, refill_per_second: float, now: float) -> None:
+        """Changes the capacity, a larger capacity is available right away and a smaller one caps the tokens"""
+        self._refill(now)
+        self.tokens = min(capacity, self.tokens + max(0.0, capacity - self.capacity))
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+
+
+@dataclass(order=True)
+class Ticket:
+    priority: int
+    sequence: int
+    model: str = field(compare=False)
+    tokens: int = field(compare=False)
+
+
+@dataclass
+class ModelState:
+    requests: TokenBucket
+    tokens: TokenBucket
+    paused_until: float = 0.0
+    waiting: list[Ticket] = field(default_factory=list)
+
+
+class RequestScheduler:
+    """Schedules LLM requests so they stay within the requests and tokens per minute of each model.
+
+    Requests wait in a priority queue per model, so interactive chats overtake batch jobs. The buckets start with the
+    configured limits, follow the limit and remaining headers of the responses and a 429 pauses the model for the
+    time the provider asks for.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Mapping[str, ModelLimits]] = None,
+        default_limits: Optional[ModelLimits] = None,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+    ):
+        self.limits = dict(limits or {})
+        self.default_limits = default_limits or ModelLimits()
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._models: dict[str, ModelState] = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _state(self, model: str) -> ModelState:
+        state = self._models.get(model)
+        if state is None:
+            limits = self.limits.get(model, self.default_limits)
+            state = ModelState(
+                TokenBucket(limits.requests_per_minute, limits.requests_per_minute / 60),
+                TokenBucket(limits.tokens_per_minute, limits.tokens_per_minute / 60),
+            )
+            self._models[model] = state
+        return state
+
+    def _enqueue(self, model: str, tokens: int, priority: Priority) -> Ticket:
+        with self._condition:
+            ticket = Ticket(int(priority), next(self._sequence), model, tokens)
+            heapq.heappush(self._state(model).waiting, ticket)
+            return ticket
+
+    def _try_acquire(self, ticket: Ticket) -> float:
+        """Acquires capacity for the ticket if it is next in line, otherwise returns how long to wait"""
+        now = time.monotonic()
+        state = self._state(ticket.model)
+        if state.waiting[0] is not ticket:
+            return 0.05
+        wait = max(
+            state.paused_until - now,
+            state.requests.time_until(1, now),
+            state.tokens.time_until(ticket.tokens, now),
+        )
+        if wait > 0:
+            return wait
+        state.requests.consume(1, now)
+        state.tokens.consume(ticket.tokens, now)
+        heapq.heappop(state.waiting)
+        self._condition.notify_all()
+        return 0.0
+
+    def _cancel(self, ticket: Ticket) -> None:
+        with self._condition:
+            state = self._state(ticket.model)
+            if ticket in state.waiting:
+                state.waiting.remove(ticket)
+                heapq.heapify(state.waiting)
+                self._condition.notify_all()
+
+    def acquire(self, model: str, tokens: int, priority: Priority = Priority.INTERACTIVE) -> None:
+        """Blocks until the request may be sent"""
+        ticket = self._enqueue(model, tokens, priority)
+        try:
+            with self._condition:
+                while True:
+                    wait = self._try_acquire(ticket)
+                    if wait == 0.0:
+                        return
+                    self._condition.wait(timeout=wait)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+    async def aacquire(self, model: str, tokens: int, priority: Priority = Priority.INTERACTIVE) -> None:
+        """Waits without blocking the event loop until the request may be sent"""
+        ticket = self._enqueue(model, tokens, priority)
+        try:
+            while True:
+                with self._condition:
+                    wait = self._try_acquire(ticket)
+                if wait == 0.0:
+                    return
+                await asyncio.sleep(min(wait, 0.05))
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+    def update_from_headers(self, model: str, headers: Mapping[str, str]) -> None:
+        """Aligns the buckets with the per minute limits and the remaining requests and tokens the provider reported"""
+        with self._condition:
+            now = time.monotonic()
+            state = self._state(model)
+            limit_requests = headers.get("x-ratelimit-limit-requests")
+            limit_tokens = headers.get("x-ratelimit-limit-tokens")
+            if limit_requests is not None and float(limit_requests) != state.requests.capacity:
+                state.requests.resize(float(limit_requests), float(limit_requests) / 60, now)
+            if limit_tokens is not None and float(limit_tokens) != state.tokens.capacity:
+                state.tokens.resize(float(limit_tokens), float(limit_tokens) / 60, now)
+            remaining_requests = headers.get("x-ratelimit-remaining-requests")
+            remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+            if remaining_requests is not None:
+                state.requests.set_remaining(float(remaining_requests), now)
+            if remaining_tokens is not None:
+                state.tokens.set_remaining(float(remaining_tokens), now)
+
+    def retry_delay(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))  # noqa: S311
+
+    def backoff(self, model: str, attempt: int, headers: Optional[Mapping[str, str]] = None) -> float:
+        """Pauses the model after a rate limit error and returns the pause in seconds.
+
+        The pause honors `retry-after` and the reset headers, otherwise it is an exponential backoff with full jitter.
+        """
+        delay = None
+        if headers is not None:
+            for header in ("retry-after-ms", "retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+                value = headers.get(header)
+                if value is not None:
+                    delay = parse_duration(value)
+                    if delay is not None and header == "retry-after-ms":
+                        delay /= 1000
+                    if delay is not None:
+                        break
+        if delay is None:
+            delay = self.retry_delay(attempt)
+        with self._condition:
+            state = self._state(model)
+            state.paused_until = max(state.paused_until, time.monotonic() + delay)
+            self._condition.notify_all()
+        return delay
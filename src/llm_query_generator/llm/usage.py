@@ -0,0 +1,163 @@
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+# statistics.quantiles needs at least two data points
+MIN_QUANTILE_SAMPLES = 2
+
+
+@dataclass(frozen=True)
+class UsageTags:
+    """Pipeline stage and database a LLM call is made for"""
+
+    stage: Optional[str] = None
+    database: Optional[str] = None
+
+
+NO_USAGE_TAGS = UsageTags()
+USAGE_TAGS: ContextVar[UsageTags] = ContextVar("usage_tags", default=NO_USAGE_TAGS)
+
+
+@contextmanager
+def usage_context(stage: Optional[str] = None, database: Optional[str] = None) -> Iterator[UsageTags]:
+    """Tags the LLM calls made inside the block, tags that are not given are inherited from the outer block"""
+    outer = USAGE_TAGS.get()
+    tags = UsageTags(stage or outer.stage, database or outer.database)
+    token = USAGE_TAGS.set(tags)
+    try:
+        yield tags
+    finally:
+        USAGE_TAGS.reset(token)
+
+
+def current_usage_tags() -> UsageTags:
+    return USAGE_TAGS.get()
+
+
+def tag_stream(chunks: Iterator[T], stage: Optional[str] = None, database: Optional[str] = None) -> Iterator[T]:
+    """Iterates a stream with the tags set only while a chunk is produced.
+
+    Streams are consumed across yields of the pipelines, which may resume in another context, so the tags can not
+    stay set for the whole stream.
+    """
+    while True:
+        with usage_context(stage, database):
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+        yield chunk
+
+
+async def atag_stream(
+    chunks: AsyncIterator[T], stage: Optional[str] = None, database: Optional[str] = None
+) -> AsyncIterator[T]:
+    """Async version of `tag_stream`"""
+    while True:
+        with usage_context(stage, database):
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                return
+        yield chunk
+
+
+@dataclass
+class UsageRecord:
+    model: str
+    stage: Optional[str]
+    database: Optional[str]
+    prompt_tokens: int
+    completion_tokens: int
+    time_to_first_token: float
+    duration: float
+    cached: bool = False
+    estimated: bool = False
+    timestamp: float = field(default_factory=time.time)
+
+
+@dataclass
+class UsageStats:
+    calls: int = 0
+    cached_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    time_to_first_token: list[float] = field(default_factory=list)
+
+    @property
+    def mean_prompt_tokens(self) -> float:
+        uncached_calls = self.calls - self.cached_calls
+        return self.prompt_tokens / uncached_calls if uncached_calls else 0.0
+
+    @property
+    def median_time_to_first_token(self) -> float:
+        return statistics.median(self.time_to_first_token) if self.time_to_first_token else 0.0
+
+    @property
+    def p95_time_to_first_token(self) -> float:
+        if len(self.time_to_first_token) < MIN_QUANTILE_SAMPLES:
+            return self.median_time_to_first_token
+        return statistics.quantiles(self.time_to_first_token, n=20)[-1]
+
+    def add(self, record: UsageRecord) -> None:
+        self.calls += 1
+        if record.cached:
+            self.cached_calls += 1
+            return
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.time_to_first_token.append(record.time_to_first_token)
+
+    def as_dict(self) -> dict[str, float]:
+        return {
+            "calls": self.calls,
+            "cached_calls": self.cached_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "mean_prompt_tokens": self.mean_prompt_tokens,
+            "median_time_to_first_token": self.median_time_to_first_token,
+            "p95_time_to_first_token": self.p95_time_to_first_token,
+        }
+
+
+class UsageTracker:
+    """Collects the token usage and time to first token of LLM calls.
+
+    Cache hits are counted as calls but not as tokens, since they were not sent to the provider.
+    """
+
+    def __init__(self, max_records: int = 10_000):
+        self.records: deque[UsageRecord] = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def record(self, record: UsageRecord) -> None:
+        with self._lock:
+            self.records.append(record)
+
+    def summary(self, by: tuple[str, ...] = ("stage", "database")) -> dict[tuple, UsageStats]:
+        """Aggregates the records grouped by the given record fields"""
+        with self._lock:
+            records = list(self.records)
+        groups: dict[tuple, UsageStats] = {}
+        for record in records:
+            key = tuple(getattr(record, name) for name in by)
+            groups.setdefault(key, UsageStats()).add(record)
+        return groups
+
+    def totals(self) -> UsageStats:
+        return self.summary(by=()).get((), UsageStats())
+
+    def metrics(self, by: tuple[str, ...] = ("stage", "database")) -> list[dict]:
+        """The summary as plain rows, sorted by the prompt tokens spent so the most expensive groups come first"""
+        rows = [{**dict(zip(by, key)), **stats.as_dict()} for key, stats in self.summary(by).items()]
+        return sorted(rows, key=lambda row: row["prompt_tokens"], reverse=True)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.records.clear()
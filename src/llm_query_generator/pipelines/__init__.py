@@ -2,3 +2,5 @@ from .agent_pipeline import AgentPipeline, DataBaseDescriptor
 from .base import Pipeline
 from .chat_pipeline import ChatPipeline
 from .qa_pipeline import QAPipeline
+from .query_cache import QueryTemplateCache
+from .router import LexicalRouter, Route
@@ -1,14 +1,24 @@
+import asyncio
+import contextvars
+import functools
 import json
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Generator
+from typing import AsyncGenerator, Generator, Literal, Optional, Union
 
 from ..chat_history import ChatHistory
 from ..db import DataBaseAdapter
-from ..llm import LLMAdapter
+from ..llm import LLMAdapter, Priority, priority_context, usage_context
 from .base import Pipeline
 from .chat_from_history_pipeline import ChatFromHistoryPipeline
 from .chat_pipeline import ChatPipeline
 from .qa_pipeline import QAPipeline
+from .query_cache import QueryTemplateCache
+from .router import LexicalRouter
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -27,19 +37,115 @@ class AgentPipeline(Pipeline):
         available_dbs: list[DataBaseDescriptor],
         *,
         is_internal: bool = False,
+        speculation: Literal["off", "likely", "all"] = "off",
+        stream_query: bool = False,
+        candidates: int = 1,
+        candidate_temperature: float = 0.8,
+        selection: Literal["first", "vote"] = "first",
+        router: Optional[LexicalRouter] = None,
+        query_cache: Optional[QueryTemplateCache] = None,
     ) -> None:
         super().__init__(is_internal=is_internal)
         self.json_llm = json_llm
         self.chat_llm = chat_llm
         self.query_llm = query_llm
         self.available_dbs = available_dbs
+        # "likely" generates the query for the last database of the conversation while deciding, "all" for every one
+        self.speculation = speculation
+        self.stream_query = stream_query
+        self.candidates = candidates
+        self.candidate_temperature = candidate_temperature
+        self.selection = selection
+        # Decides obvious questions locally, the json_llm is only asked when the router is not confident
+        self.router = router
+        self.query_cache = query_cache
+
+    def speculation_targets(self, history: ChatHistory) -> list[DataBaseDescriptor]:
+        if self.speculation == "all":
+            return list(self.available_dbs)
+        if self.speculation == "likely" and self.available_dbs:
+            likely = next((db for db in self.available_dbs if db.name == history.last_database), self.available_dbs[0])
+            return [likely]
+        return []
+
+    def qa_pipeline(self, db_descriptor: DataBaseDescriptor) -> QAPipeline:
+        return QAPipeline(
+            self.query_llm,
+            self.chat_llm,
+            db_descriptor.adapter,
+            is_internal=True,
+            database=db_descriptor.name,
+            stream_query=self.stream_query,
+            candidates=self.candidates,
+            candidate_temperature=self.candidate_temperature,
+            selection=self.selection,
+            query_cache=self.query_cache,
+        )
+
+    def decide_speculatively(self, user_input: str, history: ChatHistory) -> tuple[dict, dict[str, Future]]:
+        """Decides while the queries for the speculation targets are generated in worker threads.
+
+        Only the query of the chosen database is kept. The generations are streamed, so losing generations stop at
+        their next chunk and their streams are closed.
+        """
+        routed_decision = self.route(user_input, history)
+        if routed_decision is not None:
+            return routed_decision, {}
+        targets = self.speculation_targets(history)
+        if not targets:
+            return self.llm_decide(user_input, history), {}
+        executor = ThreadPoolExecutor(max_workers=len(targets))
+        cancel_events = {db.name: threading.Event() for db in targets}
+        speculative_queries = {
+            db.name: executor.submit(
+                contextvars.copy_context().run,
+                functools.partial(self.qa_pipeline(db).generate_query, user_input, cancelled=cancel_events[db.name]),
+            )
+            for db in targets
+        }
+        decision = {}
+        try:
+            decision = self.llm_decide(user_input, history)
+        finally:
+            for name, future in speculative_queries.items():
+                if name != decision.get("database") or decision.get("can_answer_from_history"):
+                    cancel_events[name].set()
+                    future.cancel()
+            executor.shutdown(wait=False)
+        return decision, speculative_queries
+
+    async def adecide_speculatively(
+        self, user_input: str, history: ChatHistory
+    ) -> tuple[dict, dict[str, asyncio.Task]]:
+        """Async version of `decide_speculatively`, losing generations are cancelled while they run"""
+        routed_decision = await self.aroute(user_input, history)
+        if routed_decision is not None:
+            return routed_decision, {}
+        speculative_queries = {
+            db.name: asyncio.create_task(self.qa_pipeline(db).agenerate_query(user_input))
+            for db in self.speculation_targets(history)
+        }
+        decision = {}
+        try:
+            decision = await self.allm_decide(user_input, history)
+        finally:
+            losing_queries = [
+                task
+                for name, task in speculative_queries.items()
+                if name != decision.get("database") or decision.get("can_answer_from_history")
+            ]
+            for task in losing_queries:
+                task.cancel()
+            # retrieves the exceptions of generations that failed before they were cancelled
+            await asyncio.gather(*losing_queries, return_exceptions=True)
+        return decision, speculative_queries
 
     def forward(self, user_input: str, history: ChatHistory) -> Generator[ChatHistory, None, None]:
         if not self.is_internal:
             history.add_user_message(user_input)
             yield history
 
-        decision = self.decide(user_input, history)
+        decision, speculative_queries = self.decide_speculatively(user_input, history)
 
         if decision["can_answer_from_history"]:
             # Answer from history using normal chat pipeline
@@ -57,8 +163,53 @@ class AgentPipeline(Pipeline):
                 f"Ok I will use the {db_descriptor.name} to answer the question 🔎.", process=False
             )
             yield history
-            qa_pipeline = QAPipeline(self.query_llm, self.chat_llm, db_descriptor.adapter, is_internal=True)
-            yield from qa_pipeline(user_input, history)
+            history.last_database = db_descriptor.name
+            query = None
+            speculative_query = speculative_queries.get(db_descriptor.name)
+            if speculative_query is not None:
+                try:
+                    query = speculative_query.result()
+                except Exception:
+                    logger.warning("Speculative query generation failed, generating the query again", exc_info=True)
+            yield from self.qa_pipeline(db_descriptor).forward(user_input, history, query=query)
+        else:
+            history.add_assistant_message(
+                "Sry I can`t answer this question with the current chat history or database information 😔."
+            )
+            yield history
+
+    async def aforward(self, user_input: str, history: ChatHistory) -> AsyncGenerator[ChatHistory, None]:
+        if not self.is_internal:
+            history.add_user_message(user_input)
+            yield history
+
+        decision, speculative_queries = await self.adecide_speculatively(user_input, history)
+
+        if decision["can_answer_from_history"]:
+            history.add_assistant_message(
+                "Ok I will use the current chat history to answer the question 📄.", process=False
+            )
+            yield history
+            chatfromhistory_pipeline = ChatFromHistoryPipeline(self.chat_llm, is_internal=True)
+            async for new_history in chatfromhistory_pipeline.aforward(user_input, history):
+                yield new_history
+
+        elif decision["database"] in (db.name for db in self.available_dbs):
+            db_descriptor = next(db for db in self.available_dbs if db.name == decision["database"])
+            history.add_assistant_message(
+                f"Ok I will use the {db_descriptor.name} to answer the question 🔎.", process=False
+            )
+            yield history
+            history.last_database = db_descriptor.name
+            query = None
+            speculative_query = speculative_queries.get(db_descriptor.name)
+            if speculative_query is not None:
+                try:
+                    query = await speculative_query
+                except Exception:
+                    logger.warning("Speculative query generation failed, generating the query again", exc_info=True)
+            async for new_history in self.qa_pipeline(db_descriptor).aforward(user_input, history, query=query):
+                yield new_history
         else:
             history.add_assistant_message(
                 "Sry I can`t answer this question with the current chat history or database information 😔."
@@ -87,8 +238,66 @@ Follow this example for the output:
   can_answer_from_history: bool,
 }}"""
 
+    def route(self, user_input: str, history: ChatHistory) -> Optional[dict]:
+        """The decision of the router, None if there is no router or it is not confident"""
+        if self.router is None:
+            return None
+        return self.router.decide(user_input, history, self.available_dbs)
+
+    async def aroute(self, user_input: str, history: ChatHistory) -> Optional[dict]:
+        if self.router is None:
+            return None
+        return await self.router.adecide(user_input, history, self.available_dbs)
+
     def decide(self, user_input: str, history: ChatHistory) -> dict:
+        decision = self.route(user_input, history)
+        if decision is None:
+            decision = self.llm_decide(user_input, history)
+        return decision
+
+    async def adecide(self, user_input: str, history: ChatHistory) -> dict:
+        decision = await self.aroute(user_input, history)
+        if decision is None:
+            decision = await self.allm_decide(user_input, history)
+        return decision
+
+    def llm_decide(self, user_input: str, history: ChatHistory) -> dict:
+        decision_prompt = self.generate_decision_prompt(user_input, history)
+        with usage_context("decide"):
+            serialized_decision = self.json_llm.generate(decision_prompt)
+        decision = json.loads(serialized_decision)
+        return decision
+
+    async def allm_decide(self, user_input: str, history: ChatHistory) -> dict:
         decision_prompt = self.generate_decision_prompt(user_input, history)
-        serialized_decision = self.json_llm.generate(decision_prompt)
+        with usage_context("decide"):
+            serialized_decision = await self.json_llm.agenerate(decision_prompt)
         decision = json.loads(serialized_decision)
         return decision
+
+    def decide_many(
+        self, user_inputs: list[str], histories: list[ChatHistory], max_concurrency: Optional[int] = None
+    ) -> list[Union[dict, Exception]]:
+        """Decide for many questions concurrently, e.g. for evaluations.
+
+        The decisions keep the order of the inputs, a failing decision yields its exception instead.
+        Questions the router is confident about are not sent to the LLM, the others are sent as batch requests.
+        """
+        decisions: list[Union[dict, Exception, None]] = [
+            self.route(user_input, history) for user_input, history in zip(user_inputs, histories)
+        ]
+        undecided = [index for index, decision in enumerate(decisions) if decision is None]
+        decision_prompts = [self.generate_decision_prompt(user_inputs[index], histories[index]) for index in undecided]
+        serialized_decisions = []
+        if decision_prompts:
+            with usage_context("decide"), priority_context(Priority.BATCH):
+                serialized_decisions = self.json_llm.generate_many(decision_prompts, max_concurrency)
+        for index, serialized_decision in zip(undecided, serialized_decisions):
+            if isinstance(serialized_decision, Exception):
+                decisions[index] = serialized_decision
+                continue
+            try:
+                decisions[index] = json.loads(serialized_decision)
+            except ValueError as e:
+                decisions[index] = e
+        return decisions
@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import Any, Generator
+from typing import Any, AsyncGenerator, Generator
 
+from ..async_utils import iterate_in_thread
 from ..chat_history import ChatHistory
 
 
@@ -14,3 +15,8 @@ class Pipeline(ABC):
 
     def __call__(self, user_input: str, history: ChatHistory) -> Generator[ChatHistory, None, None]:
         return self.forward(user_input, history)
+
+    async def aforward(self, user_input: str, history: ChatHistory) -> AsyncGenerator[ChatHistory, None]:
+        """Async version of `forward`, falls back to running `forward` in a worker thread"""
+        async for new_history in iterate_in_thread(self.forward(user_input, history)):
+            yield new_history
@@ -1,7 +1,7 @@
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
 from ..chat_history import ChatHistory, MessageType
-from ..llm import LLMAdapter
+from ..llm import LLMAdapter, atag_stream, tag_stream
 from .base import Pipeline
 
 
@@ -43,6 +43,17 @@ class ChatFromHistoryPipeline(Pipeline):
         formatted_history = format_history_for_qa(user_input, history)
         history.add_assistant_message("")
 
-        for chunk in self.llm.stream_generate(formatted_history):
+        for chunk in tag_stream(self.llm.stream_generate(formatted_history), "answer"):
+            history.append_to_last_message(chunk)
+            yield history
+
+    async def aforward(self, user_input: str, history: ChatHistory) -> AsyncGenerator[ChatHistory, None]:
+        if not self.is_internal:
+            history.add_user_message(user_input)
+            yield history
+        formatted_history = format_history_for_qa(user_input, history)
+        history.add_assistant_message("")
+
+        async for chunk in atag_stream(self.llm.astream_generate(formatted_history), "answer"):
             history.append_to_last_message(chunk)
             yield history
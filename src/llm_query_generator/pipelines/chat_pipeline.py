@@ -1,7 +1,7 @@
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
 from ..chat_history import ChatHistory
-from ..llm import LLMAdapter
+from ..llm import LLMAdapter, atag_stream, tag_stream
 from .base import Pipeline
 
 
@@ -15,6 +15,15 @@ class ChatPipeline(Pipeline):
             history.add_user_message(user_input)
             yield history
         history.add_assistant_message("")
-        for chunk in self.llm.stream_chat(history.format_for_model()):
+        for chunk in tag_stream(self.llm.stream_chat(history.format_for_model()), "answer"):
+            history.append_to_last_message(chunk)
+            yield history
+
+    async def aforward(self, user_input: str, history: ChatHistory) -> AsyncGenerator[ChatHistory, None]:
+        if not self.is_internal:
+            history.add_user_message(user_input)
+            yield history
+        history.add_assistant_message("")
+        async for chunk in atag_stream(self.llm.astream_chat(history.format_for_model()), "answer"):
             history.append_to_last_message(chunk)
             yield history
@@ -1,14 +1,22 @@
+import asyncio
 import json
 import re
-from typing import Any, Generator
+import threading
+from collections import Counter
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+from typing import Any, AsyncGenerator, Awaitable, Callable, Generator, Literal, Optional
 
 from ..chat_history import ChatHistory
-from ..db import DataBaseAdapter
-from ..llm import LLMAdapter
+from ..db import DataBaseAdapter, QueryCancelledError, QueryPlan, QueryResult
+from ..db.cypher_checker import mask_string_literals
+from ..db.cypher_repair import close_string_literals
+from ..llm import LLMAdapter, atag_stream, tag_stream, usage_context
 from .base import Pipeline
+from .query_cache import QueryTemplateCache
 
 MARKDOWN_PATTERN = r"```.*?\n(.*?)```"
 GLOBAL_MAX_RETRIES = 10
+RETRIES_EXHAUSTED_MESSAGE = "Sorry I was not able to generate a valid query. Please try to rephrase your question."
 
 
 def execute_query_with_retries(
@@ -18,29 +26,291 @@ def execute_query_with_retries(
     query_llm: LLMAdapter,
     user_input: str,
     max_retries: int = 2,
+    *,
+    database: Optional[str] = None,
+    stream_query: bool = False,
+    on_success: Optional[Callable[[str, list[dict[str, Any]]], None]] = None,
+    error: Optional[Exception] = None,
 ) -> Generator[tuple[ChatHistory, list[dict[str, Any]]], None, None]:
+    """Executes the query and repairs it until it succeeds or the retries are used up.
+
+    An `error` the query already failed with, e.g. as a candidate, skips its execution and goes straight to the repair.
+    """
     counter = 0
+    tried_queries = set()
     while True:
         if counter > max_retries or counter > GLOBAL_MAX_RETRIES:
-            history.add_assistant_message(
-                "Sorry I was not able to generate a valid query. Please try to rephrase your question.", process=False
-            )
+            history.add_assistant_message(RETRIES_EXHAUSTED_MESSAGE, process=False)
             yield history, None
             break
-        try:
-            db_result = db_adapter.execute(query)
-            yield history, db_result
+        tried_queries.add(query)
+        if error is None:
+            try:
+                plan = db_adapter.validate(query)
+                db_result = db_adapter.execute(query)
+                attach_plan_estimate(db_result, plan)
+            except Exception as e:
+                error = e
+            else:
+                if on_success is not None:
+                    on_success(query, db_result)
+                yield history, db_result
+                break
+        error_message = str(error)
+        # Mechanical mistakes are fixed without an LLM call and do not count as a retry
+        repaired_query = db_adapter.repair(query, error_message) if db_adapter.is_repairable(error) else None
+        error = None
+        if repaired_query is not None and repaired_query not in tried_queries:
+            query = repaired_query
+            history.add_assistant_message(format_query_fix_message(query), process=False)
+            yield history, None
+            continue
+        fixing_messages = db_adapter.build_error_prompt_messages(user_input, error_message, query)
+        with usage_context("repair", database):
+            query = generate_cypher(query_llm, fixing_messages, stream_query=stream_query)
+        history.add_assistant_message(format_query_fix_message(query), process=False)
+        yield history, None
+        counter += 1
+
+
+async def aexecute_query_with_retries(
+    db_adapter: DataBaseAdapter,
+    query: str,
+    history: ChatHistory,
+    query_llm: LLMAdapter,
+    user_input: str,
+    max_retries: int = 2,
+    *,
+    database: Optional[str] = None,
+    stream_query: bool = False,
+    on_success: Optional[Callable[[str, list[dict[str, Any]]], Awaitable[None]]] = None,
+    error: Optional[Exception] = None,
+) -> AsyncGenerator[tuple[ChatHistory, list[dict[str, Any]]], None]:
+    counter = 0
+    tried_queries = set()
+    while True:
+        if counter > max_retries or counter > GLOBAL_MAX_RETRIES:
+            history.add_assistant_message(RETRIES_EXHAUSTED_MESSAGE, process=False)
+            yield history, None
             break
-        except Exception as e:
-            error_message = str(e)
-            fixing_prompt = db_adapter.build_error_prompt(user_input, error_message, query)
-            query = clean_generation(query_llm.generate(fixing_prompt))
-            history.add_assistant_message(
-                f"⚠️There was an error with my generated query: I changed it to ```{query}```", process=False
-            )
+        tried_queries.add(query)
+        if error is None:
+            try:
+                plan = await db_adapter.avalidate(query)
+                db_result = await db_adapter.aexecute(query)
+                attach_plan_estimate(db_result, plan)
+            except Exception as e:
+                error = e
+            else:
+                if on_success is not None:
+                    await on_success(query, db_result)
+                yield history, db_result
+                break
+        error_message = str(error)
+        repaired_query = await db_adapter.arepair(query, error_message) if db_adapter.is_repairable(error) else None
+        error = None
+        if repaired_query is not None and repaired_query not in tried_queries:
+            query = repaired_query
+            history.add_assistant_message(format_query_fix_message(query), process=False)
             yield history, None
-        finally:
-            counter += 1
+            continue
+        fixing_messages = await db_adapter.abuild_error_prompt_messages(user_input, error_message, query)
+        with usage_context("repair", database):
+            query = await agenerate_cypher(query_llm, fixing_messages, stream_query=stream_query)
+        history.add_assistant_message(format_query_fix_message(query), process=False)
+        yield history, None
+        counter += 1
+
+
+def run_candidate(
+    db_adapter: DataBaseAdapter, query: str, cancelled: Optional[threading.Event] = None
+) -> list[dict[str, Any]]:
+    plan = db_adapter.validate(query)
+    if cancelled is None:
+        db_result = db_adapter.execute(query)
+    elif cancelled.is_set():
+        # a winner was found while the candidate was validated
+        raise QueryCancelledError(query)
+    else:
+        db_result = db_adapter.execute_cancellable(query, cancelled)
+    attach_plan_estimate(db_result, plan)
+    return db_result
+
+
+async def arun_candidate(db_adapter: DataBaseAdapter, query: str) -> list[dict[str, Any]]:
+    plan = await db_adapter.avalidate(query)
+    db_result = await db_adapter.aexecute(query)
+    attach_plan_estimate(db_result, plan)
+    return db_result
+
+
+def select_by_vote(queries: list[str], results: dict[str, list[dict[str, Any]]]) -> tuple[str, list[dict[str, Any]]]:
+    """Picks the result most candidates agree on, non-empty results win over empty ones and ties go to the earlier"""
+    votes = Counter(json.dumps(result, sort_keys=True, default=str) for result in results.values())
+    winner = max(
+        (query for query in queries if query in results),
+        key=lambda query: (
+            len(results[query]) > 0,
+            votes[json.dumps(results[query], sort_keys=True, default=str)],
+            -queries.index(query),
+        ),
+    )
+    return winner, results[winner]
+
+
+def execute_candidates(
+    db_adapter: DataBaseAdapter, queries: list[str], selection: Literal["first", "vote"] = "first"
+) -> tuple[str, Optional[list[dict[str, Any]]], Optional[Exception]]:
+    """Validates and executes the candidate queries concurrently.
+
+    With `first` the first candidate that returns rows wins, with `vote` the result most candidates agree on.
+    Returns the winning query and its result, or the first candidate, None and its error if every candidate failed.
+    """
+    queries = list(dict.fromkeys(queries))
+    results = {}
+    errors = {}
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(queries))
+    try:
+        futures = {executor.submit(run_candidate, db_adapter, query, cancelled): query for query in queries}
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                errors[futures[future]] = future.exception()
+                continue
+            results[futures[future]] = future.result()
+            if selection == "first" and len(future.result()) > 0:
+                return futures[future], future.result(), None
+    finally:
+        # running candidates stop at their next record, the adapter rolls back their transactions
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+    if not results:
+        return queries[0], None, errors[queries[0]]
+    return (*select_by_vote(queries, results), None)
+
+
+async def aexecute_candidates(
+    db_adapter: DataBaseAdapter, queries: list[str], selection: Literal["first", "vote"] = "first"
+) -> tuple[str, Optional[list[dict[str, Any]]], Optional[Exception]]:
+    """Async version of `execute_candidates`, the losing candidates are cancelled once a winner is found"""
+    queries = list(dict.fromkeys(queries))
+
+    async def run(query: str) -> tuple[str, Any]:
+        try:
+            return query, await arun_candidate(db_adapter, query)
+        except Exception as e:
+            return query, e
+
+    tasks = [asyncio.create_task(run(query)) for query in queries]
+    results = {}
+    errors = {}
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            query, db_result = await next_done
+            if isinstance(db_result, Exception):
+                errors[query] = db_result
+                continue
+            results[query] = db_result
+            if selection == "first" and len(db_result) > 0:
+                return query, db_result, None
+    finally:
+        for task in tasks:
+            task.cancel()
+    if not results:
+        return queries[0], None, errors[queries[0]]
+    return (*select_by_vote(queries, results), None)
+
+
+def attach_plan_estimate(db_result: list[dict[str, Any]], plan: Optional[QueryPlan]) -> None:
+    if plan is not None and isinstance(db_result, QueryResult):
+        db_result.estimated_rows = plan.estimated_rows
+
+
+def format_query_fix_message(query: str) -> str:
+    return f"⚠️There was an error with my generated query: I changed it to ```{query}```"
+
+
+def query_end(text: str) -> Optional[int]:
+    """Offset at which a streamed generation contains a complete query, None while the query is still incomplete.
+
+    A query is complete once its code fence is closed or, without a fence, once it is terminated by a semicolon.
+    """
+    fenced = re.search(MARKDOWN_PATTERN, text, re.DOTALL)
+    if fenced is not None:
+        return fenced.end()
+    if "```" in text:
+        return None
+    for terminator in re.finditer(";", mask_string_literals(text)):
+        statement = text[: terminator.start()]
+        # a semicolon inside a string literal that is still being streamed does not end the query
+        if close_string_literals(statement) == statement:
+            return terminator.start()
+    return None
+
+
+def read_query_stream(chunks: Generator[str, None, None]) -> str:
+    """Reads a streamed generation only until the query is complete, explanations after it are never generated"""
+    text = ""
+    try:
+        for chunk in chunks:
+            text += chunk
+            end = query_end(text)
+            if end is not None:
+                text = text[:end]
+                break
+    finally:
+        chunks.close()
+    return clean_generation(text)
+
+
+async def aread_query_stream(chunks: AsyncGenerator[str, None]) -> str:
+    """Async version of `read_query_stream`"""
+    text = ""
+    try:
+        async for chunk in chunks:
+            text += chunk
+            end = query_end(text)
+            if end is not None:
+                text = text[:end]
+                break
+    finally:
+        await chunks.aclose()
+    return clean_generation(text)
+
+
+def cancellable_stream(chunks: Generator[str, None, None], cancelled: threading.Event) -> Generator[str, None, None]:
+    """Passes the chunks on until `cancelled` is set, the stream is closed then so the generation stops"""
+    try:
+        if cancelled.is_set():
+            raise CancelledError
+        for chunk in chunks:
+            yield chunk
+            if cancelled.is_set():
+                raise CancelledError
+    finally:
+        chunks.close()
+
+
+def generate_cypher(
+    query_llm: LLMAdapter,
+    messages: list[dict[str, str]],
+    *,
+    stream_query: bool = False,
+    cancelled: Optional[threading.Event] = None,
+) -> str:
+    if cancelled is not None:
+        # a single completion can not be stopped, a stream is checked between its chunks
+        chunks = cancellable_stream(query_llm.stream_chat(messages), cancelled)
+        return read_query_stream(chunks) if stream_query else clean_generation("".join(chunks))
+    if stream_query:
+        return read_query_stream(query_llm.stream_chat(messages))
+    return clean_generation(query_llm.chat(messages))
+
+
+async def agenerate_cypher(query_llm: LLMAdapter, messages: list[dict[str, str]], *, stream_query: bool = False) -> str:
+    if stream_query:
+        return await aread_query_stream(query_llm.astream_chat(messages))
+    return clean_generation(await query_llm.achat(messages))
 
 
 def clean_generation(query: str) -> str:
@@ -52,12 +322,18 @@ def clean_generation(query: str) -> str:
 
 
 def format_result_for_qa(query: str, result: list[dict[str, Any]]) -> str:
+    truncation_note = ""
+    if getattr(result, "truncated", False):
+        truncation_note = f"""
+    The information only contains the first {len(result)} entries of the result, there are more.
+    Do not count or summarize the entries as if they were complete.
+    Say that the answer is based on the first {len(result)} entries."""
     result = json.dumps(result, indent=4)
     return f"""You are an assistant that helps to form nice and human understandable answers.
     The information part contains the provided information that you must use to construct an answer.
     The provided information is authoritative, you must never doubt it or try to use your internal knowledge to correct it.
     Make the answer sound as a response to the question. Do not mention that you based the result on the given information.
-    If the provided information is empty, say that you don't know the answer.
+    If the provided information is empty, say that you don't know the answer.{truncation_note}
     Information:
     {result}
 
@@ -65,6 +341,21 @@ def format_result_for_qa(query: str, result: list[dict[str, Any]]) -> str:
     Helpful Answer:"""
 
 
+def format_db_result_message(db_result: list[dict[str, Any]]) -> str:
+    if getattr(db_result, "truncated", False):
+        headline = f"I found more than {len(db_result)} database entries, here are the first {len(db_result)}!"
+    else:
+        headline = f"I found {len(db_result)} database entries!"
+    return f"""{headline}
+<details>
+<summary>Details</summary>
+<br>
+<code>
+{json.dumps(db_result,indent=4)}
+</code>
+</details>"""
+
+
 class QAPipeline(Pipeline):
     def __init__(
         self,
@@ -74,53 +365,191 @@ class QAPipeline(Pipeline):
         max_retries: int = 2,
         *,
         is_internal: bool = False,
+        database: Optional[str] = None,
+        stream_query: bool = False,
+        candidates: int = 1,
+        candidate_temperature: float = 0.8,
+        selection: Literal["first", "vote"] = "first",
+        query_cache: Optional[QueryTemplateCache] = None,
     ) -> None:
         super().__init__(is_internal=is_internal)
         self.query_llm = query_llm
         self.chat_llm = chat_llm
         self.db_adapter = db_adapter
         self.max_retries = max_retries
+        # name of the database the usage of the LLM calls is tagged with
+        self.database = database
+        # stop the query generation as soon as the streamed query is complete
+        self.stream_query = stream_query
+        # more than one candidate executes alternative queries concurrently instead of repairing them one by one
+        self.candidates = candidates
+        # candidates are sampled at their own temperature, a deterministic query llm would return n equal queries
+        self.candidate_temperature = candidate_temperature
+        self.selection = selection
+        # questions that only differ in their entities from an answered one reuse its query
+        self.query_cache = query_cache
+
+    def lookup_query(self, user_input: str) -> Optional[str]:
+        if self.query_cache is None:
+            return None
+        return self.query_cache.lookup(user_input, self.database, self.db_adapter.schema_digest())
+
+    async def alookup_query(self, user_input: str) -> Optional[str]:
+        if self.query_cache is None:
+            return None
+        return self.query_cache.lookup(user_input, self.database, await self.db_adapter.aschema_digest())
+
+    def remember_query(self, user_input: str, query: str, db_result: list[dict[str, Any]]) -> None:
+        """Caches a query that answered the question, empty results are not trusted to be correct"""
+        if self.query_cache is not None and db_result:
+            self.query_cache.put(user_input, query, self.database, self.db_adapter.schema_digest())
 
-    def forward(self, user_input: str, history: ChatHistory) -> Generator[ChatHistory, None, None]:
+    async def aremember_query(self, user_input: str, query: str, db_result: list[dict[str, Any]]) -> None:
+        if self.query_cache is not None and db_result:
+            self.query_cache.put(user_input, query, self.database, await self.db_adapter.aschema_digest())
+
+    def generate_query(self, user_input: str, *, cancelled: Optional[threading.Event] = None) -> str:
+        """Generates the query, setting `cancelled` stops the generation with a `CancelledError`"""
+        cached_query = self.lookup_query(user_input)
+        if cached_query is not None:
+            return cached_query
+        query_messages = self.db_adapter.build_prompt_messages(user_input)
+        with usage_context("generate", self.database):
+            return generate_cypher(self.query_llm, query_messages, stream_query=self.stream_query, cancelled=cancelled)
+
+    async def agenerate_query(self, user_input: str) -> str:
+        cached_query = await self.alookup_query(user_input)
+        if cached_query is not None:
+            return cached_query
+        query_messages = await self.db_adapter.abuild_prompt_messages(user_input)
+        with usage_context("generate", self.database):
+            return await agenerate_cypher(self.query_llm, query_messages, stream_query=self.stream_query)
+
+    def generate_queries(self, user_input: str) -> list[str]:
+        cached_query = self.lookup_query(user_input)
+        if cached_query is not None:
+            return [cached_query]
+        query_messages = self.db_adapter.build_prompt_messages(user_input)
+        with usage_context("generate", self.database):
+            candidates = self.query_llm.chat_candidates(query_messages, self.candidates, self.candidate_temperature)
+        return [clean_generation(candidate) for candidate in candidates]
+
+    async def agenerate_queries(self, user_input: str) -> list[str]:
+        cached_query = await self.alookup_query(user_input)
+        if cached_query is not None:
+            return [cached_query]
+        query_messages = await self.db_adapter.abuild_prompt_messages(user_input)
+        with usage_context("generate", self.database):
+            candidates = await self.query_llm.achat_candidates(
+                query_messages, self.candidates, self.candidate_temperature
+            )
+        return [clean_generation(candidate) for candidate in candidates]
+
+    def forward(
+        self, user_input: str, history: ChatHistory, query: Optional[str] = None
+    ) -> Generator[ChatHistory, None, None]:
+        """Answers the question from the database, a query that was already generated for it skips the generation"""
         working_history = history.clone()
         if not self.is_internal:
             history.add_user_message(user_input)
             yield history
 
-        query_prompt = self.db_adapter.build_prompt(user_input)
-        cleaned_query = clean_generation(self.query_llm.generate(query_prompt))
+        db_result, candidate_error = None, None
+        if query is None and self.candidates > 1:
+            cleaned_query, db_result, candidate_error = execute_candidates(
+                self.db_adapter, self.generate_queries(user_input), self.selection
+            )
+            if db_result is not None:
+                self.remember_query(user_input, cleaned_query, db_result)
+        else:
+            cleaned_query = query if query is not None else self.generate_query(user_input)
         history.add_assistant_message(f"I generated this query for you:\n {cleaned_query}", process=False)
         yield history
 
-        for new_history, db_result in execute_query_with_retries(
-            self.db_adapter, cleaned_query, history, self.query_llm, user_input, self.max_retries
-        ):
-            if new_history is not None:
-                history = new_history
+        if db_result is None:
+            for new_history, db_result in execute_query_with_retries(
+                self.db_adapter,
+                cleaned_query,
+                history,
+                self.query_llm,
+                user_input,
+                self.max_retries,
+                database=self.database,
+                stream_query=self.stream_query,
+                on_success=lambda executed_query, result: self.remember_query(user_input, executed_query, result),
+                error=candidate_error,
+            ):
+                if new_history is not None:
+                    history = new_history
+                if db_result is not None:
+                    break
+                else:
+                    yield history
+
+        if db_result is None:
+            return
+
+        history.add_assistant_message(format_db_result_message(db_result), process=False)
+        yield history
+
+        working_history.add_user_message(format_result_for_qa(user_input, db_result))
+
+        history.add_assistant_message("")
+        answer_stream = self.chat_llm.stream_chat(working_history.format_for_model())
+        for chunk in tag_stream(answer_stream, "answer", self.database):
+            history.append_to_last_message(chunk)
+            yield history
+
+    async def aforward(
+        self, user_input: str, history: ChatHistory, query: Optional[str] = None
+    ) -> AsyncGenerator[ChatHistory, None]:
+        working_history = history.clone()
+        if not self.is_internal:
+            history.add_user_message(user_input)
+            yield history
+
+        db_result, candidate_error = None, None
+        if query is None and self.candidates > 1:
+            cleaned_query, db_result, candidate_error = await aexecute_candidates(
+                self.db_adapter, await self.agenerate_queries(user_input), self.selection
+            )
             if db_result is not None:
-                break
-            else:
-                yield history
+                await self.aremember_query(user_input, cleaned_query, db_result)
+        else:
+            cleaned_query = query if query is not None else await self.agenerate_query(user_input)
+        history.add_assistant_message(f"I generated this query for you:\n {cleaned_query}", process=False)
+        yield history
+
+        if db_result is None:
+            async for new_history, db_result in aexecute_query_with_retries(
+                self.db_adapter,
+                cleaned_query,
+                history,
+                self.query_llm,
+                user_input,
+                self.max_retries,
+                database=self.database,
+                stream_query=self.stream_query,
+                on_success=lambda executed_query, result: self.aremember_query(user_input, executed_query, result),
+                error=candidate_error,
+            ):
+                if new_history is not None:
+                    history = new_history
+                if db_result is not None:
+                    break
+                else:
+                    yield history
 
         if db_result is None:
             return
 
-        history.add_assistant_message(
-            f"""I found {len(db_result)} database entries!
-<details>
-<summary>Details</summary>
-<br>
-<code>
-{json.dumps(db_result,indent=4)}
-</code>
-</details>""",
-            process=False,
-        )
+        history.add_assistant_message(format_db_result_message(db_result), process=False)
         yield history
 
         working_history.add_user_message(format_result_for_qa(user_input, db_result))
 
         history.add_assistant_message("")
-        for chunk in self.chat_llm.stream_chat(working_history.format_for_model()):
+        answer_stream = self.chat_llm.astream_chat(working_history.format_for_model())
+        async for chunk in atag_stream(answer_stream, "answer", self.database):
             history.append_to_last_message(chunk)
             yield history
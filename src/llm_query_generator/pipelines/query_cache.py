@@ -0,0 +1,192 @@
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Optional, Union
+
+from ..db.cypher_checker import STRING_LITERAL_PATTERN, mask_string_literals
+from ..text_index import SparseIndex, mask_entities
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+NUMBER_LITERAL_PATTERN = re.compile(r"(?<![\w.$])-?\d+(?:\.\d+)?(?![\w.])")
+# a number of the question that sizes the result is not an entity a similar question can swap
+PAGINATION_PATTERN = re.compile(r"\b(?:LIMIT|SKIP)\s+$", re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueryTemplate:
+    """A validated query split around the literals that came from the entities of its question.
+
+    `parts` has one element more than `slots`, the literal of entity `slots[i]` belongs between `parts[i]` and
+    `parts[i + 1]`.
+    """
+
+    database: Optional[str]
+    question: str
+    kinds: list[str]
+    parts: list[str]
+    slots: list[int]
+    schema_digest: Optional[str] = None
+    hits: int = field(default=0, compare=False)
+
+    @classmethod
+    def build(
+        cls, question: str, query: str, database: Optional[str] = None, schema_digest: Optional[str] = None
+    ) -> Optional["QueryTemplate"]:
+        """Builds a template if every entity of the question appears as exactly one literal of the query.
+
+        None if an entity is missing, ambiguous because it matches several literals or a `LIMIT` or `SKIP` count.
+        """
+        masked_question, values, kinds = mask_entities(question)
+        if len(set(values)) != len(values):
+            return None
+        masked_query = mask_string_literals(query)
+        spans = []
+        for slot, (value, kind) in enumerate(zip(values, kinds)):
+            if kind == "number":
+                found = [
+                    match.span() for match in NUMBER_LITERAL_PATTERN.finditer(masked_query) if match.group() == value
+                ]
+            else:
+                found = [
+                    (match.start() + 1, match.end() - 1)
+                    for match in STRING_LITERAL_PATTERN.finditer(query)
+                    if unescape(match.group()[1:-1]) == value
+                ]
+            if len(found) != 1 or PAGINATION_PATTERN.search(masked_query, 0, found[0][0]):
+                return None
+            spans.extend((start, end, slot) for start, end in found)
+        spans.sort()
+        parts, slots, position = [], [], 0
+        for start, end, slot in spans:
+            parts.append(query[position:start])
+            slots.append(slot)
+            position = end
+        parts.append(query[position:])
+        return cls(database, masked_question, kinds, parts, slots, schema_digest)
+
+    def instantiate(self, values: list[str]) -> str:
+        query = self.parts[0]
+        for slot, part in zip(self.slots, self.parts[1:]):
+            value = values[slot]
+            if self.kinds[slot] == "string":
+                quote = query[-1]
+                value = value.replace("\\", "\\\\").replace(quote, "\\" + quote)
+            query += value + part
+        return query
+
+
+def unescape(literal: str) -> str:
+    return re.sub(r"\\(.)", r"\1", literal)
+
+
+class QueryTemplateCache:
+    """Caches validated queries as templates of their entity masked questions.
+
+    A question is answered from the cache if its masked form is at least `threshold` similar to a cached question
+    with the same kinds of entities, the cached query is then filled with the entities of the new question and
+    the query generation is skipped. Templates are evicted least recently used first, dropped once the schema of
+    their database changes and with a `path` persisted as a JSON snapshot.
+    """
+
+    def __init__(self, max_entries: int = 1000, threshold: float = 0.95, path: Optional[Union[str, Path]] = None):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.path = Path(path) if path is not None else None
+        self.templates: OrderedDict[tuple[Optional[str], str], QueryTemplate] = OrderedDict()
+        self.index: SparseIndex[tuple[Optional[str], str]] = SparseIndex()
+        self._lock = threading.Lock()
+        if self.path is not None:
+            self._read_snapshot()
+
+    def __len__(self) -> int:
+        return len(self.templates)
+
+    def lookup(
+        self, question: str, database: Optional[str] = None, schema_digest: Optional[str] = None
+    ) -> Optional[str]:
+        """The cached query filled with the entities of the question, None if no similar question was cached"""
+        masked_question, values, kinds = mask_entities(question)
+        with self._lock:
+            if schema_digest is not None:
+                self._drop_outdated(database, schema_digest)
+            for key, _score in self.index.search(masked_question, k=None, min_score=self.threshold):
+                template = self.templates[key]
+                if key[0] == database and template.kinds == kinds:
+                    template.hits += 1
+                    self.templates.move_to_end(key)
+                    return template.instantiate(values)
+        return None
+
+    def put(
+        self, question: str, query: str, database: Optional[str] = None, schema_digest: Optional[str] = None
+    ) -> bool:
+        """Caches the validated query of a question, returns False if its entities could not be found in the query"""
+        template = QueryTemplate.build(question, query, database, schema_digest)
+        if template is None:
+            return False
+        key = (database, template.question)
+        with self._lock:
+            self.templates[key] = template
+            self.templates.move_to_end(key)
+            self.index.add(key, template.question)
+            while len(self.templates) > self.max_entries:
+                evicted, _ = self.templates.popitem(last=False)
+                self.index.remove(evicted)
+            self._write_snapshot()
+        return True
+
+    def invalidate(self, database: Optional[str] = None) -> None:
+        """Drops the templates of a database, e.g. after its schema changed, or all templates without a database"""
+        with self._lock:
+            for key in [key for key in self.templates if database is None or key[0] == database]:
+                del self.templates[key]
+                self.index.remove(key)
+            self._write_snapshot()
+
+    def _drop_outdated(self, database: Optional[str], schema_digest: str) -> None:
+        outdated = [
+            key
+            for key, template in self.templates.items()
+            if key[0] == database and template.schema_digest not in (None, schema_digest)
+        ]
+        for key in outdated:
+            del self.templates[key]
+            self.index.remove(key)
+        if outdated:
+            self._write_snapshot()
+
+    def _read_snapshot(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            snapshot = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable query template snapshot %s", self.path, exc_info=True)
+            return
+        if snapshot.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+            return
+        for entry in snapshot["templates"][-self.max_entries :]:
+            template = QueryTemplate(**entry)
+            key = (template.database, template.question)
+            self.templates[key] = template
+            self.index.add(key, template.question)
+
+    def _write_snapshot(self) -> None:
+        if self.path is None:
+            return
+        snapshot = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "templates": [asdict(template) for template in self.templates.values()],
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        temporary_path.write_text(json.dumps(snapshot))
+        os.replace(temporary_path, self.path)
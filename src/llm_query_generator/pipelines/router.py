@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+from ..chat_history import ChatHistory
+from ..text_index import SparseIndex
+
+if TYPE_CHECKING:
+    from .agent_pipeline import DataBaseDescriptor
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Route:
+    """The database a question matches best, `confidence` is its share of the scores of all databases"""
+
+    database: str
+    score: float
+    confidence: float
+
+
+class LexicalRouter:
+    """Routes questions to a database without an LLM call when the question clearly belongs to one database.
+
+    Every database is indexed by its name, its description, the identifiers of its schema and a sample of entity
+    names. A database is scored by its best matching document, a route is only trusted if its score reaches `min_score`
+    and its share of the scores of all databases reaches `threshold`. Follow-up questions are left to the LLM unless
+    `route_follow_ups` is set, because only the LLM can tell if the chat history already answers them.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.6,
+        min_score: float = 0.45,
+        *,
+        sample_limit: int = 1000,
+        ngram: int = 3,
+        route_follow_ups: bool = False,
+    ):
+        self.threshold = threshold
+        self.min_score = min_score
+        self.sample_limit = sample_limit
+        self.ngram = ngram
+        self.route_follow_ups = route_follow_ups
+        self.index: Optional[SparseIndex[tuple[str, int]]] = None
+        self._lock = threading.Lock()
+
+    def documents(self, db: "DataBaseDescriptor") -> list[str]:
+        documents = [db.name, db.description]
+        try:
+            documents.extend(db.adapter.schema_terms())
+            documents.extend(row["value"] for row in db.adapter.sample_values(self.sample_limit))
+        except Exception:
+            logger.warning("Could not sample %s, routing to it only by its description", db.name, exc_info=True)
+        return documents
+
+    def fit(self, available_dbs: list["DataBaseDescriptor"]) -> "LexicalRouter":
+        index: SparseIndex[tuple[str, int]] = SparseIndex(self.ngram)
+        for db in available_dbs:
+            index.extend(((db.name, position), text) for position, text in enumerate(self.documents(db)))
+        index.norms()
+        self.index = index
+        return self
+
+    def route(self, question: str, available_dbs: list["DataBaseDescriptor"]) -> Optional[Route]:
+        """Scores the question against every database, the index is built on first use"""
+        if self.index is None:
+            with self._lock:
+                if self.index is None:
+                    self.fit(available_dbs)
+        scores: dict[str, float] = {}
+        for (database, _), score in self.index.scores(question).items():
+            scores[database] = max(scores.get(database, 0.0), score)
+        if not scores:
+            return None
+        database, score = max(scores.items(), key=lambda item: item[1])
+        return Route(database, score, score / sum(scores.values()))
+
+    def decide(self, question: str, history: ChatHistory, available_dbs: list["DataBaseDescriptor"]) -> Optional[dict]:
+        """A decision in the format of the LLM decision, None if the LLM has to decide"""
+        if not self.route_follow_ups and any(message["role"] == "assistant" for message in history.format_for_model()):
+            return None
+        route = self.route(question, available_dbs)
+        if route is None or route.score < self.min_score or route.confidence < self.threshold:
+            return None
+        return {"database": route.database, "can_answer_from_history": False}
+
+    async def adecide(
+        self, question: str, history: ChatHistory, available_dbs: list["DataBaseDescriptor"]
+    ) -> Optional[dict]:
+        """Async version of `decide`, the index is built in a worker thread as it samples the databases"""
+        if self.index is None:
+            await asyncio.to_thread(self.fit, available_dbs)
+        return self.decide(question, history, available_dbs)
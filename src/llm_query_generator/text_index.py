@@ -0,0 +1,177 @@
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Generic, Hashable, Iterable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+WORD_PATTERN = re.compile(r"[^\W_]+")
+CAMEL_CASE_PATTERN = re.compile(r"(?<=[a-z])(?=[A-Z])")
+ENTITY_PATTERN = re.compile(
+    r"\"(?P<double>[^\"]+)\"|(?<!\w)'(?P<single>[^']+)'(?!\w)|“(?P<curly>[^”]+)”"
+    r"|(?P<number>(?<![\w.])-?\d+(?:\.\d+)?(?![\w.]))"
+    r"|(?P<name>[A-Z][\w-]*(?:\s+(?:(?:of|the|de|la|von|van|upon)\s+)*[A-Z][\w-]*)*)"
+)
+# Capitalized words at the start of a question that do not belong to a name
+LEADING_WORDS = {
+    "a", "an", "are", "at", "can", "could", "describe", "did", "do", "does", "find", "for", "from", "give", "has",
+    "have", "how", "i", "in", "is", "list", "name", "of", "on", "please", "show", "tell", "the", "was", "were",
+    "what", "when", "where", "which", "who", "whom", "whose", "why",
+}  # fmt: skip
+ENTITY_PLACEHOLDER = "ENTITY"
+NUMBER_PLACEHOLDER = "NUMBER"
+
+
+def tokenize(text: str, ngram: int = 0) -> list[str]:
+    """Lowercase word tokens, identifiers like `line_id`, `ACTED_IN` or `releaseYear` are split into their words.
+
+    With `ngram` the character n-grams of every padded word are added as well, so plurals and typos still overlap.
+    """
+    tokens = []
+    for word in WORD_PATTERN.findall(CAMEL_CASE_PATTERN.sub(" ", text).lower()):
+        tokens.append(word)
+        if ngram > 0:
+            padded = f"<{word}>"
+            tokens.extend(f"#{padded[i : i + ngram]}" for i in range(len(padded) - ngram + 1))
+    return tokens
+
+
+def mask_entities(question: str) -> tuple[str, list[str], list[str]]:
+    """Replaces quoted strings, numbers and capitalized names in a question by placeholders.
+
+    Returns the masked question, the masked values and their kinds, either "string" or "number".
+    """
+    masked, values, kinds = [], [], []
+    position = 0
+    for match in ENTITY_PATTERN.finditer(question):
+        start, value, kind = match.start(), match.group(), "string"
+        if match.group("number") is not None:
+            kind = "number"
+        elif match.group("name") is not None:
+            words = list(re.finditer(r"\S+", value))
+            while words and words[0].group().lower() in LEADING_WORDS:
+                words.pop(0)
+            if not words:
+                continue
+            start += words[0].start()
+            value = question[start : match.end()]
+        else:
+            value = match.group("double") or match.group("single") or match.group("curly")
+        masked.append(question[position:start])
+        masked.append(NUMBER_PLACEHOLDER if kind == "number" else ENTITY_PLACEHOLDER)
+        values.append(value)
+        kinds.append(kind)
+        position = match.end()
+    masked.append(question[position:])
+    return "".join(masked), values, kinds
+
+
+class SparseIndex(Generic[K]):
+    """In-memory TF-IDF index that ranks documents by cosine similarity.
+
+    Documents are kept as sparse term counts in an inverted index, so a search only touches the documents that
+    share a term with the query. Documents can be added and removed at any time, the IDF weights and document norms
+    are recomputed lazily on the next search.
+    """
+
+    def __init__(self, ngram: int = 0):
+        self.ngram = ngram
+        self.documents: dict[K, Counter[str]] = {}
+        self.postings: dict[str, dict[K, int]] = {}
+        self._norms: Optional[dict[K, float]] = None
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self.documents
+
+    def add(self, key: K, text: str) -> None:
+        """Indexes a document, a document with the same key is replaced"""
+        if key in self.documents:
+            self.remove(key)
+        counts = Counter(tokenize(text, self.ngram))
+        self.documents[key] = counts
+        for term, count in counts.items():
+            self.postings.setdefault(term, {})[key] = count
+        self._norms = None
+
+    def extend(self, documents: Iterable[tuple[K, str]]) -> None:
+        for key, text in documents:
+            self.add(key, text)
+
+    def remove(self, key: K) -> None:
+        counts = self.documents.pop(key, None)
+        if counts is None:
+            return
+        for term in counts:
+            postings = self.postings[term]
+            del postings[key]
+            if not postings:
+                del self.postings[term]
+        self._norms = None
+
+    def clear(self) -> None:
+        self.documents.clear()
+        self.postings.clear()
+        self._norms = None
+
+    def idf(self, term: str) -> float:
+        """Smoothed inverse document frequency, terms unknown to the index get the highest weight"""
+        return math.log((1 + len(self.documents)) / (1 + len(self.postings.get(term, ())))) + 1
+
+    def norms(self) -> dict[K, float]:
+        norms = self._norms
+        if norms is None:
+            idfs = {term: self.idf(term) for term in self.postings}
+            norms = {
+                key: math.sqrt(sum((term_weight(count) * idfs[term]) ** 2 for term, count in counts.items()))
+                for key, counts in self.documents.items()
+            }
+            self._norms = norms
+        return norms
+
+    def scores(self, text: str) -> dict[K, float]:
+        """Cosine similarity of the text to every document that shares at least one term with it"""
+        norms = self.norms()
+        counts = Counter(tokenize(text, self.ngram))
+        query = {term: term_weight(count) * self.idf(term) for term, count in counts.items()}
+        query_norm = math.sqrt(sum(weight**2 for weight in query.values()))
+        scores: dict[K, float] = {}
+        for term, weight in query.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            idf = self.idf(term)
+            for key, count in postings.items():
+                scores[key] = scores.get(key, 0.0) + weight * term_weight(count) * idf
+        return {key: score / (query_norm * norms[key]) for key, score in scores.items() if norms[key] > 0}
+
+    def coverage(self, text: str) -> dict[K, float]:
+        """Share of the weight of every document that the text contains.
+
+        Unlike the cosine similarity it does not depend on the length of the text, so it suits scoring short
+        documents like identifiers by how much of them a longer question mentions.
+        """
+        norms = self.norms()
+        scores: dict[K, float] = {}
+        for term in set(tokenize(text, self.ngram)):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            idf = self.idf(term)
+            for key, count in postings.items():
+                scores[key] = scores.get(key, 0.0) + (term_weight(count) * idf) ** 2
+        return {key: score / norms[key] ** 2 for key, score in scores.items() if norms[key] > 0}
+
+    def search(self, text: str, k: Optional[int] = 5, min_score: float = 0.0) -> list[tuple[K, float]]:
+        """The `k` most similar documents with a score of at least `min_score`, best first"""
+        matches = [(key, score) for key, score in self.scores(text).items() if score >= min_score]
+        if k is None:
+            return sorted(matches, key=lambda match: match[1], reverse=True)
+        return heapq.nlargest(k, matches, key=lambda match: match[1])
+
+
+def term_weight(count: int) -> float:
+    return 1 + math.log(count)
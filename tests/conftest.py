@@ -0,0 +1,118 @@
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from src.llm_query_generator.db import DataBaseAdapter
+from src.llm_query_generator.llm import LLMAdapter, OpenAILLM
+from src.llm_query_generator.llm.usage import current_usage_tags
+
+CHUNK_PATTERN = re.compile(r"\S+\s*|\s+")
+
+
+class StaticLLM(LLMAdapter):
+    """Answers every prompt with the same text, records the last message and the usage tags of each call"""
+
+    def __init__(self, answer: str = ""):
+        self.answer = answer
+        self.prompts = []
+        self.tags = []
+
+    @property
+    def calls(self):
+        return len(self.prompts)
+
+    def _record(self, formatted_history):
+        self.prompts.append(formatted_history[-1]["content"] if formatted_history else "")
+        self.tags.append(current_usage_tags())
+
+    def generate(self, prompt):
+        return self.chat([{"role": "user", "content": prompt}])
+
+    def chat(self, formatted_history):
+        self._record(formatted_history)
+        return self.answer
+
+    def stream_chat(self, formatted_history):
+        self._record(formatted_history)
+        yield from CHUNK_PATTERN.findall(self.answer)
+
+    def stream_generate(self, prompt):
+        yield from self.stream_chat([{"role": "user", "content": prompt}])
+
+
+class StaticDataBase(DataBaseAdapter):
+    """Returns the same result for every query and records the executed queries"""
+
+    def __init__(self, result=None, *, terms=(), values=(), digest=None):
+        self.result = result if result is not None else []
+        self.terms = list(terms)
+        self.values = list(values)
+        self.digest = digest
+        self.queries = []
+
+    def execute(self, query):
+        self.queries.append(query)
+        return self.result
+
+    def build_prompt(self, question):
+        return question
+
+    def build_error_prompt(self, _question, error_message, _query):
+        return error_message
+
+    def schema_terms(self):
+        return self.terms
+
+    def sample_values(self, limit=1000):
+        return [{"label": "Node", "property": "name", "value": value} for value in self.values[:limit]]
+
+    def schema_digest(self):
+        return self.digest
+
+    def connect(self):
+        return self
+
+    def disconnect(self):
+        return self
+
+
+class FakeCompletions:
+    """Stands in for `client.chat.completions` of the OpenAI client, `{index}` in the content numbers the choices"""
+
+    def __init__(self, content="RETURN {index}", usage=None):
+        self.content = content
+        self.usage = usage
+        self.requests = []
+
+    def create(self, **request):
+        self.requests.append(request)
+        choices = [
+            SimpleNamespace(message=SimpleNamespace(content=self.content.format(index=index)))
+            for index in range(request.get("n", 1))
+        ]
+        return SimpleNamespace(choices=choices, usage=self.usage)
+
+
+@pytest.fixture()
+def static_llm():
+    """Factory of `StaticLLM`s"""
+    return StaticLLM
+
+
+@pytest.fixture()
+def static_db():
+    """Factory of `StaticDataBase`s"""
+    return StaticDataBase
+
+
+@pytest.fixture()
+def openai_llm():
+    """Factory of `OpenAILLM`s that send their requests to `FakeCompletions`"""
+
+    def make(completions=None, **kwargs):
+        llm = OpenAILLM(api_key="test", **kwargs)
+        llm.client = SimpleNamespace(chat=SimpleNamespace(completions=completions or FakeCompletions()))
+        return llm
+
+    return make
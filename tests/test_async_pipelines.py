@@ -0,0 +1,201 @@
+import asyncio
+import json
+import threading
+import time
+
+from conftest import CHUNK_PATTERN, StaticDataBase, StaticLLM
+
+from src.llm_query_generator.chat_history import ChatHistory
+from src.llm_query_generator.pipelines import AgentPipeline, ChatPipeline, DataBaseDescriptor, QAPipeline
+
+
+async def collect(generator):
+    return [history async for history in generator]
+
+
+def test_chat_pipeline_aforward_streams_answer(static_llm):
+    pipeline = ChatPipeline(static_llm("hello there"))
+    histories = asyncio.run(collect(pipeline.aforward("hi", ChatHistory())))
+    assert histories[-1][-1].text == "hello there"
+
+
+def test_qa_pipeline_aforward_executes_generated_query(static_llm, static_db):
+    db = static_db([{"count": 3}])
+    pipeline = QAPipeline(static_llm("```cypher\nMATCH (n) RETURN count(n)\n```"), static_llm("three"), db)
+    histories = asyncio.run(collect(pipeline.aforward("How many nodes?", ChatHistory())))
+    assert db.queries == ["MATCH (n) RETURN count(n)\n"]
+    assert histories[-1][-1].text == "three"
+
+
+def test_agent_pipeline_aforward_routes_to_database(static_llm, static_db):
+    db = static_db([{"count": 3}])
+    json_llm = static_llm(json.dumps({"database": "Test", "can_answer_from_history": False}))
+    descriptors = [DataBaseDescriptor("Test", "", db)]
+    pipeline = AgentPipeline(json_llm, static_llm("three"), static_llm("MATCH (n) RETURN n"), descriptors)
+    histories = asyncio.run(collect(pipeline.aforward("How many nodes?", ChatHistory())))
+    assert db.queries == ["MATCH (n) RETURN n"]
+    assert histories[-1][-1].text == "three"
+
+
+class PromptedDataBase(StaticDataBase):
+    def __init__(self, name):
+        super().__init__([{"count": 3}])
+        self.name = name
+
+    def build_prompt(self, _question):
+        return self.name
+
+
+class DatabaseQueryLLM(StaticLLM):
+    """Answers with a query for the database named in the prompt, the Movie generation takes long"""
+
+    def __init__(self):
+        super().__init__("")
+        self.started = []
+        self.cancelled = []
+
+    def chat(self, formatted_history):
+        return f"MATCH (n:{formatted_history[-1]['content']}) RETURN n"
+
+    def stream_chat(self, formatted_history):
+        yield from CHUNK_PATTERN.findall(self.chat(formatted_history))
+
+    async def achat(self, formatted_history):
+        name = formatted_history[-1]["content"]
+        self.started.append(name)
+        try:
+            await asyncio.sleep(1 if name == "Movie" else 0)
+        except asyncio.CancelledError:
+            self.cancelled.append(name)
+            raise
+        return self.chat(formatted_history)
+
+
+def test_agent_pipeline_generates_queries_while_deciding():
+    clevr, movie = PromptedDataBase("CLEVR"), PromptedDataBase("Movie")
+    json_llm = StaticLLM(json.dumps({"database": "CLEVR", "can_answer_from_history": False}))
+    descriptors = [DataBaseDescriptor("CLEVR", "", clevr), DataBaseDescriptor("Movie", "", movie)]
+    query_llm = DatabaseQueryLLM()
+    pipeline = AgentPipeline(json_llm, StaticLLM("three"), query_llm, descriptors, speculation="all")
+    history = ChatHistory()
+    histories = list(pipeline("How many stations?", history))
+    assert clevr.queries == ["MATCH (n:CLEVR) RETURN n"]
+    assert movie.queries == []
+    assert histories[-1][-1].text == "three"
+    assert history.last_database == "CLEVR"
+
+
+class SlowDecisionLLM(StaticLLM):
+    async def achat(self, formatted_history):
+        await asyncio.sleep(0.1)
+        return self.chat(formatted_history)
+
+
+def test_agent_pipeline_cancels_losing_speculative_generations():
+    clevr, movie = PromptedDataBase("CLEVR"), PromptedDataBase("Movie")
+    json_llm = SlowDecisionLLM(json.dumps({"database": "CLEVR", "can_answer_from_history": False}))
+    descriptors = [DataBaseDescriptor("CLEVR", "", clevr), DataBaseDescriptor("Movie", "", movie)]
+    query_llm = DatabaseQueryLLM()
+    pipeline = AgentPipeline(json_llm, StaticLLM("three"), query_llm, descriptors, speculation="all")
+
+    async def run():
+        histories = await collect(pipeline.aforward("How many stations?", ChatHistory()))
+        await asyncio.sleep(0)
+        return histories
+
+    histories = asyncio.run(run())
+    assert sorted(query_llm.started) == ["CLEVR", "Movie"]
+    assert query_llm.cancelled == ["Movie"]
+    assert clevr.queries == ["MATCH (n:CLEVR) RETURN n"]
+    assert histories[-1][-1].text == "three"
+
+
+class SlowStreamQueryLLM(DatabaseQueryLLM):
+    """Streams the Movie query one slow chunk at a time and records how far each stream got"""
+
+    def __init__(self):
+        super().__init__()
+        self.produced = {}
+        self.closed = threading.Event()
+
+    def stream_chat(self, formatted_history):
+        name = formatted_history[-1]["content"]
+        if name != "Movie":
+            yield from super().stream_chat(formatted_history)
+            return
+        self.produced[name] = 0
+        try:
+            for _ in range(100):
+                time.sleep(0.01)
+                self.produced[name] += 1
+                yield "MATCH "
+        finally:
+            self.closed.set()
+
+
+class SlowSyncDecisionLLM(StaticLLM):
+    def chat(self, formatted_history):
+        time.sleep(0.1)
+        return super().chat(formatted_history)
+
+
+def test_agent_pipeline_stops_losing_speculative_streams():
+    clevr, movie = PromptedDataBase("CLEVR"), PromptedDataBase("Movie")
+    json_llm = SlowSyncDecisionLLM(json.dumps({"database": "CLEVR", "can_answer_from_history": False}))
+    descriptors = [DataBaseDescriptor("CLEVR", "", clevr), DataBaseDescriptor("Movie", "", movie)]
+    query_llm = SlowStreamQueryLLM()
+    pipeline = AgentPipeline(json_llm, StaticLLM("three"), query_llm, descriptors, speculation="all")
+    histories = list(pipeline("How many stations?", ChatHistory()))
+    assert query_llm.closed.wait(timeout=1)
+    assert 0 < query_llm.produced["Movie"] < 100
+    assert clevr.queries == ["MATCH (n:CLEVR) RETURN n"]
+    assert movie.queries == []
+    assert histories[-1][-1].text == "three"
+
+
+def test_agent_pipeline_speculates_on_last_database():
+    descriptors = [DataBaseDescriptor(name, "", PromptedDataBase(name)) for name in ("CLEVR", "Movie")]
+    pipeline = AgentPipeline(StaticLLM(""), StaticLLM(""), StaticLLM(""), descriptors, speculation="likely")
+    history, other_history = ChatHistory(), ChatHistory()
+    assert [db.name for db in pipeline.speculation_targets(history)] == ["CLEVR"]
+    history.last_database = "Movie"
+    assert [db.name for db in pipeline.speculation_targets(history)] == ["Movie"]
+    assert [db.name for db in pipeline.speculation_targets(other_history)] == ["CLEVR"]
+    assert history.clone().last_database == "Movie"
+
+
+class FailingQueryLLM(DatabaseQueryLLM):
+    """Fails the first generation, like a speculative generation that hit a transient error"""
+
+    def chat(self, formatted_history):
+        if not self.started:
+            self.started.append("failed")
+            message = "connection reset"
+            raise ConnectionError(message)
+        return super().chat(formatted_history)
+
+    async def achat(self, formatted_history):
+        if not self.started:
+            self.started.append("failed")
+            message = "connection reset"
+            raise ConnectionError(message)
+        return super().chat(formatted_history)
+
+
+def failing_speculation_pipeline():
+    clevr = PromptedDataBase("CLEVR")
+    json_llm = StaticLLM(json.dumps({"database": "CLEVR", "can_answer_from_history": False}))
+    descriptors = [DataBaseDescriptor("CLEVR", "", clevr)]
+    return clevr, AgentPipeline(json_llm, StaticLLM("three"), FailingQueryLLM(), descriptors, speculation="all")
+
+
+def test_failed_speculative_generation_falls_back_to_normal_generation():
+    clevr, pipeline = failing_speculation_pipeline()
+    histories = list(pipeline("How many stations?", ChatHistory()))
+    assert clevr.queries == ["MATCH (n:CLEVR) RETURN n"]
+    assert histories[-1][-1].text == "three"
+
+    clevr, pipeline = failing_speculation_pipeline()
+    histories = asyncio.run(collect(pipeline.aforward("How many stations?", ChatHistory())))
+    assert clevr.queries == ["MATCH (n:CLEVR) RETURN n"]
+    assert histories[-1][-1].text == "three"
@@ -0,0 +1,80 @@
+from src.llm_query_generator.llm import CompletionCache, OpenAILLM
+from src.llm_query_generator.llm.completion_cache import completion_key
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = CompletionCache(max_entries=2)
+    cache.put("a", ["1"])
+    cache.put("b", ["2"])
+    cache.get("a")
+    cache.put("c", ["3"])
+    assert cache.get("b") is None
+    assert cache.get("a") == ["1"]
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = tmp_path / "completions.sqlite"
+    CompletionCache(path=path).put("key", ["MATCH ", "(n) RETURN n"])
+    assert CompletionCache(path=path).get("key") == ["MATCH ", "(n) RETURN n"]
+
+
+def test_disk_tier_is_bounded(tmp_path):
+    cache = CompletionCache(max_entries=1, path=tmp_path / "completions.sqlite", max_disk_entries=2)
+    for key in "abc":
+        cache.put(key, [key])
+    assert len(cache) == 2
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    path = tmp_path / "completions.sqlite"
+    cache = CompletionCache(max_entries=1, path=path, max_disk_entries=2)
+    cache.put("a", ["1"])
+    cache.put("b", ["2"])
+    cache.get("a")
+    cache.close()
+    cache = CompletionCache(max_entries=1, path=path, max_disk_entries=2)
+    cache.put("c", ["3"])
+    assert cache.get("b") is None
+    assert cache.get("a") == ["1"]
+
+
+def test_disk_tier_indexes_the_access_time(tmp_path):
+    cache = CompletionCache(path=tmp_path / "completions.sqlite")
+    indexes = cache._connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+    assert ("completions_accessed_at",) in indexes
+
+
+def test_expired_completions_are_not_served():
+    cache = CompletionCache(ttl=-1)
+    cache.put("key", ["answer"])
+    assert cache.get("key") is None
+
+
+def test_key_depends_on_sampling_settings():
+    request = {"model": "gpt-4", "temperature": 0.0, "max_tokens": 100, "messages": [], "response_format": None}
+    assert completion_key(request) == completion_key(dict(request))
+    assert completion_key(request) != completion_key({**request, "temperature": 0.2})
+
+
+def test_openai_adapter_replays_cached_chunks():
+    cache = CompletionCache()
+    adapter = OpenAILLM("test-key", temperature=0.0, cache=cache)
+    messages = [{"role": "user", "content": "How many stations are there?"}]
+    cache.put(completion_key(adapter._request(messages)), ["MATCH (s:STATION) ", "RETURN count(s)"])
+    assert list(adapter.stream_chat(messages)) == ["MATCH (s:STATION) ", "RETURN count(s)"]
+    assert adapter.chat(messages) == "MATCH (s:STATION) RETURN count(s)"
+
+
+def test_openai_adapter_only_caches_greedy_single_completions(openai_llm):
+    cache = CompletionCache()
+    messages = [{"role": "user", "content": "How many stations are there?"}]
+    sampling = openai_llm(temperature=0.7, cache=cache)
+    assert sampling.chat(messages) == sampling.chat(messages) == "RETURN 0"
+    assert len(sampling.client.chat.completions.requests) == 2
+    greedy = openai_llm(temperature=0.0, cache=cache)
+    greedy.chat_candidates(messages, n=3)
+    greedy.chat_candidates(messages, n=3)
+    greedy.chat(messages)
+    greedy.chat(messages)
+    assert len(greedy.client.chat.completions.requests) == 3
+    assert len(cache) == 1
@@ -0,0 +1,51 @@
+import pytest
+
+from src.llm_query_generator.db import CostGuard, QueryCostError, QueryPlan
+from src.llm_query_generator.db.cost_guard import var_length_upper_bounds
+
+
+def plan(*operators, estimated_rows=10.0):
+    children = [QueryPlan(operator, estimated_rows) for operator in operators]
+    return QueryPlan("ProduceResults", estimated_rows, children=children)
+
+
+def test_var_length_bounds_are_parsed():
+    query = "MATCH (a)-[:EDGE*..50]-(b), (b)-[*]->(c), (c)-[:EDGE*2..3]->(d), (d)-[r*4]->(e) RETURN [x IN r | x*2]"
+    assert var_length_upper_bounds(query) == [50, None, 3, 4]
+
+
+def test_cheap_plan_passes():
+    CostGuard().check(plan("NodeByLabelScan"), "MATCH (s:STATION) RETURN s LIMIT 10")
+
+
+def test_cartesian_product_and_all_nodes_scan_are_rejected():
+    guard = CostGuard()
+    violations = guard.violations(plan("CartesianProduct", "AllNodesScan"), "MATCH (a),(b) RETURN a, b")
+    assert len(violations) == 2
+
+
+def test_unbounded_shortest_path_is_rejected():
+    query = "MATCH path = shortestPath((a:STATION)-[:EDGE*..50]-(b:STATION)) RETURN length(path)"
+    with pytest.raises(QueryCostError) as e:
+        CostGuard(max_var_length=10).check(plan("ShortestPath"), query)
+    assert "Make this query cheaper" in str(e.value)
+
+
+def test_estimated_rows_limit():
+    with pytest.raises(QueryCostError):
+        CostGuard(max_estimated_rows=100).check(plan("Expand(All)", estimated_rows=1e6), "MATCH (a:A)--(b) RETURN b")
+
+
+def test_few_shot_shortest_paths_pass_the_default_guard():
+    query = "MATCH path = shortestPath((a:STATION {name: 'x'})-[:EDGE*..50]-(b:STATION)) RETURN length(path)"
+    CostGuard().check(plan("ShortestPath"), query)
+
+
+def test_var_length_patterns_in_string_literals_are_ignored():
+    assert var_length_upper_bounds("MATCH (s:STATION {name: '-[:EDGE*]-'}) RETURN s") == []
+
+
+def test_message_without_var_length_limit():
+    with pytest.raises(QueryCostError) as e:
+        CostGuard(max_var_length=None).check(plan("CartesianProduct"), "MATCH (a:A), (b:B) RETURN a, b")
+    assert "None" not in str(e.value)
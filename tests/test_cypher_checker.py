@@ -0,0 +1,72 @@
+from src.llm_query_generator.db import CypherChecker
+
+SCHEMA = {
+    "node_properties": [
+        {
+            "labels": "STATION",
+            "properties": [{"property": "name", "type": "STRING"}, {"property": "music", "type": "STRING"}],
+        },
+        {"labels": "Person", "properties": [{"property": "name", "type": "STRING"}]},
+        {"labels": "Movie", "properties": [{"property": "title", "type": "STRING"}]},
+    ],
+    "relationship_properties": [
+        {
+            "type": "EDGE",
+            "properties": [{"property": "line_id", "type": "STRING"}, {"property": "line_name", "type": "STRING"}],
+        }
+    ],
+    "relationships": [
+        {"start": "STATION", "type": "EDGE", "end": "STATION"},
+        {"start": "Person", "type": "ACTED_IN", "end": "Movie"},
+    ],
+}
+
+
+def test_valid_queries_have_no_diagnostics():
+    checker = CypherChecker(SCHEMA)
+    queries = [
+        'MATCH (:STATION {name: "Spriaords Palace"})-[r:EDGE]-() RETURN COUNT(DISTINCT r.line_id) AS NumberOfLines',
+        "MATCH path = shortestPath((start:STATION {name: 'Snoiarty St'})-[:EDGE*..50]-(end:STATION)) RETURN LENGTH(path)",
+        "MATCH (p:Person {name: 'Tom Hanks'})-[:ACTED_IN]->(m:Movie) RETURN m.title, count(*)",
+        "MATCH (s1:STATION)-[e:EDGE]->(s2:STATION) WHERE e.line_name = 'a.b: c' RETURN s1.music",
+    ]
+    for query in queries:
+        assert checker.check(query) == []
+
+
+def test_unknown_label_and_relationship_type_are_reported():
+    diagnostics = CypherChecker(SCHEMA).check("MATCH (s:Station)-[:CONNECTED_TO]->(t:STATION) RETURN s")
+    assert len(diagnostics) == 2
+    assert "Label `Station`" in diagnostics[0]
+    assert "Relationship type `CONNECTED_TO`" in diagnostics[1]
+
+
+def test_unknown_properties_are_reported():
+    diagnostics = CypherChecker(SCHEMA).check("MATCH (s:STATION {title: 'x'})-[e:EDGE]->() RETURN s.size, e.line")
+    assert len(diagnostics) == 3
+    assert all("does not exist on" in diagnostic for diagnostic in diagnostics)
+
+
+def test_wrong_direction_is_reported():
+    diagnostics = CypherChecker(SCHEMA).check("MATCH (m:Movie)-[:ACTED_IN]->(p:Person) RETURN p.name")
+    assert len(diagnostics) == 1
+    assert "Reverse the direction" in diagnostics[0]
+    assert CypherChecker(SCHEMA).check("MATCH (m:Movie)<-[:ACTED_IN]-(p:Person) RETURN p.name") == []
+
+
+def test_only_unknown_labels_are_errors():
+    errors, warnings = CypherChecker(SCHEMA).diagnose(
+        "MATCH (m:Movie)-[:ACTED_IN]->(p:Person) WHERE p.born > 1960 RETURN m.released"
+    )
+    assert errors == []
+    assert len(warnings) == 3
+    errors, warnings = CypherChecker(SCHEMA).diagnose("MATCH (s:Station)-[:EDGE]-(t:STATION) RETURN t.size")
+    assert len(errors) == 1
+    assert len(warnings) == 1
+
+
+def test_unsampled_relationship_type_is_a_warning():
+    errors, warnings = CypherChecker(SCHEMA).diagnose("MATCH (s:STATION)-[:CONNECTED_TO]->(t:STATION) RETURN s")
+    assert errors == []
+    assert len(warnings) == 1
+    assert "Relationship type `CONNECTED_TO`" in warnings[0]
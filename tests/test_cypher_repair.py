@@ -0,0 +1,69 @@
+from src.llm_query_generator.db import CypherRepairer
+from src.llm_query_generator.db.cypher_repair import close_string_literals, edit_distance, strip_code_fences
+
+SCHEMA = {
+    "node_properties": [
+        {
+            "labels": "STATION",
+            "properties": [{"property": "name", "type": "STRING"}, {"property": "size", "type": "STRING"}],
+        },
+        {"labels": "LINE", "properties": [{"property": "line_id", "type": "INTEGER"}]},
+    ],
+    "relationship_properties": [
+        {
+            "type": "EDGE",
+            "properties": [{"property": "line_name", "type": "STRING"}, {"property": "line_id", "type": "INTEGER"}],
+        }
+    ],
+    "relationships": [{"start": "STATION", "type": "EDGE", "end": "STATION"}],
+}
+
+
+def test_edit_distance():
+    assert edit_distance("station", "station") == 0
+    assert edit_distance("edge", "edges") == 1
+    assert edit_distance("kitten", "sitting") == 3
+    assert edit_distance("nmae", "name") == 1
+
+
+def test_code_fences_and_stray_backticks_are_removed():
+    assert strip_code_fences("```cypher\nMATCH (n) RETURN n") == "MATCH (n) RETURN n"
+    assert strip_code_fences("`MATCH (n) RETURN n`") == "MATCH (n) RETURN n"
+    assert strip_code_fences("MATCH (n) RETURN n`") == "MATCH (n) RETURN n"
+    assert strip_code_fences("MATCH (n:`My Label`) RETURN n") == "MATCH (n:`My Label`) RETURN n"
+
+
+def test_open_string_literal_is_closed():
+    assert close_string_literals("MATCH (s {name: 'Snoiarty St") == "MATCH (s {name: 'Snoiarty St'"
+    assert close_string_literals("RETURN 'it\\'s'") == "RETURN 'it\\'s'"
+
+
+def test_near_miss_identifiers_are_fixed():
+    repairer = CypherRepairer(SCHEMA)
+    query = "MATCH (s:Station {nmae: 'Groitz Lane'})-[e:EDGES]->(t:STATION) RETURN e.line_nme, t.size"
+    assert repairer.repair(query) == (
+        "MATCH (s:STATION {name: 'Groitz Lane'})-[e:EDGE]->(t:STATION) RETURN e.line_name, t.size"
+    )
+
+
+def test_quoted_numbers_are_unquoted_for_numeric_properties():
+    repairer = CypherRepairer(SCHEMA)
+    query = "MATCH (s:STATION {name: '42'})-[e:EDGE]->() WHERE e.line_id = '7' RETURN s"
+    assert repairer.repair(query) == "MATCH (s:STATION {name: '42'})-[e:EDGE]->() WHERE e.line_id = 7 RETURN s"
+
+
+def test_missing_return_is_added():
+    repairer = CypherRepairer(SCHEMA)
+    repaired = repairer.repair("MATCH p = (s:STATION)-[:EDGE]->(t:STATION)")
+    assert repaired == "MATCH p = (s:STATION)-[:EDGE]->(t:STATION)\nRETURN p, s, t"
+
+
+def test_valid_query_is_unchanged():
+    query = 'MATCH (:STATION {name: "Spriaords Palace"})-[r:EDGE]-() RETURN COUNT(DISTINCT r.line_id) AS NumberOfLines'
+    assert CypherRepairer(SCHEMA).repair(query) == query
+
+
+def test_numbers_inside_string_literals_stay_quoted():
+    repairer = CypherRepairer(SCHEMA)
+    query = "MATCH (s:STATION) WHERE s.name = 'line_id = \"7\"' RETURN s"
+    assert repairer.unquote_numbers(query) == query
@@ -0,0 +1,119 @@
+import threading
+
+import pytest
+
+from src.llm_query_generator.db import Neo4jAdapter, driver_registry
+from src.llm_query_generator.db.driver_registry import DriverConfig, DriverRegistry
+
+
+class FakeDriver:
+    def __init__(self, uri, **kwargs):
+        self.uri = uri
+        self.kwargs = kwargs
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_adapters_with_same_uri_share_driver(monkeypatch):
+    monkeypatch.setattr(driver_registry.GraphDatabase, "driver", FakeDriver)
+    registry = DriverRegistry()
+    first = registry.acquire("bolt://localhost:7687", ("neo4j", "password"))
+    second = registry.acquire("bolt://localhost:7687", ("neo4j", "password"))
+    other = registry.acquire("bolt://localhost:7688", ("neo4j", "password"))
+    assert first is second
+    assert first is not other
+    assert len(registry) == 2
+
+
+def test_driver_is_closed_after_last_release(monkeypatch):
+    monkeypatch.setattr(driver_registry.GraphDatabase, "driver", FakeDriver)
+    registry = DriverRegistry()
+    driver = registry.acquire("bolt://localhost:7687", ("neo4j", "password"))
+    registry.acquire("bolt://localhost:7687", ("neo4j", "password"))
+    registry.release("bolt://localhost:7687", ("neo4j", "password"))
+    assert not driver.closed
+    registry.release("bolt://localhost:7687", ("neo4j", "password"))
+    assert driver.closed
+    assert len(registry) == 0
+
+
+def test_pool_config_is_passed_to_driver(monkeypatch):
+    monkeypatch.setattr(driver_registry.GraphDatabase, "driver", FakeDriver)
+    registry = DriverRegistry()
+    config = DriverConfig(max_connection_pool_size=5, connection_acquisition_timeout=2.0)
+    driver = registry.acquire("bolt://localhost:7687", ("neo4j", "password"), config)
+    assert driver.kwargs["max_connection_pool_size"] == 5
+    assert driver.kwargs["connection_acquisition_timeout"] == 2.0
+
+
+class FakeAsyncDriver(FakeDriver):
+    async def close(self):
+        self.closed = True
+
+
+def test_failed_warm_up_closes_the_driver(monkeypatch):
+    drivers = []
+
+    def create_driver(uri, **kwargs):
+        drivers.append(FakeDriver(uri, **kwargs))
+        return drivers[-1]
+
+    monkeypatch.setattr(driver_registry.GraphDatabase, "driver", create_driver)
+
+    def unreachable(_driver, _connections):
+        message = "unreachable"
+        raise ConnectionError(message)
+
+    monkeypatch.setattr(driver_registry, "warm_up", unreachable)
+    registry = DriverRegistry()
+    with pytest.raises(ConnectionError):
+        registry.acquire("bolt://localhost:7687", ("neo4j", "password"), DriverConfig(warmup_connections=1))
+    assert drivers[0].closed
+    assert len(registry) == 0
+
+
+def test_slow_warm_up_does_not_block_other_servers(monkeypatch):
+    monkeypatch.setattr(driver_registry.GraphDatabase, "driver", FakeDriver)
+    warming_up, release_warm_up = threading.Event(), threading.Event()
+
+    def slow_warm_up(_driver, _connections):
+        warming_up.set()
+        release_warm_up.wait(timeout=5)
+
+    monkeypatch.setattr(driver_registry, "warm_up", slow_warm_up)
+    registry = DriverRegistry()
+    slow = threading.Thread(
+        target=registry.acquire, args=("bolt://slow:7687", ("neo4j", "password"), DriverConfig(warmup_connections=1))
+    )
+    slow.start()
+    warming_up.wait(timeout=5)
+    registry.acquire("bolt://localhost:7687", ("neo4j", "password"))
+    assert len(registry) == 1
+    release_warm_up.set()
+    slow.join()
+    assert len(registry) == 2
+
+
+def test_close_all_closes_async_drivers(monkeypatch):
+    monkeypatch.setattr(driver_registry.GraphDatabase, "driver", FakeDriver)
+    monkeypatch.setattr(driver_registry.AsyncGraphDatabase, "driver", FakeAsyncDriver)
+    registry = DriverRegistry()
+    driver = registry.acquire("bolt://localhost:7687", ("neo4j", "password"))
+    async_driver = registry.acquire("bolt://localhost:7687", ("neo4j", "password"), asynchronous=True)
+    registry.close_all()
+    assert driver.closed and async_driver.closed
+    assert len(registry) == 0
+
+
+def test_second_disconnect_does_not_release_a_shared_driver(monkeypatch):
+    monkeypatch.setattr(driver_registry.GraphDatabase, "driver", FakeDriver)
+    registry = DriverRegistry()
+    first = Neo4jAdapter("bolt://localhost:7687", "neo4j", "password", driver_registry=registry)
+    second = Neo4jAdapter("bolt://localhost:7687", "neo4j", "password", driver_registry=registry)
+    for adapter in (first, second):
+        adapter.driver = registry.acquire(adapter.uri, (adapter.user, adapter.password))
+    first.disconnect()
+    first.disconnect()
+    assert not second.driver.closed
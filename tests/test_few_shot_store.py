@@ -0,0 +1,52 @@
+import json
+
+from src.llm_query_generator.db import FewShotExample, FewShotStore, Neo4jAdapter
+from src.llm_query_generator.db.neo4j import build_structured_schema
+
+CORPUS = [
+    {"question": "How many lines is Frauel Lane on?", "cypher": 'MATCH (s {name: "Frauel Lane"})-[r]-() RETURN r'},
+    {"question": "How many lines is Yatz Way on?", "cypher": 'MATCH (s {name: "Yatz Way"})-[r]-() RETURN r'},
+    {"question": "What size is Debington?", "cypher": 'MATCH (s {name: "Debington"}) RETURN s.size'},
+    {"question": "Which music plays at Greiff St?", "cypher": 'MATCH (s {name: "Greiff St"}) RETURN s.music'},
+]
+
+
+def write_corpus(path):
+    # create_graph.py joins the lines without a trailing newline
+    path.write_text("\n".join(json.dumps(record) for record in CORPUS))
+    return path
+
+
+def test_corpus_is_loaded_from_a_memory_mapped_file(tmp_path):
+    store = FewShotStore.from_jsonl(write_corpus(tmp_path / "questions.jsonl"))
+    assert len(store) == 4
+    assert len(store.shapes) == 3
+    assert store.example(3) == FewShotExample(CORPUS[3]["question"], CORPUS[3]["cypher"])
+    store.close()
+
+
+def test_select_returns_one_example_per_similar_question_shape(tmp_path):
+    store = FewShotStore.from_jsonl(write_corpus(tmp_path / "questions.jsonl"))
+    examples = store.select("How many lines is Wriott Court on?", k=2)
+    assert examples[0].question == "How many lines is Frauel Lane on?"
+    assert len({example.cypher for example in examples}) == len(examples)
+
+
+def test_select_stays_within_the_token_budget():
+    store = FewShotStore(FewShotExample(record["question"], record["cypher"]) for record in CORPUS)
+    assert store.select("What size is Wriott Court?", k=4, max_tokens=30) == [
+        FewShotExample("What size is Debington?", 'MATCH (s {name: "Debington"}) RETURN s.size')
+    ]
+    assert store.select("What size is Wriott Court?", k=4, max_tokens=1) == []
+
+
+def test_adapter_puts_selected_examples_into_the_user_message():
+    store = FewShotStore(FewShotExample(record["question"], record["cypher"]) for record in CORPUS)
+    adapter = Neo4jAdapter("bolt://localhost:7687", "", "", few_shot_store=store, few_shot_k=1)
+    adapter.schema_cache.put(build_structured_schema([]), "fingerprint")
+    system_message, user_message = adapter.build_prompt_messages("What size is Wriott Court?")
+    assert "Debington" not in system_message["content"]
+    assert user_message["content"].startswith("Hint: You can use the following queries as examples:")
+    assert "What size is Debington?" in user_message["content"]
+    assert "Greiff St" not in user_message["content"]
+    assert "Debington" in adapter.build_error_prompt("What size is Wriott Court?", "error", "MATCH")
@@ -0,0 +1,156 @@
+import asyncio
+import itertools
+import time
+from types import SimpleNamespace
+
+from conftest import FakeCompletions
+
+from src.llm_query_generator.llm import HedgePolicy, UsageTracker, usage_context
+from src.llm_query_generator.llm.hedging import ahedged_call, ahedged_stream, hedged_call, hedged_stream
+
+
+def warmed_up_policy(**kwargs):
+    policy = HedgePolicy(min_samples=5, min_delay=0.01, default_budget=1.0, **kwargs)
+    for _ in range(5):
+        policy.observe(0.02)
+        policy.observe(0.02, "first_token")
+    return policy
+
+
+def test_no_hedging_before_enough_latencies_are_observed():
+    policy = HedgePolicy(min_samples=3)
+    policy.observe(1.0)
+    assert policy.delay() is None
+    policy.observe(1.0)
+    policy.observe(3.0)
+    assert 1.0 <= policy.delay() <= 3.0
+
+
+def test_latencies_are_kept_per_kind():
+    policy = HedgePolicy(min_samples=2)
+    policy.observe(5.0)
+    policy.observe(5.0)
+    assert policy.delay("first_token") is None
+    policy.observe(0.1, "first_token")
+    policy.observe(0.1, "first_token")
+    assert policy.delay("first_token") < 1.0 < policy.delay()
+
+
+def test_hedge_budget_is_per_stage():
+    policy = HedgePolicy(budgets={"answer": 0.5}, default_budget=0.0)
+    for _ in range(4):
+        policy.start("answer")
+        policy.start("decide")
+    assert [policy.allow_hedge("answer") for _ in range(3)] == [True, True, False]
+    assert not policy.allow_hedge("decide")
+
+
+def first_call_is_slow():
+    calls = itertools.count()
+
+    def call():
+        if next(calls) == 0:
+            time.sleep(0.3)
+            return "slow"
+        return "fast"
+
+    return call
+
+
+def test_slow_calls_are_hedged():
+    start = time.perf_counter()
+    assert hedged_call(warmed_up_policy(), first_call_is_slow()) == "fast"
+    assert time.perf_counter() - start < 0.3
+
+
+def test_hedged_calls_share_the_executor_of_the_policy():
+    policy = warmed_up_policy()
+    executor = policy.executor
+    for _ in range(3):
+        assert hedged_call(policy, lambda: "done") == "done"
+    assert policy.executor is executor
+
+
+class SlowFirstCompletions(FakeCompletions):
+    """Answers the first request last, each answer names its request and spends one more completion token"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = itertools.count()
+
+    def create(self, **request):
+        call = next(self.calls)
+        if call == 0:
+            time.sleep(0.2)
+        self.requests.append(request)
+        usage = SimpleNamespace(prompt_tokens=10, completion_tokens=call + 1)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"call-{call}"))], usage=usage)
+
+
+def test_usage_of_the_losing_request_is_tracked(openai_llm):
+    tracker = UsageTracker()
+    llm = openai_llm(SlowFirstCompletions(), usage_tracker=tracker, hedge=warmed_up_policy())
+    assert llm.generate("question") == "call-1"
+    time.sleep(0.3)
+    assert sorted(record.completion_tokens for record in tracker.records) == [1, 2]
+
+
+def test_hedges_stop_when_the_budget_is_spent():
+    policy = warmed_up_policy(budgets={"generate": 0.0})
+    with usage_context("generate"):
+        assert hedged_call(policy, first_call_is_slow()) == "slow"
+
+
+def test_slower_async_request_is_cancelled():
+    cancelled = []
+    calls = itertools.count()
+
+    async def call():
+        delay = 1.0 if next(calls) == 0 else 0.0
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return delay
+
+    assert asyncio.run(ahedged_call(warmed_up_policy(), call)) == 0.0
+    assert cancelled == [1.0]
+
+
+def test_hedged_stream_keeps_the_stream_that_starts_first():
+    closed = []
+    streams = itertools.count()
+
+    def open_stream():
+        name = f"stream-{next(streams)}"
+        try:
+            if name == "stream-0":
+                time.sleep(0.2)
+            yield name
+            yield "done"
+        finally:
+            closed.append(name)
+
+    assert list(hedged_stream(warmed_up_policy(), open_stream)) == ["stream-1", "done"]
+    time.sleep(0.3)
+    assert sorted(closed) == ["stream-0", "stream-1"]
+
+
+def test_async_hedged_stream_closes_the_slower_stream():
+    closed = []
+    streams = itertools.count()
+
+    async def open_stream():
+        name = f"stream-{next(streams)}"
+        try:
+            await asyncio.sleep(1.0 if name == "stream-0" else 0.0)
+            yield name
+        finally:
+            closed.append(name)
+
+    async def collect():
+        return [chunk async for chunk in ahedged_stream(warmed_up_policy(), open_stream)]
+
+    assert asyncio.run(collect()) == ["stream-1"]
+    assert sorted(closed) == ["stream-0", "stream-1"]
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from src.llm_query_generator.chat_history import ChatHistory
+from src.llm_query_generator.llm import LLMAdapter
+from src.llm_query_generator.pipelines import AgentPipeline
+
+
+class SlowEchoLLM(LLMAdapter):
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+
+    def generate(self, prompt):
+        return prompt
+
+    def chat(self, formatted_history):
+        return formatted_history[-1]["content"]
+
+    def stream_chat(self, formatted_history):
+        yield self.chat(formatted_history)
+
+    def stream_generate(self, prompt):
+        yield prompt
+
+    async def achat(self, formatted_history):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        content = formatted_history[-1]["content"]
+        if content == "fail":
+            message = "failed"
+            raise ValueError(message)
+        return content
+
+
+def test_generate_many_keeps_order_and_isolates_errors():
+    llm = SlowEchoLLM()
+    answers = llm.generate_many(["a", "fail", "c"])
+    assert answers[0] == "a"
+    assert isinstance(answers[1], ValueError)
+    assert answers[2] == "c"
+
+
+def test_generate_many_bounds_concurrency():
+    llm = SlowEchoLLM()
+    llm.generate_many([str(i) for i in range(20)], max_concurrency=3)
+    assert llm.max_running == 3
+
+
+def test_generate_many_works_inside_running_loop():
+    async def run():
+        return SlowEchoLLM().generate_many(["a", "b"])
+
+    assert asyncio.run(run()) == ["a", "b"]
+
+
+def test_decide_many_parses_decisions():
+    class DecisionLLM(SlowEchoLLM):
+        async def achat(self, formatted_history):
+            if "broken" in formatted_history[-1]["content"]:
+                return "not json"
+            return '{"database": "CLEVR", "can_answer_from_history": false}'
+
+    pipeline = AgentPipeline(DecisionLLM(), SlowEchoLLM(), SlowEchoLLM(), [])
+    decisions = pipeline.decide_many(["Which line?", "broken"], [ChatHistory(), ChatHistory()])
+    assert decisions[0]["database"] == "CLEVR"
+    assert isinstance(decisions[1], ValueError)
@@ -1,7 +1,26 @@
+import asyncio
+import threading
+
 import pytest
 
 from src.llm_query_generator.chat_history import ChatHistory
-from src.llm_query_generator.db import DataBaseAdapter, Neo4jAdapter
+from src.llm_query_generator.db import (
+    AsyncNeo4jAdapter,
+    CypherSchemaError,
+    DataBaseAdapter,
+    Neo4jAdapter,
+    QueryCancelledError,
+    QueryCostError,
+    QueryPlan,
+)
+from src.llm_query_generator.db.neo4j import (
+    FINGERPRINT_QUERY,
+    build_structured_schema,
+    format_compact_schema,
+    format_schema,
+    schema_identifiers,
+)
+from src.llm_query_generator.llm.scheduler import estimate_tokens
 
 URI = "bolt://localhost:7688"
 USER = ""
@@ -120,3 +139,184 @@ def test_adapter_throws_on_wrong_syntax_queries():
     with pytest.raises(Exception) as e:
         _ = adapter.execute(query)
     assert "Neo.ClientError.Statement.SyntaxError" in str(e.value)
+
+
+META_DATA = [
+    {"label": "STATION", "other": [], "elementType": "node", "type": "STRING", "property": "name"},
+    {"label": "STATION", "other": ["STATION"], "elementType": "node", "type": "RELATIONSHIP", "property": "EDGE"},
+    {"label": "EDGE", "other": [], "elementType": "relationship", "type": "STRING", "property": "line_name"},
+    {"label": "LINE", "other": [], "elementType": "node", "type": "INTEGER", "property": "id"},
+]
+
+
+def test_structured_schema_is_built_in_one_pass():
+    schema = build_structured_schema(META_DATA)
+    assert schema["node_properties"] == [
+        {"labels": "STATION", "properties": [{"property": "name", "type": "STRING"}]},
+        {"labels": "LINE", "properties": [{"property": "id", "type": "INTEGER"}]},
+    ]
+    assert schema["relationship_properties"] == [
+        {"type": "EDGE", "properties": [{"property": "line_name", "type": "STRING"}]}
+    ]
+    assert schema["relationships"] == [{"start": "STATION", "type": "EDGE", "end": "STATION"}]
+    assert "(:STATION)-[:EDGE]->(:STATION)" in format_schema(schema)
+
+
+def test_schema_query_parameters_contain_sampling_knobs():
+    adapter = Neo4jAdapter(URI, USER, PASSWORD, schema_sample=50, schema_max_rels=10)
+    assert adapter.schema_query_parameters() == {"config": {"sample": 50, "maxRels": 10}}
+
+
+def test_query_plan_is_built_from_summary():
+    summary_plan = {
+        "operatorType": "ProduceResults@neo4j",
+        "args": {"EstimatedRows": 25.0},
+        "children": [{"operatorType": "NodeByLabelScan@neo4j", "args": {"EstimatedRows": 38.0}, "children": []}],
+    }
+    plan = QueryPlan.from_summary(summary_plan)
+    assert plan.operator == "ProduceResults"
+    assert plan.estimated_rows == 25.0
+    assert [operator.operator for operator in plan.walk()] == ["ProduceResults", "NodeByLabelScan"]
+
+
+def test_prompt_prefix_is_stable_per_schema_version():
+    adapter = Neo4jAdapter(URI, USER, PASSWORD, few_shots="Question: Example?")
+    adapter.schema_cache.put(build_structured_schema(META_DATA), "fingerprint")
+    messages = adapter.build_prompt_messages("How many stations are there?")
+    error_messages = adapter.build_error_prompt_messages("How many stations are there?", "Invalid input", "MA (n)")
+    assert messages[0] == error_messages[0]
+    assert messages[0]["role"] == "system"
+    assert messages[0]["content"] is adapter.prompt_prefix()
+    assert "How many stations" not in messages[0]["content"]
+    assert "Invalid input" in error_messages[1]["content"]
+
+    adapter.schema_cache.put(build_structured_schema(META_DATA[:1]), "changed")
+    assert "LINE" not in adapter.build_prompt_messages("How many stations are there?")[0]["content"]
+
+
+def test_schema_identifiers_list_labels_types_and_properties():
+    schema = build_structured_schema(META_DATA)
+    assert schema_identifiers(schema) == ["STATION", "name", "LINE", "id", "EDGE", "line_name"]
+
+
+def test_compact_schema_renders_one_line_per_label_and_pattern():
+    schema = build_structured_schema(META_DATA)
+    assert format_compact_schema(schema) == (
+        "Nodes:\nSTATION(name:STRING)\nLINE(id:INTEGER)\n"
+        "Relationships:\n(:STATION)-[:EDGE {line_name:STRING}]->(:STATION)"
+    )
+    assert estimate_tokens(format_compact_schema(schema)) * 2 < estimate_tokens(format_schema(schema))
+
+
+def test_schema_format_is_selected_per_adapter():
+    adapter = Neo4jAdapter(URI, USER, PASSWORD, schema_format="compact")
+    adapter.schema_cache.put(build_structured_schema(META_DATA), "fingerprint")
+    assert "STATION(name:STRING)" in adapter.prompt_prefix()
+    assert adapter.get_schema() == format_compact_schema(build_structured_schema(META_DATA))
+    with pytest.raises(ValueError):
+        Neo4jAdapter(URI, USER, PASSWORD, schema_format="yaml")
+
+
+class AsyncOnlyAdapter(AsyncNeo4jAdapter):
+    async def _arun(self, query, _parameters=None):
+        if query == FINGERPRINT_QUERY:
+            return [{"labels": {"STATION": 2}, "relTypesCount": {}}]
+        return META_DATA[:1]
+
+
+def test_async_only_adapter_refreshes_a_stale_schema_on_the_async_driver():
+    adapter = AsyncOnlyAdapter(URI, USER, PASSWORD, schema_ttl=0, explain_before_execute=False)
+    adapter.schema_cache.put(build_structured_schema(META_DATA), "old")
+    sync_refreshes = []
+    adapter.schema_cache.refresh = lambda: sync_refreshes.append(True)
+
+    async def validate_and_refresh():
+        await adapter.avalidate("MATCH (s:STATION) RETURN s.name")
+        await adapter._schema_refresh
+
+    asyncio.run(validate_and_refresh())
+    for thread in threading.enumerate():
+        if thread.name == "schema-refresh":
+            thread.join()
+    assert sync_refreshes == []
+    assert adapter.get_structured_schema() == build_structured_schema(META_DATA[:1])
+
+
+class ExplainingAdapter(Neo4jAdapter):
+    def explain(self, query):
+        self.explained = query
+        return QueryPlan("ProduceResults", 1.0)
+
+
+def test_schema_elements_missing_from_the_sample_fall_through_to_explain():
+    adapter = ExplainingAdapter(URI, USER, PASSWORD)
+    adapter.schema_cache.put(build_structured_schema(META_DATA), "fingerprint")
+    query = "MATCH (s:STATION)-[e:EDGE]->(t:STATION) WHERE e.line_color = 'red' RETURN s.size, t.name"
+    assert adapter.validate(query) is not None
+    assert adapter.explained == query
+    query = "MATCH (s:STATION)-[:CONNECTED_TO]->(t:STATION) RETURN t.name"
+    assert adapter.validate(query) is not None
+    assert adapter.explained == query
+    with pytest.raises(CypherSchemaError):
+        adapter.validate("MATCH (s:Station) RETURN s.name")
+
+
+class FakeRecord(dict):
+    def data(self):
+        return dict(self)
+
+
+class FakeTransaction:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def run(self, _query, _parameters=None):
+        return (FakeRecord(row) for row in self.rows)
+
+
+class FakeSession:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+    def execute_read(self, transaction):
+        return transaction(FakeTransaction(self.rows))
+
+
+class FakeDriver:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def session(self, **_config):
+        return FakeSession(self.rows)
+
+
+def test_row_cap_only_applies_to_user_queries():
+    adapter = Neo4jAdapter(URI, USER, PASSWORD, max_rows=2)
+    adapter.driver = FakeDriver(META_DATA)
+    result = adapter.execute("MATCH (n) RETURN n")
+    assert len(result) == 2
+    assert result.truncated
+    assert adapter._load_schema() == build_structured_schema(META_DATA)
+
+
+def test_cancelled_candidates_stop_reading_records():
+    adapter = Neo4jAdapter(URI, USER, PASSWORD)
+    adapter.driver = FakeDriver(META_DATA)
+    cancelled = threading.Event()
+    assert adapter.execute_cancellable("MATCH (n) RETURN n", cancelled) == META_DATA
+    cancelled.set()
+    with pytest.raises(QueryCancelledError):
+        adapter.execute_cancellable("MATCH (n) RETURN n", cancelled)
+
+
+def test_only_syntax_and_schema_errors_are_repaired_mechanically():
+    adapter = Neo4jAdapter(URI, USER, PASSWORD)
+    assert adapter.is_repairable(CypherSchemaError("Label `Station` does not exist in the schema"))
+    assert not adapter.is_repairable(QueryCostError("The query was rejected because it is too expensive"))
+    assert not adapter.is_repairable(TimeoutError("timed out"))
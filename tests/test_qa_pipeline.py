@@ -1,9 +1,21 @@
+import asyncio
 import os
+import threading
+
+from conftest import FakeCompletions, StaticDataBase, StaticLLM
 
 from src.llm_query_generator.chat_history import ChatHistory
-from src.llm_query_generator.db import DataBaseAdapter, Neo4jAdapter
-from src.llm_query_generator.llm import LLMAdapter, OpenAILLM
-from src.llm_query_generator.pipelines.qa_pipeline import execute_query_with_retries
+from src.llm_query_generator.db import Neo4jAdapter, QueryPlan, QueryResult
+from src.llm_query_generator.llm import OpenAILLM
+from src.llm_query_generator.pipelines import QAPipeline
+from src.llm_query_generator.pipelines.qa_pipeline import (
+    aexecute_candidates,
+    execute_candidates,
+    execute_query_with_retries,
+    format_result_for_qa,
+    query_end,
+    read_query_stream,
+)
 
 API_KEY = os.environ.get("OPENAI_KEY")
 
@@ -44,3 +56,232 @@ def test_execute_query_with_retries_can_fix_query():
     assert db_ansers[1] is not None
 
     db_adapter.disconnect()
+
+
+class ExplainingDataBase(StaticDataBase):
+    def __init__(self):
+        super().__init__(QueryResult([{"count": 12}]))
+
+    def validate(self, query):
+        if query.startswith("MA "):
+            message = "Invalid input 'MA'"
+            raise ValueError(message)
+        return QueryPlan("ProduceResults", estimated_rows=12.0)
+
+
+def test_planner_errors_are_repaired_without_execution():
+    db_adapter = ExplainingDataBase()
+    llm = StaticLLM("MATCH (m:Movie) RETURN count(m) AS count")
+    results = [
+        db_result
+        for _, db_result in execute_query_with_retries(
+            db_adapter, "MA (m:Movie) RETURN count(m)", ChatHistory(), llm, "How many movies?"
+        )
+    ]
+    assert results[0] is None
+    assert results[1] == [{"count": 12}]
+    assert results[1].estimated_rows == 12.0
+    assert db_adapter.queries == ["MATCH (m:Movie) RETURN count(m) AS count"]
+    assert llm.prompts == ["Invalid input 'MA'"]
+
+
+class RepairingDataBase(ExplainingDataBase):
+    def repair(self, query, _error_message):
+        return query.replace("MA ", "MATCH ")
+
+
+def test_deterministic_repair_runs_before_llm():
+    db_adapter = RepairingDataBase()
+    llm = StaticLLM("MATCH (m:Movie) RETURN count(m) AS count")
+    results = [
+        db_result
+        for _, db_result in execute_query_with_retries(
+            db_adapter, "MA (m:Movie) RETURN count(m)", ChatHistory(), llm, "How many movies?", max_retries=0
+        )
+    ]
+    assert results[-1] == [{"count": 12}]
+    assert db_adapter.queries == ["MATCH (m:Movie) RETURN count(m)"]
+    assert llm.prompts == []
+
+
+class TimingOutDataBase(RepairingDataBase):
+    def is_repairable(self, _error):
+        return False
+
+
+def test_repair_is_skipped_for_errors_it_cannot_fix():
+    db_adapter = TimingOutDataBase()
+    llm = StaticLLM("MATCH (m:Movie) RETURN count(m) AS count")
+    results = [
+        db_result
+        for _, db_result in execute_query_with_retries(
+            db_adapter, "MA (m:Movie) RETURN count(m)", ChatHistory(), llm, "How many movies?", max_retries=1
+        )
+    ]
+    assert results[-1] == [{"count": 12}]
+    assert db_adapter.queries == ["MATCH (m:Movie) RETURN count(m) AS count"]
+    assert llm.prompts == ["Invalid input 'MA'"]
+
+
+def counted_stream(chunks, produced):
+    for chunk in chunks:
+        produced.append(chunk)
+        yield chunk
+
+
+def test_query_stream_stops_at_closing_fence():
+    produced = []
+    chunks = ["```cypher\nMATCH (m:Movie)", " RETURN m\n", "```", "\nThis query returns", " all movies."]
+    assert read_query_stream(counted_stream(chunks, produced)) == "MATCH (m:Movie) RETURN m\n"
+    assert produced == chunks[:3]
+
+
+def test_query_stream_stops_at_terminator_outside_literals():
+    produced = []
+    chunks = ["MATCH (m {title: 'a;", "b'}) RETURN m", "; It returns", " the movie."]
+    assert read_query_stream(counted_stream(chunks, produced)) == "MATCH (m {title: 'a;b'}) RETURN m"
+    assert produced == chunks[:3]
+
+
+def test_query_end_waits_for_incomplete_queries():
+    assert query_end("```cypher\nMATCH (n) RETURN n;") is None
+    assert query_end("MATCH (n) RETURN n") is None
+
+
+CANDIDATE_RESULTS = {
+    "MATCH (m:Movie) RETURN m.title": [{"m.title": "Heat"}],
+    "MATCH (m:Movie) RETURN m.name": [],
+    "MATCH (m:Film) RETURN m.title": [{"m.title": "Heat"}],
+    "MATCH (m:Movie) RETURN m.title LIMIT 0": [],
+}
+
+
+class CandidateDataBase(ExplainingDataBase):
+    def execute(self, query):
+        self.queries.append(query)
+        return QueryResult(CANDIDATE_RESULTS[query.strip()])
+
+
+def test_first_successful_candidate_with_rows_wins():
+    queries = ["MA (m:Movie) RETURN m", "MATCH (m:Movie) RETURN m.name", "MATCH (m:Movie) RETURN m.title"]
+    query, db_result, _error = execute_candidates(CandidateDataBase(), queries)
+    assert query == "MATCH (m:Movie) RETURN m.title"
+    assert db_result == [{"m.title": "Heat"}]
+
+
+def test_candidates_can_vote_on_results():
+    queries = ["MATCH (m:Movie) RETURN m.name", "MATCH (m:Film) RETURN m.title", "MATCH (m:Movie) RETURN m.title"]
+    query, db_result, _error = asyncio.run(aexecute_candidates(CandidateDataBase(), queries, selection="vote"))
+    assert query == "MATCH (m:Film) RETURN m.title"
+    assert db_result == [{"m.title": "Heat"}]
+
+
+class SlowCandidateDataBase(CandidateDataBase):
+    def __init__(self):
+        super().__init__()
+        self.stopped = threading.Event()
+
+    def execute_cancellable(self, query, cancelled):
+        if query == "MATCH (m:Movie) RETURN m.name":
+            if cancelled.wait(timeout=1.0):
+                self.stopped.set()
+            return QueryResult([])
+        return self.execute(query)
+
+
+def test_losing_candidates_are_cancelled():
+    db_adapter = SlowCandidateDataBase()
+    queries = ["MATCH (m:Movie) RETURN m.name", "MATCH (m:Movie) RETURN m.title"]
+    assert execute_candidates(db_adapter, queries)[0] == "MATCH (m:Movie) RETURN m.title"
+    assert db_adapter.stopped.wait(timeout=0.5)
+
+
+def test_failing_candidates_fall_back_to_the_first():
+    query, db_result, error = execute_candidates(CandidateDataBase(), ["MA (m)", "MA (n)"])
+    assert (query, db_result, str(error)) == ("MA (m)", None, "Invalid input 'MA'")
+
+
+class ValidationCountingDataBase(CandidateDataBase):
+    def __init__(self):
+        super().__init__()
+        self.validated = []
+
+    def validate(self, query):
+        self.validated.append(query)
+        return super().validate(query)
+
+
+class FailingCandidateLLM(StaticLLM):
+    def chat_candidates(self, _formatted_history, n, _temperature=None):
+        return ["MA (m:Movie) RETURN m", "MA (n:Movie) RETURN n"][:n]
+
+    async def achat_candidates(self, formatted_history, n, temperature=None):
+        return self.chat_candidates(formatted_history, n, temperature)
+
+
+async def collect(generator):
+    return [history async for history in generator]
+
+
+def test_error_of_the_failed_candidate_feeds_the_first_repair():
+    question = "Which movies are there?"
+    for run in (
+        lambda pipeline: list(pipeline(question, ChatHistory())),
+        lambda pipeline: asyncio.run(collect(pipeline.aforward(question, ChatHistory()))),
+    ):
+        db = ValidationCountingDataBase()
+        llm = FailingCandidateLLM("MATCH (m:Movie) RETURN m.title")
+        histories = run(QAPipeline(llm, StaticLLM("Heat"), db, candidates=2))
+        # the failed candidates are neither validated nor executed again
+        assert sorted(db.validated) == [
+            "MA (m:Movie) RETURN m",
+            "MA (n:Movie) RETURN n",
+            "MATCH (m:Movie) RETURN m.title",
+        ]
+        assert db.queries == ["MATCH (m:Movie) RETURN m.title"]
+        assert llm.prompts == ["Invalid input 'MA'"]
+        assert histories[-1][-1].text == "Heat"
+
+
+class CandidateLLM(StaticLLM):
+    def chat_candidates(self, _formatted_history, n, _temperature=None):
+        return ["MA (m:Movie) RETURN m", "```cypher\nMATCH (m:Movie) RETURN m.title\n```"][:n]
+
+
+def test_qa_pipeline_executes_candidates_without_repair():
+    llm = CandidateLLM("MATCH (m:Movie) RETURN m.name")
+    pipeline = QAPipeline(llm, StaticLLM("Heat"), CandidateDataBase(), candidates=2)
+    histories = list(pipeline("Which movies are there?", ChatHistory()))
+    assert "MATCH (m:Movie) RETURN m.title" in histories[-1][-3].text
+    assert histories[-1][-1].text == "Heat"
+    assert llm.prompts == []
+
+
+class SamplingLLM(StaticLLM):
+    def chat_candidates(self, _formatted_history, n, temperature=None):
+        if not temperature:
+            return ["MATCH (m:Movie) RETURN m.name"] * n
+        return ["MATCH (m:Movie) RETURN m.name", "MATCH (m:Movie) RETURN m.title"][:n]
+
+
+def test_candidates_are_sampled_at_their_own_temperature():
+    db = CandidateDataBase()
+    pipeline = QAPipeline(SamplingLLM(""), StaticLLM("Heat"), db, candidates=2, selection="vote")
+    histories = list(pipeline("Which movies are there?", ChatHistory()))
+    assert sorted(db.queries) == ["MATCH (m:Movie) RETURN m.name", "MATCH (m:Movie) RETURN m.title"]
+    assert histories[-1][-1].text == "Heat"
+
+
+def test_openai_candidates_override_the_temperature_of_the_adapter(openai_llm):
+    completions = FakeCompletions()
+    llm = openai_llm(completions, temperature=0.0)
+    candidates = llm.chat_candidates([{"role": "user", "content": "question"}], 2, temperature=0.8)
+    assert candidates == ["RETURN 0", "RETURN 1"]
+    assert completions.requests[0]["temperature"] == 0.8
+    assert completions.requests[0]["n"] == 2
+
+
+def test_answer_prompt_notes_truncated_results():
+    rows = [{"m.title": "Heat"}, {"m.title": "Ronin"}]
+    assert "there are more" in format_result_for_qa("How many movies are there?", QueryResult(rows, truncated=True))
+    assert "there are more" not in format_result_for_qa("How many movies are there?", QueryResult(rows))
@@ -0,0 +1,92 @@
+import asyncio
+
+from src.llm_query_generator.chat_history import ChatHistory
+from src.llm_query_generator.pipelines import QAPipeline, QueryTemplateCache
+from src.llm_query_generator.pipelines.query_cache import QueryTemplate
+from src.llm_query_generator.text_index import mask_entities
+
+QUESTION = "How many lines is Spriaords Palace on?"
+QUERY = 'MATCH (:STATION {name: "Spriaords Palace"})-[r:EDGE]-() RETURN COUNT(DISTINCT r.line_id) AS lines'
+
+
+def test_mask_entities_masks_names_quotes_and_numbers():
+    assert mask_entities("Are Pfeirty International and Thruolly Lane on the same line?") == (
+        "Are ENTITY and ENTITY on the same line?",
+        ["Pfeirty International", "Thruolly Lane"],
+        ["string", "string"],
+    )
+    assert mask_entities('Which movies released after 1999 star "Keanu Reeves"?')[1:] == (
+        ["1999", "Keanu Reeves"],
+        ["number", "string"],
+    )
+
+
+def test_template_is_filled_with_escaped_entities():
+    template = QueryTemplate.build(QUESTION, QUERY)
+    assert template.question == "How many lines is ENTITY on?"
+    assert template.instantiate(['Mc"Laewn Square']) == QUERY.replace("Spriaords Palace", 'Mc\\"Laewn Square')
+
+
+def test_queries_without_the_entities_of_the_question_are_not_cached():
+    cache = QueryTemplateCache()
+    assert not cache.put(QUESTION, "MATCH (s:STATION) WHERE toLower(s.name) = 'spriaords palace' RETURN s")
+    assert len(cache) == 0
+
+
+def test_numbers_matching_several_literals_or_a_limit_are_not_cached():
+    cache = QueryTemplateCache()
+    query = "MATCH (s:STATION)-[:EDGE]-() WITH s, count(*) AS connections WHERE connections > 1 RETURN s.name LIMIT 1"
+    assert not cache.put("Name one station with more than 1 connection", query)
+    assert cache.lookup("Name one station with more than 3 connection") is None
+    assert not cache.put("Name 3 stations", "MATCH (s:STATION) RETURN s.name LIMIT 3")
+    assert len(cache) == 0
+
+
+def test_lookup_requires_a_near_duplicate_with_the_same_entity_kinds():
+    cache = QueryTemplateCache()
+    cache.put(QUESTION, QUERY, "CLEVR")
+    expected_query = QUERY.replace("Spriaords Palace", "Wriott Court")
+    assert cache.lookup("How many lines is Wriott Court on?", "CLEVR") == expected_query
+    assert cache.lookup("How many lines is Wriott Court on?", "MovieDatabase") is None
+    assert cache.lookup("How many stations is Wriott Court next to?", "CLEVR") is None
+    assert cache.lookup("How many lines is 42 on?", "CLEVR") is None
+
+
+def test_least_recently_used_templates_are_evicted():
+    cache = QueryTemplateCache(max_entries=1)
+    cache.put(QUESTION, QUERY)
+    cache.put("What size is Cliick On Trent?", 'MATCH (s {name: "Cliick On Trent"}) RETURN s.size')
+    assert cache.lookup("How many lines is Wriott Court on?") is None
+    assert cache.lookup("What size is Wriott Court?") == 'MATCH (s {name: "Wriott Court"}) RETURN s.size'
+
+
+def test_templates_are_persisted_and_dropped_after_schema_changes(tmp_path):
+    path = tmp_path / "templates.json"
+    QueryTemplateCache(path=path).put(QUESTION, QUERY, "CLEVR", "v1")
+    cache = QueryTemplateCache(path=path)
+    assert cache.lookup("How many lines is Wriott Court on?", "CLEVR", "v1") is not None
+    assert cache.lookup("How many lines is Wriott Court on?", "CLEVR", "v2") is None
+    assert len(QueryTemplateCache(path=path)) == 0
+
+
+def test_invalidate_drops_the_templates_of_a_database():
+    cache = QueryTemplateCache()
+    cache.put(QUESTION, QUERY, "CLEVR")
+    cache.invalidate("MovieDatabase")
+    assert len(cache) == 1
+    cache.invalidate("CLEVR")
+    assert len(cache) == 0
+
+
+def test_qa_pipeline_skips_generation_for_cached_templates(static_llm, static_db):
+    db, query_llm = static_db([{"lines": 2}], digest="v1"), static_llm(QUERY)
+    pipeline = QAPipeline(query_llm, static_llm("Two lines."), db, query_cache=QueryTemplateCache(), database="CLEVR")
+    list(pipeline(QUESTION, ChatHistory()))
+    list(pipeline("How many lines is Wriott Court on?", ChatHistory()))
+    asyncio.run(pipeline.agenerate_query("How many lines is Cliick On Trent on?"))
+    assert query_llm.calls == 1
+    assert db.queries[-1] == QUERY.replace("Spriaords Palace", "Wriott Court")
+
+    db.digest = "v2"
+    pipeline.generate_query("How many lines is Wriott Court on?")
+    assert query_llm.calls == 2
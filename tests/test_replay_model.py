@@ -0,0 +1,74 @@
+import asyncio
+import json
+import time
+from pathlib import Path
+
+import pytest
+
+from src.llm_query_generator.chat_history import ChatHistory
+from src.llm_query_generator.llm import LLMAdapter, ReplayLLM, ReplayMissError
+from src.llm_query_generator.llm.completion_cache import completion_key
+from src.llm_query_generator.pipelines import AgentPipeline
+from src.llm_query_generator.pipelines.qa_pipeline import format_result_for_qa
+
+RESULTS_DIR = Path(__file__).resolve().parents[1] / "evaluation_results"
+
+
+class ChunkedLLM(LLMAdapter):
+    def generate(self, prompt):
+        return self.chat([{"role": "user", "content": prompt}])
+
+    def chat(self, formatted_history):
+        return "".join(self.stream_chat(formatted_history))
+
+    def stream_chat(self, _formatted_history):
+        yield "MATCH (n) "
+        yield "RETURN n"
+
+    def stream_generate(self, prompt):
+        yield from self.stream_chat([{"role": "user", "content": prompt}])
+
+
+def test_recordings_can_be_replayed(tmp_path):
+    path = tmp_path / "recordings.jsonl"
+    recorder = ReplayLLM("record", path, llm=ChunkedLLM())
+    assert list(recorder.stream_generate("question")) == ["MATCH (n) ", "RETURN n"]
+    assert recorder.generate("other question") == "MATCH (n) RETURN n"
+
+    replay = ReplayLLM("replay", path)
+    assert list(replay.stream_generate("question")) == ["MATCH (n) ", "RETURN n"]
+    assert asyncio.run(replay.agenerate("other question")) == "MATCH (n) RETURN n"
+    with pytest.raises(ReplayMissError):
+        replay.generate("unknown question")
+
+
+def test_replay_simulates_recorded_latency(tmp_path):
+    path = tmp_path / "recordings.jsonl"
+    messages = [{"role": "user", "content": "question"}]
+    entry = {"key": completion_key({"messages": messages}), "chunks": ["RETURN 1"], "delays": [0.05]}
+    path.write_text(json.dumps(entry) + "\n")
+    start = time.perf_counter()
+    assert ReplayLLM("replay", path, latency_scale=1.0).generate("question") == "RETURN 1"
+    assert time.perf_counter() - start >= 0.05
+
+
+def test_synthetic_mode_answers_evaluation_questions():
+    llm = ReplayLLM("synthetic", results_dir=RESULTS_DIR)
+    answer = llm.generate(format_result_for_qa("What size is Cliick On Trent?", [{"Size": "medium-sized"}]))
+    assert answer == "Click On Trent is medium-sized."
+    assert llm.generate(format_result_for_qa("A question nobody asked?", [])) != ""
+
+
+def test_synthetic_mode_drives_agent_pipeline_decisions():
+    llms = [ReplayLLM("synthetic", results_dir=RESULTS_DIR) for _ in range(3)]
+    pipeline = AgentPipeline(*llms, [])
+    decision = pipeline.decide("Which products does the ordner with the orderID 10254 contain?", ChatHistory())
+    assert decision == {"database": "Northwind", "can_answer_from_history": False}
+
+
+def test_synthetic_mode_reads_the_results_of_the_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        ReplayLLM("synthetic")
+    monkeypatch.setenv("EVALUATION_RESULTS_DIR", str(RESULTS_DIR))
+    assert ReplayLLM("synthetic").synthetic.answers
@@ -0,0 +1,49 @@
+from src.llm_query_generator.db import QueryResult, ResultCache, normalize_cypher
+
+
+def test_normalization_ignores_whitespace_and_keyword_case():
+    first = "match (s:STATION {name: 'Snoiarty St'})\n  return   count(s) ;"
+    second = "MATCH (s:STATION{name:'Snoiarty St'}) RETURN COUNT(s)"
+    assert normalize_cypher(first) == normalize_cypher(second)
+
+
+def test_normalization_keeps_literals_and_identifiers():
+    assert normalize_cypher("MATCH (s:Station) RETURN s") != normalize_cypher("MATCH (s:STATION) RETURN s")
+    assert normalize_cypher("RETURN 'a  b'") != normalize_cypher("RETURN 'a b'")
+    assert normalize_cypher("RETURN n.count") == "RETURN n.count"
+
+
+def test_cache_hit_and_miss_are_counted():
+    cache = ResultCache()
+    assert cache.get("bolt://db", "RETURN 1") is None
+    cache.put("bolt://db", "RETURN 1", [{"1": 1}])
+    assert cache.get("bolt://db", "return 1") == [{"1": 1}]
+    assert cache.get("bolt://other", "RETURN 1") is None
+    stats = cache.stats()
+    assert stats.hits == 1
+    assert stats.misses == 2
+    assert stats.hit_rate == 1 / 3
+
+
+def test_cache_is_invalidated_by_graph_version():
+    cache = ResultCache()
+    cache.put("bolt://db", "RETURN 1", [{"1": 1}], graph_version="a")
+    assert cache.get("bolt://db", "RETURN 1", graph_version="b") is None
+    assert cache.stats().invalidations == 1
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ResultCache(max_entries=2)
+    cache.put("db", "RETURN 1", [])
+    cache.put("db", "RETURN 2", [])
+    cache.get("db", "RETURN 1")
+    cache.put("db", "RETURN 3", [])
+    assert cache.get("db", "RETURN 2") is None
+    assert cache.get("db", "RETURN 1") is not None
+    assert cache.stats().evictions == 1
+
+
+def test_cache_keeps_truncation_flag():
+    cache = ResultCache()
+    cache.put("db", "MATCH (n) RETURN n", QueryResult([{"n": 1}], truncated=True))
+    assert cache.get("db", "MATCH (n) RETURN n").truncated
@@ -0,0 +1,32 @@
+from src.llm_query_generator.db import QueryResult, ResultStream, RowBudget
+
+
+def rows(count):
+    return ({"id": i} for i in range(count))
+
+
+def test_stream_yields_all_rows_within_budget():
+    result = ResultStream(rows(5), RowBudget(max_rows=10)).to_result()
+    assert isinstance(result, QueryResult)
+    assert len(result) == 5
+    assert not result.truncated
+
+
+def test_stream_stops_at_row_cap():
+    result = ResultStream(rows(1_000_000), RowBudget(max_rows=3)).to_result()
+    assert result == [{"id": 0}, {"id": 1}, {"id": 2}]
+    assert result.truncated
+
+
+def test_stream_stops_at_byte_budget():
+    result = ResultStream(rows(100), RowBudget(max_bytes=30)).to_result()
+    assert len(result) == 3
+    assert result.truncated
+
+
+def test_stream_closes_session_when_done():
+    closed = []
+    stream = ResultStream(rows(10), RowBudget(max_rows=2), on_close=lambda: closed.append(True))
+    list(stream)
+    stream.close()
+    assert closed == [True]
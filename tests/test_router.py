@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+from conftest import StaticDataBase, StaticLLM
+
+from src.llm_query_generator.chat_history import ChatHistory
+from src.llm_query_generator.pipelines import AgentPipeline, DataBaseDescriptor, LexicalRouter
+from src.llm_query_generator.text_index import SparseIndex, tokenize
+
+
+class BrokenDataBase(StaticDataBase):
+    def schema_terms(self):
+        message = "not connected"
+        raise ConnectionError(message)
+
+
+def decision_llm(decision):
+    return StaticLLM(json.dumps(decision))
+
+
+def databases():
+    return [
+        DataBaseDescriptor(
+            "MovieDatabase",
+            "A neo4j database containing information about movies, actors and directors",
+            StaticDataBase(
+                terms=["Movie", "title", "Person", "name", "ACTED_IN", "DIRECTED"],
+                values=["The Matrix", "Keanu Reeves"],
+            ),
+        ),
+        DataBaseDescriptor(
+            "CLEVR",
+            "A neo4j database containing information about underground stations and lines",
+            StaticDataBase(
+                terms=["STATION", "name", "has_rail", "LINE", "EDGE", "line_id"], values=["Cliick On Trent"]
+            ),
+        ),
+    ]
+
+
+def test_tokenize_splits_identifiers_and_adds_ngrams():
+    assert tokenize("ACTED_IN releaseYear") == ["acted", "in", "release", "year"]
+    assert tokenize("Neo", ngram=3) == ["neo", "#<ne", "#neo", "#eo>"]
+
+
+def test_sparse_index_ranks_by_cosine_similarity():
+    index = SparseIndex()
+    index.extend([(1, "underground stations"), (2, "movies and actors"), (3, "actors")])
+    assert [key for key, _ in index.search("Which actors played in movies?", k=2)] == [2, 3]
+    assert index.search("stations")[0][1] > index.search("underground stations near me")[0][1]
+    index.remove(2)
+    assert [key for key, _ in index.search("movies")] == []
+
+
+def test_router_decides_confident_questions_locally():
+    json_llm = decision_llm({"database": "None", "can_answer_from_history": False})
+    pipeline = AgentPipeline(json_llm, json_llm, json_llm, databases(), router=LexicalRouter())
+    assert pipeline.decide("Which movies did Keanu Reeves act in?", ChatHistory()) == {
+        "database": "MovieDatabase",
+        "can_answer_from_history": False,
+    }
+    assert pipeline.decide("Does Cliick On Trent have rail connections?", ChatHistory())["database"] == "CLEVR"
+    assert json_llm.calls == 0
+
+
+def test_router_defers_unclear_questions_and_follow_ups_to_the_llm():
+    json_llm = decision_llm({"database": "None", "can_answer_from_history": True})
+    pipeline = AgentPipeline(json_llm, json_llm, json_llm, databases(), router=LexicalRouter())
+    assert pipeline.decide("What are the health benefits of a Mediterranean diet?", ChatHistory())["database"] == "None"
+    history = ChatHistory().add_user_message("Who played Neo?").add_assistant_message("Keanu Reeves")
+    assert pipeline.decide("Which movies did Keanu Reeves act in?", history)["can_answer_from_history"]
+    assert json_llm.calls == 2
+
+
+def test_router_falls_back_to_the_description_of_unavailable_databases():
+    descriptors = databases()
+    descriptors[1].adapter = BrokenDataBase()
+    router = LexicalRouter().fit(descriptors)
+    assert router.route("Which stations are on the underground line?", descriptors).database == "CLEVR"
+
+
+def test_decide_many_only_asks_the_llm_for_undecided_questions():
+    json_llm = decision_llm({"database": "None", "can_answer_from_history": False})
+    pipeline = AgentPipeline(json_llm, json_llm, json_llm, databases(), router=LexicalRouter())
+    questions = ["Who directed The Matrix?", "Who wrote the play 'Romeo and Juliet'?"]
+    decisions = pipeline.decide_many(questions, [ChatHistory(), ChatHistory()])
+    assert [decision["database"] for decision in decisions] == ["MovieDatabase", "None"]
+    assert json_llm.calls == 1
+
+
+def test_async_decide_uses_the_router():
+    json_llm = decision_llm({"database": "None", "can_answer_from_history": False})
+    pipeline = AgentPipeline(json_llm, json_llm, json_llm, databases(), router=LexicalRouter())
+    decision = asyncio.run(pipeline.adecide("Who directed The Matrix?", ChatHistory()))
+    assert decision["database"] == "MovieDatabase"
+    assert json_llm.calls == 0
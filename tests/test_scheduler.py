@@ -0,0 +1,168 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from conftest import FakeCompletions, StaticLLM
+from openai import InternalServerError, RateLimitError
+
+from src.llm_query_generator.llm import ModelLimits, Priority, RequestScheduler, priority_context
+from src.llm_query_generator.llm.scheduler import TokenBucket, current_priority, estimate_request_tokens, parse_duration
+
+
+def test_parse_duration_of_rate_limit_headers():
+    assert parse_duration("20ms") == 0.02
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("1.5") == 1.5
+    assert parse_duration("soon") is None
+
+
+def test_request_estimate_includes_completion_tokens():
+    assert estimate_request_tokens([{"role": "user", "content": "a" * 40}], max_tokens=100) == 114
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(capacity=10, refill_per_second=5)
+    now = time.monotonic()
+    bucket.consume(10, now)
+    assert bucket.time_until(5, now) == 1.0
+    assert bucket.time_until(5, now + 1) == 0.0
+
+
+def test_interactive_requests_overtake_batch_requests():
+    scheduler = RequestScheduler(default_limits=ModelLimits(requests_per_minute=600, tokens_per_minute=10**6))
+    scheduler.acquire("gpt", 1)
+    scheduler.update_from_headers("gpt", {"x-ratelimit-remaining-requests": "0"})
+    order = []
+
+    async def request(name, priority):
+        await scheduler.aacquire("gpt", 1, priority)
+        order.append(name)
+
+    async def main():
+        batch = asyncio.create_task(request("batch", Priority.BATCH))
+        await asyncio.sleep(0.01)
+        interactive = asyncio.create_task(request("interactive", Priority.INTERACTIVE))
+        await asyncio.gather(batch, interactive)
+
+    asyncio.run(main())
+    assert order == ["interactive", "batch"]
+
+
+def test_limit_headers_resize_the_buckets():
+    scheduler = RequestScheduler(default_limits=ModelLimits(requests_per_minute=1, tokens_per_minute=100))
+    scheduler.acquire("gpt", 100)
+    headers = {
+        "x-ratelimit-limit-requests": "6000",
+        "x-ratelimit-limit-tokens": "600000",
+        "x-ratelimit-remaining-tokens": "599000",
+    }
+    scheduler.update_from_headers("gpt", headers)
+    state = scheduler._state("gpt")
+    assert (state.requests.capacity, state.requests.refill_per_second) == (6000, 100)
+    assert state.tokens.capacity == 600_000
+    assert state.tokens.tokens <= 599_000
+    start = time.monotonic()
+    scheduler.acquire("gpt", 10_000)
+    assert time.monotonic() - start < 0.05
+
+
+def test_backoff_honors_retry_after():
+    scheduler = RequestScheduler()
+    assert scheduler.backoff("gpt", attempt=0, headers={"retry-after-ms": "50"}) == 0.05
+    start = time.monotonic()
+    scheduler.acquire("gpt", 1)
+    assert time.monotonic() - start >= 0.04
+
+
+def test_backoff_without_headers_is_jittered_and_capped():
+    scheduler = RequestScheduler(backoff_base=1, backoff_max=2)
+    delays = [scheduler.backoff(f"gpt-{attempt}", attempt=10) for attempt in range(20)]
+    assert all(0 <= delay <= 2 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+class FlakyCompletions(FakeCompletions):
+    """Fails the first requests with the given error and answers through the raw response API afterwards"""
+
+    def __init__(self, failures, error=RateLimitError, status_code=429):
+        super().__init__("RETURN 1")
+        self.failures = failures
+        self.error = error
+        self.status_code = status_code
+        self.with_raw_response = self
+
+    @property
+    def calls(self):
+        return len(self.requests)
+
+    def create(self, **request):
+        completion = super().create(**request)
+        if self.calls <= self.failures:
+            response = httpx.Response(
+                self.status_code, headers={"retry-after-ms": "1"}, request=httpx.Request("POST", "http://x")
+            )
+            message = "failed"
+            raise self.error(message, response=response, body=None)
+        return SimpleNamespace(headers={"x-ratelimit-remaining-tokens": "1000"}, parse=lambda: completion)
+
+
+def test_openai_adapter_retries_rate_limited_requests(openai_llm):
+    completions = FlakyCompletions(failures=2)
+    llm = openai_llm(completions, scheduler=RequestScheduler(), max_rate_limit_retries=2)
+    assert llm.generate("question") == "RETURN 1"
+    assert completions.calls == 3
+
+
+def test_openai_adapter_retries_server_errors_through_the_scheduler(openai_llm):
+    scheduler = RequestScheduler(backoff_base=0.001)
+    completions = FlakyCompletions(failures=2, error=InternalServerError, status_code=500)
+    llm = openai_llm(completions, scheduler=scheduler, max_transient_retries=2)
+    assert llm.generate("question") == "RETURN 1"
+    assert completions.calls == 3
+
+    completions = FlakyCompletions(failures=3, error=InternalServerError, status_code=500)
+    llm.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    with pytest.raises(InternalServerError):
+        llm.generate("question")
+    assert scheduler._state(llm.model).paused_until == 0.0
+
+
+class RecordingScheduler(RequestScheduler):
+    def __init__(self):
+        super().__init__()
+        self.priorities = []
+
+    def acquire(self, model, tokens, priority=Priority.INTERACTIVE):
+        self.priorities.append(priority)
+        super().acquire(model, tokens, priority)
+
+
+class PriorityLLM(StaticLLM):
+    """Records the priority each request would be scheduled with"""
+
+    def __init__(self):
+        super().__init__("RETURN 1")
+        self.priorities = []
+
+    def chat(self, formatted_history):
+        self.priorities.append(current_priority())
+        return super().chat(formatted_history)
+
+
+def test_priority_context_overrides_the_adapter_priority(openai_llm):
+    scheduler = RecordingScheduler()
+    llm = openai_llm(FlakyCompletions(failures=0), scheduler=scheduler)
+    llm.generate("question")
+    with priority_context(Priority.BATCH):
+        llm.generate("question")
+    llm.generate("question")
+    assert scheduler.priorities == [Priority.INTERACTIVE, Priority.BATCH, Priority.INTERACTIVE]
+
+
+def test_generate_many_sends_batch_requests():
+    llm = PriorityLLM()
+    assert llm.generate_many(["a", "b"]) == ["RETURN 1", "RETURN 1"]
+    llm.generate("c")
+    assert llm.priorities == [Priority.BATCH, Priority.BATCH, None]
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from src.llm_query_generator.db.schema_cache import SchemaCache
+
+
+class CountingLoader:
+    def __init__(self, delay: float = 0.0):
+        self.calls = 0
+        self.delay = delay
+        self.schema = {"node_properties": [], "relationship_properties": [], "relationships": []}
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.schema
+
+
+def test_concurrent_first_requests_load_once():
+    loader = CountingLoader(delay=0.05)
+    cache = SchemaCache(loader)
+    threads = [threading.Thread(target=cache.get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loader.calls == 1
+
+
+def test_refresh_skips_loader_if_fingerprint_is_unchanged():
+    loader = CountingLoader()
+    cache = SchemaCache(loader, fingerprint=lambda: "same", ttl=0.0)
+    cache.get()
+    cache.refresh()
+    assert loader.calls == 1
+    assert cache.version == 1
+
+
+def test_refresh_reloads_if_fingerprint_changed():
+    loader = CountingLoader()
+    fingerprints = iter(["first", "second"])
+    cache = SchemaCache(loader, fingerprint=lambda: next(fingerprints), ttl=0.0)
+    cache.get()
+    loader.schema = {"node_properties": ["changed"], "relationship_properties": [], "relationships": []}
+    assert cache.refresh() == loader.schema
+    assert loader.calls == 2
+    assert cache.version == 2
+
+
+def test_snapshot_is_used_after_restart(tmp_path):
+    snapshot_path = tmp_path / "schema.json"
+    loader = CountingLoader()
+    SchemaCache(loader, snapshot_path=snapshot_path, identity="bolt://localhost:7687").get()
+
+    restarted_loader = CountingLoader()
+    restarted = SchemaCache(restarted_loader, snapshot_path=snapshot_path, identity="bolt://localhost:7687")
+    assert restarted.get() == loader.schema
+    assert restarted_loader.calls == 0
+
+
+def test_snapshot_of_other_database_is_ignored(tmp_path):
+    snapshot_path = tmp_path / "schema.json"
+    SchemaCache(CountingLoader(), snapshot_path=snapshot_path, identity="bolt://localhost:7687").get()
+    other = SchemaCache(CountingLoader(), snapshot_path=snapshot_path, identity="bolt://localhost:7688")
+    assert other.peek() is None
@@ -0,0 +1,89 @@
+from src.llm_query_generator.db import Neo4jAdapter
+from src.llm_query_generator.db.neo4j import build_structured_schema
+from src.llm_query_generator.db.schema_index import SchemaIndex
+
+
+def node_property(label, prop, value_type="STRING"):
+    return {"label": label, "other": [], "elementType": "node", "type": value_type, "property": prop}
+
+
+def relationship(start, rel_type, end):
+    return {"label": start, "other": [end], "elementType": "node", "type": "RELATIONSHIP", "property": rel_type}
+
+
+META_DATA = [
+    node_property("Movie", "title"),
+    node_property("Movie", "released", "INTEGER"),
+    node_property("Person", "name"),
+    node_property("Person", "born", "INTEGER"),
+    node_property("Studio", "name"),
+    node_property("Studio", "founded", "INTEGER"),
+    node_property("Product", "productName"),
+    node_property("Product", "unitPrice", "FLOAT"),
+    node_property("Supplier", "companyName"),
+    relationship("Person", "ACTED_IN", "Movie"),
+    relationship("Studio", "PRODUCED", "Movie"),
+    relationship("Supplier", "SUPPLIES", "Product"),
+    {"label": "ACTED_IN", "other": [], "elementType": "relationship", "type": "LIST", "property": "roles"},
+]
+SAMPLES = [{"label": "Person", "property": "name", "value": "Keanu Reeves"}]
+
+
+def labels(schema):
+    return {node["labels"] for node in schema["node_properties"]}
+
+
+def test_prune_keeps_matching_labels_and_their_neighbours():
+    index = SchemaIndex(build_structured_schema(META_DATA), SAMPLES)
+    schema = index.prune("Which movies did Keanu Reeves act in?")
+    assert labels(schema) == {"Movie", "Person", "Studio"}
+    assert {relationship["type"] for relationship in schema["relationships"]} == {"ACTED_IN", "PRODUCED"}
+    studio = next(node for node in schema["node_properties"] if node["labels"] == "Studio")
+    assert studio["properties"] == [{"property": "name", "type": "STRING"}]
+
+
+def relationship_property(rel_type, prop):
+    return {"label": rel_type, "other": [], "elementType": "relationship", "type": "STRING", "property": prop}
+
+
+def test_prune_keeps_the_properties_of_expanded_relationships():
+    meta_data = [
+        node_property("STATION", "name"),
+        relationship("STATION", "EDGE", "STATION"),
+        relationship_property("EDGE", "line_id"),
+        relationship_property("EDGE", "line_name"),
+    ]
+    samples = [{"label": "STATION", "property": "name", "value": "Spriaords Palace"}]
+    index = SchemaIndex(build_structured_schema(meta_data), samples)
+    question = "How many lines is the station Spriaords Palace on?"
+    assert ("relationship", "EDGE") not in index.match(question)
+    [edge] = index.prune(question)["relationship_properties"]
+    assert [prop["property"] for prop in edge["properties"]] == ["line_id", "line_name"]
+
+
+def test_prune_without_hops_keeps_only_direct_matches():
+    index = SchemaIndex(build_structured_schema(META_DATA), SAMPLES, hops=0)
+    schema = index.prune("What is the unit price of the product Chai?")
+    assert labels(schema) == {"Product"}
+    assert schema["relationships"] == []
+
+
+def test_prune_falls_back_to_the_whole_schema():
+    schema = build_structured_schema(META_DATA)
+    assert SchemaIndex(schema).prune("Tell me a joke") is schema
+
+
+class SampledAdapter(Neo4jAdapter):
+    def sample_values(self, limit=1000):
+        return SAMPLES[:limit]
+
+
+def test_adapter_renders_the_pruned_schema_with_the_question():
+    adapter = SampledAdapter("bolt://localhost:7687", "", "", prune_schema=True)
+    adapter.schema_cache.put(build_structured_schema(META_DATA), "fingerprint")
+    system_message, user_message = adapter.build_prompt_messages("Which movies did Keanu Reeves act in?")
+    assert "Schema:" not in system_message["content"]
+    assert user_message["content"].startswith("Schema:")
+    assert "Person" in user_message["content"]
+    assert "Supplier" not in user_message["content"]
+    assert "Supplier" not in adapter.build_error_prompt("Which movies did Keanu Reeves act in?", "error", "MATCH")
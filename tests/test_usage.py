@@ -0,0 +1,76 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from conftest import FakeCompletions
+
+from src.llm_query_generator.chat_history import ChatHistory
+from src.llm_query_generator.llm import UsageRecord, UsageTracker, tag_stream, usage_context
+from src.llm_query_generator.llm.usage import current_usage_tags
+from src.llm_query_generator.pipelines import AgentPipeline, ChatPipeline, DataBaseDescriptor
+
+
+async def consume(stream):
+    return [item async for item in stream]
+
+
+def record(stage, database, prompt_tokens, *, cached=False):
+    return UsageRecord("gpt", stage, database, prompt_tokens, 10, 0.5, 1.0, cached=cached)
+
+
+def test_usage_context_inherits_outer_tags():
+    with usage_context(database="CLEVR"):
+        with usage_context("repair") as tags:
+            assert (tags.stage, tags.database) == ("repair", "CLEVR")
+    assert current_usage_tags().database is None
+
+
+def test_tag_stream_tags_only_while_producing_chunks():
+    def chunks():
+        yield current_usage_tags().stage
+        yield current_usage_tags().stage
+
+    stream = tag_stream(chunks(), "answer")
+    assert next(stream) == "answer"
+    assert current_usage_tags().stage is None
+    assert list(stream) == ["answer"]
+
+
+def test_tracker_aggregates_by_stage_and_database():
+    tracker = UsageTracker()
+    tracker.record(record("generate", "CLEVR", 1000))
+    tracker.record(record("generate", "CLEVR", 3000))
+    tracker.record(record("generate", "CLEVR", 3000, cached=True))
+    tracker.record(record("decide", None, 200))
+    stats = tracker.summary()[("generate", "CLEVR")]
+    assert (stats.calls, stats.cached_calls, stats.prompt_tokens, stats.mean_prompt_tokens) == (3, 1, 4000, 2000)
+    assert tracker.metrics()[0]["stage"] == "generate"
+    assert tracker.totals().prompt_tokens == 4200
+
+
+def test_openai_adapter_records_provider_usage(openai_llm):
+    tracker = UsageTracker()
+    completions = FakeCompletions(usage=SimpleNamespace(prompt_tokens=120, completion_tokens=3))
+    llm = openai_llm(completions, usage_tracker=tracker)
+    with usage_context("generate", "CLEVR"):
+        llm.generate("question")
+    [usage] = tracker.records
+    assert (usage.stage, usage.database, usage.prompt_tokens, usage.completion_tokens) == ("generate", "CLEVR", 120, 3)
+    assert not usage.estimated
+
+
+def test_agent_pipeline_tags_stages_and_database(static_llm, static_db):
+    json_llm = static_llm(json.dumps({"database": "CLEVR", "can_answer_from_history": False}))
+    query_llm, chat_llm = static_llm("MATCH (n) RETURN n"), static_llm("three")
+    db = static_db([{"count": 3}])
+    pipeline = AgentPipeline(json_llm, chat_llm, query_llm, [DataBaseDescriptor("CLEVR", "", db)])
+    list(pipeline("How many nodes?", ChatHistory()))
+    tags = [(tag.stage, tag.database) for tag in json_llm.tags + query_llm.tags + chat_llm.tags]
+    assert tags == [("decide", None), ("generate", "CLEVR"), ("answer", "CLEVR")]
+
+
+def test_chat_pipeline_tags_the_answer(static_llm):
+    llm = static_llm("hello there")
+    list(ChatPipeline(llm)("hi", ChatHistory()))
+    asyncio.run(consume(ChatPipeline(llm).aforward("hi", ChatHistory())))
+    assert [tag.stage for tag in llm.tags] == ["answer", "answer"]
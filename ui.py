@@ -7,9 +7,9 @@ from typing import List, Tuple
 import gradio as gr
 
 from src.llm_query_generator.chat_history import ChatHistory
-from src.llm_query_generator.db import Neo4jAdapter
-from src.llm_query_generator.llm import OpenAILLM
-from src.llm_query_generator.pipelines import AgentPipeline, DataBaseDescriptor
+from src.llm_query_generator.db import FewShotStore, Neo4jAdapter
+from src.llm_query_generator.llm import CompletionCache, HedgePolicy, OpenAILLM, RequestScheduler, UsageTracker
+from src.llm_query_generator.pipelines import AgentPipeline, DataBaseDescriptor, LexicalRouter, QueryTemplateCache
 
 SYSTEM_PROMPT = "You are a helpfull chat assistant that helps the user answer questions."
 
@@ -32,11 +32,14 @@ RETURN s1.name AS Station, s2.name AS ConnectedStation, s1.has_rail AS HasRail
 
 """
 
+# questions.jsonl written by scripts/clevr/create_graph.py, replaces the static examples with the most similar ones
+CLEVR_FEW_SHOT_CORPUS = os.getenv("CLEVR_FEW_SHOT_CORPUS")
 CLEVR_DB_ADAPTER = Neo4jAdapter(
     uri=os.getenv("CLEVR_DB_URI", "bolt://localhost:7687"),
     user=os.getenv("CLEVR_DB_USERNAME", ""),
     password=os.getenv("CLEVR_DB_PASSWORD", ""),
-    few_shots=FEW_SHOT_EXAMPLES_CLEVR,
+    few_shots=FEW_SHOT_EXAMPLES_CLEVR if CLEVR_FEW_SHOT_CORPUS is None else None,
+    few_shot_store=FewShotStore.from_jsonl(CLEVR_FEW_SHOT_CORPUS) if CLEVR_FEW_SHOT_CORPUS is not None else None,
 )
 MOVIE_DB_ADAPTER = Neo4jAdapter(
     uri=os.getenv("MOVIE_DB_URI", "bolt://localhost:7688"),
@@ -44,14 +47,40 @@ MOVIE_DB_ADAPTER = Neo4jAdapter(
     password=os.getenv("MOVIE_DB_PASSWORD", ""),
 )
 MODEL = os.getenv("OPEN_AI_MODEL", "gpt-4-1106-preview")
-CHAT_LLM = OpenAILLM(api_key=os.environ.get("OPENAI_KEY"), model=MODEL, temperature=0.2, max_tokens=200)
-QUERY_LLM = OpenAILLM(api_key=os.environ.get("OPENAI_KEY"), model=MODEL, temperature=0.0, max_tokens=100)
+SCHEDULER = RequestScheduler()
+USAGE_TRACKER = UsageTracker()
+# hedging duplicates slow requests, which costs extra tokens, so it has to be switched on
+HEDGING = os.getenv("LLM_HEDGING", "off") == "on"
+CHAT_LLM = OpenAILLM(
+    api_key=os.environ.get("OPENAI_KEY"),
+    model=MODEL,
+    temperature=0.2,
+    max_tokens=200,
+    scheduler=SCHEDULER,
+    usage_tracker=USAGE_TRACKER,
+    hedge=HedgePolicy() if HEDGING else None,
+)
+COMPLETION_CACHE = CompletionCache(path=os.getenv("COMPLETION_CACHE_PATH"))
+QUERY_LLM = OpenAILLM(
+    api_key=os.environ.get("OPENAI_KEY"),
+    model=MODEL,
+    temperature=0.0,
+    max_tokens=100,
+    cache=COMPLETION_CACHE,
+    scheduler=SCHEDULER,
+    usage_tracker=USAGE_TRACKER,
+    hedge=HedgePolicy() if HEDGING else None,
+)
 JSON_LLM = OpenAILLM(
     api_key=os.environ.get("OPENAI_KEY"),
     model=MODEL,
     temperature=0.0,
     max_tokens=50,
     response_format={"type": "json_object"},
+    cache=COMPLETION_CACHE,
+    scheduler=SCHEDULER,
+    usage_tracker=USAGE_TRACKER,
+    hedge=HedgePolicy() if HEDGING else None,
 )
 DATA_BASE_DESCRIPTORS = [
     DataBaseDescriptor(
@@ -63,7 +92,15 @@ DATA_BASE_DESCRIPTORS = [
         CLEVR_DB_ADAPTER,
     ),
 ]
-PIPELINE = AgentPipeline(JSON_LLM, CHAT_LLM, QUERY_LLM, DATA_BASE_DESCRIPTORS)
+PIPELINE = AgentPipeline(
+    JSON_LLM,
+    CHAT_LLM,
+    QUERY_LLM,
+    DATA_BASE_DESCRIPTORS,
+    speculation=os.getenv("QUERY_SPECULATION", "off"),
+    router=LexicalRouter(),
+    query_cache=QueryTemplateCache(path=os.getenv("QUERY_TEMPLATE_CACHE_PATH")),
+)
 
 
 def chatbot_response(message: str, history: ChatHistory) -> List[Tuple[str, str]]: